@@ -0,0 +1,159 @@
+"""
+Micro-benchmarks of the functions that run once or more per evaluation.
+
+Every case is timed with timeit (best of --repeat, per call) and its peak
+allocation is measured with tracemalloc. The results can be saved as a
+baseline and later runs compared against it:
+
+    python benchmarks/bench_hotpaths.py --save-baseline
+    python benchmarks/bench_hotpaths.py --compare --threshold 0.2
+
+--compare exits with code 1 when a case is slower (or allocates more) than
+the baseline by more than the threshold (0.2 = 20 %).
+"""
+import argparse
+import json
+import pathlib
+import sys
+import timeit
+import tracemalloc
+
+import numpy as np
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT / "laser"))
+sys.path.append(str(ROOT / "laser_train"))
+import data_processing as data
+import ape_com
+from tools import json_safe
+
+DEFAULT_BASELINE = pathlib.Path(__file__).resolve().parent / "baseline_hotpaths.json"
+
+ACF_POINTS = 10_000
+STRIPES = (5, 10, 20, 40, 80)
+POPULATIONS = (10, 200)
+SLM_W = 1920
+
+
+def synthetic_acf(n=ACF_POINTS, fwhm=0.3, scan_range=50, seed=0):
+    """sech^2-like ACF with noise on a float32 delay axis, as read from the device."""
+    rng = np.random.default_rng(seed)
+    delay = np.linspace(-scan_range / 2, scan_range / 2, n, dtype=np.float32) + 1.3
+    acf = data.sech_squared(delay - 1.3, fwhm * 1000) + 0.01 * rng.random(n)
+    return delay, acf.astype(np.float32)
+
+
+def build_cases():
+    """Return {case name: callable}."""
+    cases = {}
+    rng = np.random.default_rng(0)
+
+    for pd in STRIPES:
+        vec = rng.integers(0, 1024, pd)
+        width = SLM_W // pd
+        cases[f"vec_to_mask[pd={pd}]"] = lambda vec=vec, width=width: data.vec_to_mask(vec, width)
+        half_width = SLM_W // 2 // pd
+        cases[f"vec_to_half_mask[pd={pd}]"] = \
+            lambda vec=vec, width=half_width: data.vec_to_half_mask(vec, width)
+
+    delay, acf = synthetic_acf()
+    # both functions shift the delay axis in place, so they get a fresh copy
+    cases[f"normalize_delay[n={ACF_POINTS}]"] = lambda: data.normalize_delay(delay.copy(), acf)
+    cases[f"calc_pulse_qual[n={ACF_POINTS}]"] = lambda: data.calc_pulse_qual(acf, delay.copy(), 50)
+    for n in POPULATIONS:
+        acfs = [synthetic_acf(seed=i)[1] for i in range(n)]
+        cases[f"calc_pulse_qual[pop={n}]"] = \
+            lambda acfs=acfs: [data.calc_pulse_qual(a, delay.copy(), 50) for a in acfs]
+
+    buffer = np.empty(2 * ACF_POINTS, dtype=np.float32)
+    buffer[0::2], buffer[1::2] = delay, acf
+    cases[f"separate_acf[n={ACF_POINTS}]"] = lambda: ape_com.separate_acf(buffer)
+
+    # read_acf result as the client sends it: separate_acf returns lists of np.float32
+    result = list(ape_com.separate_acf(buffer))
+    cases[f"json_safe[acf n={ACF_POINTS}]"] = lambda: json_safe({"action": "response", "result": result})
+    cases[f"json_safe[array n={ACF_POINTS}]"] = lambda: json_safe([delay, acf])
+    for n in POPULATIONS:
+        pop = rng.integers(0, 1024, (n, 20))
+        cases[f"json_safe[pop={n}]"] = lambda pop=pop: json_safe(list(pop))
+
+    try:
+        import slm_com          # needs SLMFunc.dll (Windows) and a connected SLM
+    except (ImportError, OSError, NameError, AttributeError) as ex:
+        print(f"skipping slm_com.send_mask: {ex!r}")
+    else:
+        mask = data.vec_to_mask(rng.integers(0, 1024, 20), SLM_W // 20)
+        cases["slm_com.send_mask"] = lambda: slm_com.send_mask(mask)
+
+    return cases
+
+
+def measure(func, repeat, min_time):
+    """Return (best seconds per call, peak allocated bytes of one call)."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def run(args):
+    results = {}
+    for name, func in build_cases().items():
+        if args.filter and args.filter not in name:
+            continue
+        seconds, peak = measure(func, args.repeat, args.min_time)
+        results[name] = {"seconds": seconds, "peak_bytes": peak}
+        print(f"{name:40s} {seconds * 1e3:10.3f} ms {peak / 2**20:10.2f} MiB")
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the ratios to the baseline, return the names of the regressed cases."""
+    regressions = []
+    print(f"\n{'case':40s} {'time':>8s} {'memory':>8s}  (ratio to baseline)")
+    for name, res in results.items():
+        if name not in baseline:
+            print(f"{name:40s} {'new':>8s}")
+            continue
+        base = baseline[name]
+        t_ratio = res["seconds"] / base["seconds"]
+        m_ratio = res["peak_bytes"] / max(base["peak_bytes"], 1)
+        flag = ""
+        if t_ratio > 1 + threshold or m_ratio > 1 + threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:40s} {t_ratio:8.2f} {m_ratio:8.2f}{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the per-evaluation hot paths.")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE), help="baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--compare", action="store_true", help="compare the results with the baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative slow-down")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per repeat")
+    parser.add_argument("--filter", default=None, help="run only the cases containing this string")
+    args = parser.parse_args()
+
+    results = run(args)
+
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}")
+            sys.exit(1)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"results": results}, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
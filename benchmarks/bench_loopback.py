@@ -0,0 +1,143 @@
+"""
+End-to-end loopback benchmark of the RemoteMaskEnv <-> laser/client.py loop.
+
+Starts RemoteMaskEnv on localhost and N mock clients (laser/client.py with
+use_mock), drives a fixed number of env steps and writes a JSON report with
+the step latency percentiles, throughput, payload bytes and CPU per step.
+
+Example:
+    python benchmarks/bench_loopback.py --steps 200 --clients 2 \
+        --acquisition 0.01 --inject-delay 0.005 --out loopback.json
+"""
+import argparse
+import json
+import os
+import pathlib
+import platform
+import re
+import resource
+import socket
+import subprocess
+import sys
+import time
+import logging
+
+import numpy as np
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT / "laser_train"))
+from gym_server import RemoteMaskEnv
+from metrics import METRICS
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def metric_total(text, name):
+    """Sum of all the samples of a counter in the Prometheus text."""
+    return sum(float(v) for v in re.findall(rf"^{name}(?:{{[^}}]*}})? (\S+)$", text, re.M))
+
+
+def start_clients(n, port, args):
+    cmd = [sys.executable, str(ROOT / "laser" / "client.py"),
+           "--host", "127.0.0.1", "--port", str(port),
+           "--use_mock", "true", "--verbose", "false",
+           "--settle", str(args.settle),
+           "--mock_acquisition", str(args.acquisition),
+           "--inject_delay", str(args.inject_delay),
+           "--pipelined", str(args.pipelined).lower()]
+    return [subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            for _ in range(n)]
+
+
+def run(args):
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    port = free_port()
+    env = RemoteMaskEnv(host="127.0.0.1", port=port, default_wait=args.poll,
+                        n_stripes=args.stripes)
+    env.reset()
+    clients = start_clients(args.clients, port, args)
+    time.sleep(0.1)
+    for client in clients:
+        if client.poll() is not None:
+            raise RuntimeError(f"client exited with code {client.returncode}")
+    rng = np.random.default_rng(0)
+
+    try:
+        for _ in range(args.warmup):
+            env.step(rng.integers(0, 1024, args.stripes).tolist())
+
+        before = METRICS.render()
+        cpu_server = time.process_time()
+        latencies = []
+        t_start = time.perf_counter()
+        for _ in range(args.steps):
+            action = rng.integers(0, 1024, args.stripes).tolist()
+            t0 = time.perf_counter()
+            env.step(action)
+            latencies.append(time.perf_counter() - t0)
+        wall = time.perf_counter() - t_start
+        cpu_server = time.process_time() - cpu_server
+        after = METRICS.render()
+    finally:
+        for client in clients:
+            client.terminate()
+        for client in clients:
+            client.wait()
+
+    # children are reaped above, so their CPU time is in RUSAGE_CHILDREN
+    # (includes the warmup steps and start-up, an upper bound)
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu_clients = usage.ru_utime + usage.ru_stime
+
+    def delta(name):
+        return metric_total(after, name) - metric_total(before, name)
+
+    lat_ms = np.array(latencies) * 1000
+    return {
+        "config": vars(args),
+        "host": {"python": platform.python_version(), "machine": platform.machine(),
+                 "cpus": os.cpu_count()},
+        "steps": args.steps,
+        "wall_seconds": wall,
+        "throughput_steps_per_s": args.steps / wall,
+        "latency_ms": {
+            "mean": float(lat_ms.mean()),
+            "p50": float(np.percentile(lat_ms, 50)),
+            "p95": float(np.percentile(lat_ms, 95)),
+            "p99": float(np.percentile(lat_ms, 99)),
+            "max": float(lat_ms.max()),
+        },
+        "payload_bytes_per_step": {
+            "request": delta("rpc_request_bytes_total") / args.steps,
+            "response": delta("rpc_response_bytes_total") / args.steps,
+        },
+        "rpc_requests_per_step": delta("rpc_requests_total") / args.steps,
+        "cpu_ms_per_step": {
+            "server": cpu_server * 1000 / args.steps,
+            "clients": cpu_clients * 1000 / (args.steps + args.warmup),
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Loopback throughput benchmark of the RPC step pipeline.")
+    parser.add_argument("--steps", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--clients", type=int, default=1)
+    parser.add_argument("--stripes", type=int, default=20)
+    parser.add_argument("--poll", type=float, default=0.01, help="wait time the server tells idle clients (s)")
+    parser.add_argument("--settle", type=float, default=0.0, help="settle time after send_mask (s)")
+    parser.add_argument("--acquisition", type=float, default=0.0, help="mock ACF acquisition time (s)")
+    parser.add_argument("--inject-delay", type=float, default=0.0, help="delay added to every request (s)")
+    parser.add_argument("--pipelined", action="store_true", help="run the clients in the pipelined mode")
+    parser.add_argument("--out", default="loopback.json", help="JSON report path")
+    args = parser.parse_args()
+
+    report = run(args)
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report["latency_ms"]), f'{report["throughput_steps_per_s"]:.1f} steps/s')
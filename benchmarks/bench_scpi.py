@@ -0,0 +1,120 @@
+"""
+Load benchmark of the pulseCheck receive path against the fake SCPI server.
+
+Starts laser/fake_pulsecheck.py in a background thread and reads ACFs with
+ape_com.read_acf from --connections threads (one ape_device each) for
+--duration seconds. Reports reads/s, MB/s and read latency percentiles.
+With --asyncio the connections are driven from one event loop with the
+asyncio driver (ape_com.read_acf_async).
+
+Example:
+    python benchmarks/bench_scpi.py --connections 4 --chunk-size 1460 --out scpi.json
+"""
+import argparse
+import asyncio
+import json
+import pathlib
+import sys
+import threading
+import time
+
+import numpy as np
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT / "laser"))
+import ape_com
+from fake_pulsecheck import FakePulseCheck, synthetic_source
+
+
+def reader(host, port, duration, latencies, errors):
+    device = ape_com.connect(host, port)
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        t0 = time.perf_counter()
+        try:
+            delay, intensity = ape_com.read_acf(device)
+        except Exception:
+            errors.append(1)
+            continue
+        if len(delay) == 0:
+            errors.append(1)
+            continue
+        latencies.append(time.perf_counter() - t0)
+    ape_com.disconnect(device)
+
+
+async def async_reader(host, port, duration, latencies, errors):
+    device = await ape_com.connect_async(host, port)
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        t0 = time.perf_counter()
+        try:
+            delay, intensity = await ape_com.read_acf_async(device)
+        except Exception:
+            errors.append(1)
+            continue
+        if len(delay) == 0:
+            errors.append(1)
+            continue
+        latencies.append(time.perf_counter() - t0)
+    await device.close()
+
+
+async def run_async(host, port, args, latencies, errors):
+    await asyncio.gather(*(async_reader(host, port, args.duration, latencies, errors)
+                           for _ in range(args.connections)))
+
+
+def run(args):
+    fake = FakePulseCheck(source=synthetic_source(args.points), latency=args.latency,
+                          chunk_size=args.chunk_size, chunk_delay=args.chunk_delay,
+                          error_rate=args.error_rate)
+    host, port = fake.run_in_thread()
+
+    latencies, errors = [], []
+    t0 = time.perf_counter()
+    if args.asyncio:
+        asyncio.run(run_async(host, port, args, latencies, errors))
+    else:
+        threads = [threading.Thread(target=reader, args=(host, port, args.duration, latencies, errors))
+                   for _ in range(args.connections)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    wall = time.perf_counter() - t0
+
+    lat_ms = np.array(latencies) * 1000
+    block_bytes = 8 * args.points
+    return {
+        "config": vars(args),
+        "reads": len(latencies),
+        "errors": len(errors),
+        "reads_per_s": len(latencies) / wall,
+        "mb_per_s": len(latencies) * block_bytes / wall / 1e6,
+        "latency_ms": {
+            "p50": float(np.percentile(lat_ms, 50)),
+            "p95": float(np.percentile(lat_ms, 95)),
+            "p99": float(np.percentile(lat_ms, 99)),
+        } if len(lat_ms) else {},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Receive-path load benchmark against the fake pulseCheck.")
+    parser.add_argument("--connections", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per connection")
+    parser.add_argument("--points", type=int, default=10000)
+    parser.add_argument("--latency", type=float, default=0.0, help="fake acquisition time (s)")
+    parser.add_argument("--chunk-size", type=int, default=None, help="partial packet size (bytes)")
+    parser.add_argument("--chunk-delay", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--asyncio", action="store_true", help="one event loop with the asyncio driver")
+    parser.add_argument("--out", default="scpi.json", help="JSON report path")
+    args = parser.parse_args()
+
+    report = run(args)
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f'{report["reads_per_s"]:.1f} reads/s, {report["mb_per_s"]:.1f} MB/s, '
+          f'{report["errors"]} errors, {report["latency_ms"]}')
@@ -0,0 +1,107 @@
+"""
+Cold-start benchmark: module import times and time to ready.
+
+Every measurement runs in a fresh interpreter (a subprocess), so nothing is
+cached between them:
+- import time of the modules loaded by the lab client, the optimizer and
+  the env (best of --repeat), plus the modules that used to be loaded
+  eagerly (matplotlib, pandas, scipy), for reference;
+- RemoteMaskEnv(): from the constructor call until the first HTTP request
+  is answered;
+- ape_com.connect() to the fake pulseCheck: until *idn? was answered.
+
+Example:
+    python benchmarks/bench_startup.py --repeat 5 --out startup.json
+"""
+import argparse
+import json
+import pathlib
+import subprocess
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+PRELUDE = f"""
+import sys, time
+sys.path[:0] = [{str(ROOT / 'laser')!r}, {str(ROOT / 'laser_train')!r}]
+"""
+
+IMPORTS = {
+    "data_processing": "import data_processing",
+    "ape_com": "import ape_com",
+    "cs": "import cs",
+    "client": "sys.argv = ['client.py']; import client",
+    "gym_server": "import gym_server",
+    # formerly eager dependencies, for reference
+    "matplotlib.pyplot": "import matplotlib.pyplot",
+    "pandas": "import pandas",
+    "scipy.integrate": "import scipy.integrate",
+}
+
+ENV_READY = """
+import logging, socket, requests
+logging.getLogger('werkzeug').setLevel(logging.ERROR)
+with socket.socket() as s:
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+from gym_server import RemoteMaskEnv
+t0 = time.perf_counter()
+env = RemoteMaskEnv(host='127.0.0.1', port=port)
+requests.post(f'http://127.0.0.1:{port}/rpc', json={'action': 'query'}, timeout=5).raise_for_status()
+print(time.perf_counter() - t0)
+"""
+
+DEVICE_READY = """
+import contextlib, io
+from fake_pulsecheck import FakePulseCheck
+import ape_com
+host, port = FakePulseCheck().run_in_thread()
+t0 = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    device = ape_com.connect(host, port)
+print(time.perf_counter() - t0)
+"""
+
+
+def run_snippet(code):
+    """Run the code in a fresh interpreter, return the float it prints last."""
+    out = subprocess.run([sys.executable, "-c", PRELUDE + code], capture_output=True, text=True,
+                         cwd=ROOT / "laser", timeout=120)
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.strip().splitlines()[-1] if out.stderr else "failed")
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def import_time(statement):
+    return run_snippet(f"t0 = time.perf_counter()\n{statement}\nprint(time.perf_counter() - t0)")
+
+
+def best_of(func, arg, repeat):
+    try:
+        return min(func(arg) for _ in range(repeat))
+    except RuntimeError as ex:
+        return str(ex)
+
+
+def run(args):
+    report = {"imports_s": {}, "ready_s": {}}
+    for name, statement in IMPORTS.items():
+        report["imports_s"][name] = best_of(import_time, statement, args.repeat)
+    report["ready_s"]["RemoteMaskEnv"] = best_of(run_snippet, ENV_READY, args.repeat)
+    report["ready_s"]["ape_com.connect"] = best_of(run_snippet, DEVICE_READY, args.repeat)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import-time and time-to-ready benchmark.")
+    parser.add_argument("--repeat", type=int, default=3, help="fresh interpreters per measurement")
+    parser.add_argument("--out", default="startup.json", help="JSON report path")
+    args = parser.parse_args()
+
+    report = run(args)
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    for group, values in report.items():
+        for name, value in values.items():
+            shown = f"{value * 1000:9.1f} ms" if isinstance(value, float) else f"  failed: {value}"
+            print(f"{group:10s} {name:20s} {shown}")
@@ -0,0 +1,181 @@
+'''
+Streaming ACF acquisition into a preallocated ring buffer.
+
+A background thread reads frames from the autocorrelator back to back and
+stores them in a fixed-size ring, each with a sequence number and the
+monotonic time the acquisition started and ended. Instead of sleeping a
+conservative settle time after send_mask and then asking for a new frame,
+the caller asks for the first frame whose acquisition started after the
+mask was displayed (plus the settle time):
+
+    stream = ACFStream(lambda: ape_com.read_acf_arrays(pulseCheck)).start()
+    slm_com.send_mask(mask)
+    frame = stream.first_after(time.monotonic() + settle)
+    delay, intensity = frame.delay, frame.intensity
+
+mean_after() averages several such frames, accumulated in place.
+'''
+
+import threading
+import time
+from collections import namedtuple
+import numpy as np
+
+Frame = namedtuple('Frame', ['seq', 't_start', 't_end', 'delay', 'intensity'])
+
+
+class ACFStream:
+    def __init__(self, read, capacity=32, clock=time.monotonic, error_delay=0.1):
+        '''
+        :param read: callable returning (delay, intensity) of one frame,
+                     e.g. lambda: ape_com.read_acf_arrays(pulseCheck)
+        :param capacity: number of frames kept in the ring
+        :param clock: time source of the timestamps, must be monotonic
+        :param error_delay: pause after a failed read, seconds
+        '''
+        self.read = read
+        self.capacity = capacity
+        self.clock = clock
+        self.error_delay = error_delay
+
+        # allocated on the first frame, when the number of points is known
+        self._delay = None
+        self._intensity = None
+        self._acc = None
+        self._t_start = np.zeros(capacity)
+        self._t_end = np.zeros(capacity)
+        self._seq = np.full(capacity, -1, dtype=np.int64)
+        self.count = 0                  # number of frames acquired so far
+        self.errors = 0
+        self.last_error = None
+
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ------------------------------------------------------------------
+    # Acquisition
+    # ------------------------------------------------------------------
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='acf-stream', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _allocate(self, n_points):
+        self._delay = np.zeros((self.capacity, n_points), dtype=np.float32)
+        self._intensity = np.zeros((self.capacity, n_points), dtype=np.float32)
+        self._acc = np.zeros(n_points, dtype=np.float64)
+
+    def _run(self):
+        while not self._stop.is_set():
+            t_start = self.clock()
+            try:
+                delay, intensity = self.read()
+            except Exception as ex:
+                self.errors += 1
+                self.last_error = ex
+                self._stop.wait(self.error_delay)
+                continue
+            t_end = self.clock()
+            self._store(t_start, t_end, delay, intensity)
+
+    def _store(self, t_start, t_end, delay, intensity):
+        with self._cond:
+            if self._intensity is None or self._intensity.shape[1] != len(intensity):
+                # first frame, or the resolution was changed: start over
+                self._allocate(len(intensity))
+                self._seq[:] = -1
+            slot = self.count % self.capacity
+            self._delay[slot] = delay
+            self._intensity[slot] = intensity
+            self._t_start[slot] = t_start
+            self._t_end[slot] = t_end
+            self._seq[slot] = self.count
+            self.count += 1
+            self._cond.notify_all()
+
+    # ------------------------------------------------------------------
+    # Reading
+    # ------------------------------------------------------------------
+    def _find_after(self, t):
+        '''Slot of the oldest frame in the ring that started at or after t, None if none'''
+        valid = self._seq >= 0
+        candidates = np.flatnonzero(valid & (self._t_start >= t))
+        if len(candidates) == 0:
+            return None
+        return candidates[np.argmin(self._seq[candidates])]
+
+    def _frame(self, slot):
+        return Frame(int(self._seq[slot]), float(self._t_start[slot]), float(self._t_end[slot]),
+                     self._delay[slot].copy(), self._intensity[slot].copy())
+
+    def _wait_for(self, predicate, timeout):
+        '''Waits (holding the lock) until predicate() is not None, returns its value'''
+        deadline = None if timeout is None else self.clock() + timeout
+        while True:
+            value = predicate()
+            if value is not None:
+                return value
+            remaining = None if deadline is None else deadline - self.clock()
+            if remaining is not None and remaining <= 0:
+                raise TimeoutError(f'[ACFStream] no frame in {timeout} s (last error: {self.last_error!r})')
+            self._cond.wait(remaining)
+
+    def latest(self, timeout=None):
+        '''
+        Returns the most recent frame (a copy), waits for the first one if needed
+        '''
+        with self._cond:
+            self._wait_for(lambda: self.count or None, timeout)
+            return self._frame((self.count - 1) % self.capacity)
+
+    def first_after(self, t, timeout=None):
+        '''
+        Returns the first frame whose acquisition started at or after t.
+        If the ring has wrapped since t, the oldest frame still held is returned
+        (it also started after t).
+        :param t: time on the stream's clock (time.monotonic by default)
+        :param timeout: seconds to wait for such a frame, None waits forever
+        :return: Frame (copies of the arrays)
+        '''
+        with self._cond:
+            return self._frame(self._wait_for(lambda: self._find_after(t), timeout))
+
+    def mean_after(self, t, n, timeout=None):
+        '''
+        Averages the first n frames whose acquisition started at or after t.
+        The frames are accumulated in place, no frame is copied.
+        :param n: number of frames, at most the capacity of the ring
+        :return: Frame with the seq/t_start of the first and t_end of the last frame
+        '''
+        if not 0 < n <= self.capacity:
+            raise ValueError(f'n must be in 1..{self.capacity}')
+
+        def ready():
+            slot = self._find_after(t)
+            if slot is None or self.count - self._seq[slot] < n:
+                return None
+            return slot
+
+        with self._cond:
+            first = self._wait_for(ready, timeout)
+            self._acc[:] = 0
+            for i in range(n):
+                np.add(self._acc, self._intensity[(first + i) % self.capacity], out=self._acc)
+            self._acc /= n
+            last = (first + n - 1) % self.capacity
+            return Frame(int(self._seq[first]), float(self._t_start[first]), float(self._t_end[last]),
+                         self._delay[first].copy(), self._acc.astype(np.float32))
@@ -11,6 +11,14 @@ import re
 device_dns_name = "pulsecheck-S09797"
 tcp_port = 5025
 
+# SCPI commands used to change the acquisition settings. The values are
+# formatted into the command as they are passed to set_acquisition().
+ACQUISITION_COMMANDS = {
+    'scan_range': 'SENSE:RANGE {}',         # scan range in ps
+    'resolution': 'SENSE:RESOLUTION {}',    # number of points per scan
+    'averaging': 'SENSE:AVERAGE {}',        # number of averaged scans
+}
+
 def separate_acf(buffer):
     even_list = []
     odd_list = []
@@ -32,6 +40,98 @@ def read_acf(pulseCheck):
     delay, intensity = separate_acf(acf)
     return delay, intensity
 
+def read_acf_arrays(pulseCheck):
+    '''
+    Same as read_acf, but returns numpy arrays (views of the received buffer)
+    instead of lists, for the streaming acquisition (acf_stream.ACFStream)
+    :return: delay, intensity (float32)
+    '''
+    acf = np.frombuffer(bytes(pulseCheck.query("CALCULATE:DATA:ALL?", True)), dtype=np.float32)
+    return acf[0::2], acf[1::2]
+
+def get_acquisition(pulseCheck):
+    '''
+    Returns the cached acquisition settings of the device
+    :param pulseCheck: device returned by connect()
+    :return: dict with the last settings sent to the device
+    '''
+    if not hasattr(pulseCheck, 'acquisition'):
+        pulseCheck.acquisition = {}
+    return pulseCheck.acquisition
+
+def set_acquisition(pulseCheck, **settings):
+    '''
+    Changes the acquisition settings (scan_range, resolution, averaging).
+    The device state is cached, so only the settings that differ from the
+    last ones sent are written to the device. None values are ignored.
+    :param pulseCheck: device returned by connect()
+    :param settings: settings to apply, keys from ACQUISITION_COMMANDS
+    :return: dict with the settings that were actually sent
+    '''
+    state = get_acquisition(pulseCheck)
+    changed = {}
+    for key, value in settings.items():
+        if key not in ACQUISITION_COMMANDS:
+            raise ValueError(f'Unknown acquisition setting: {key}')
+        if value is None or state.get(key) == value:
+            continue
+        pulseCheck.send(ACQUISITION_COMMANDS[key].format(value))
+        state[key] = value
+        changed[key] = value
+
+    if changed:
+        try:
+            pulseCheck.checkStatus()
+        except Exception:
+            # the device state is unknown now, force a resend next time
+            state.clear()
+            raise
+    return changed
+
+async def read_acf_async(device, check_status=True):
+    '''
+    Reads the ACF with the asyncio driver (ape_device_async.AsyncApeDevice).
+    The status check and the data read are pipelined in a single round trip.
+    :param device: connected AsyncApeDevice
+    :param check_status: read *stb? with the data and raise on device errors
+    :return: delay, intensity
+    '''
+    if check_status:
+        status, acf_binary_data = await device.pipeline([("*stb?", False), ("CALCULATE:DATA:ALL?", True)])
+        await device.check_status(int(status))
+    else:
+        acf_binary_data = await device.query("CALCULATE:DATA:ALL?", True)
+    acf = np.frombuffer(bytes(acf_binary_data), dtype=np.float32)
+    delay, intensity = separate_acf(acf)
+    return delay, intensity
+
+async def read_acfs_async(devices, check_status=True):
+    '''
+    Reads the ACFs of several autocorrelators concurrently
+    :param devices: list of connected AsyncApeDevice
+    :return: list of (delay, intensity), in the order of devices
+    '''
+    import asyncio
+
+    return await asyncio.gather(*(read_acf_async(device, check_status) for device in devices))
+
+async def connect_async(device_dns_name, tcp_port):
+    '''
+    Opens an asyncio connection to the device, see connect()
+    :return: connected AsyncApeDevice
+    '''
+    import ape_device_async
+
+    device = ape_device_async.AsyncApeDevice(device_dns_name, tcp_port)
+    idn = await device.connect()
+    print("Device identification: {}\n".format(idn))
+    if re.findall('(mini|pulselink)', idn.lower()) != []:
+        await device.close()
+        raise Exception(
+            'Error. The specified connection details point to an APE miniUSB or pulseLink USB device.\n'
+            'This script is not compatible with these devices.')
+    return device
+
 def disconnect(pulseCheck):
     # Close the TCP connection
     if type(pulseCheck) is not None:
@@ -49,7 +149,7 @@ def connect(device_dns_name, tcp_port):
         try:
             #Read device identification
             idn = pulseCheck.idn()
-            print("Device identification: {}\n".format(pulseCheck.idn()))
+            print("Device identification: {}\n".format(idn))
 
             # Check if the connected device is a pulseCheckNX, not an older pulseCheck USB
             # (Older devices use different data types and commands)
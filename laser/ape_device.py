@@ -84,16 +84,52 @@ class ape_device:
                 self.dev.settimeout(self.timeout)
                 self.dev.connect((self.host, self.port))
                 self.connected = True
-                time.sleep(1)
+                self._waitReady()
                 print('Connected to: ' + self.host + ':' + str(self.port))
                 print('--------------------------------------------')
 
+            except (TimeoutError, ConnectionError):
+                # from _waitReady, keep its specific message
+                raise
             except socket.gaierror:
                 self.connected = False
                 self.dev = None
                 raise Exception(
                     'Error. Unable to open TCP connection to the specified remote host. Please make sure the specified connection details.')
 
+    def _waitReady(self, ready_timeout=5.0, quiet=0.05):
+        '''
+        Waits until the device answers *idn? (instead of a fixed 1 s sleep).
+        The probe is sent once and its reply awaited until ready_timeout, then
+        whatever else is pending is drained, so no late reply shifts the
+        replies of the later queries.
+        '''
+        deadline = time.time() + ready_timeout
+        self.send("*idn?")
+        reply = bytearray()
+        while not reply.endswith(b'\n') or not reply.strip(b'\x00\r\n'):
+            if reply.endswith(b'\n'):
+                reply = bytearray()             # an empty line, keep waiting
+            remaining = deadline - time.time()
+            if remaining <= 0 or not select([self.dev], [], [], remaining)[0]:
+                self._closeSocket()
+                raise TimeoutError('[Connect] Error. The device did not answer *idn? in '
+                                   + str(ready_timeout) + ' s')
+            chunk = self.dev.recv(1)
+            if not chunk:
+                self._closeSocket()
+                raise ConnectionError('[Connect] Error. Connection closed while waiting for *idn?')
+            reply.extend(chunk)
+        # drain the stray bytes still arriving
+        while select([self.dev], [], [], quiet)[0]:
+            if not self.dev.recv(4096):
+                break
+
+    def _closeSocket(self):
+        self.dev.close()
+        self.connected = False
+        self.dev = None
+
     def disconnect(self):
         if not self.connected:
             raise Exception('[Disconnect] Not connected')
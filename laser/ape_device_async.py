@@ -0,0 +1,205 @@
+'''
+Asyncio driver for the APE pulseCheck, alongside the blocking ape_device.
+
+- built on asyncio.open_connection, one event loop can drive several devices
+- pipeline() sends several commands at once and reads the replies in order,
+  e.g. a status check and the data read in a single round trip
+- connect() waits for the device to answer *idn? instead of a fixed sleep
+- a dropped connection is re-opened and the command retried transparently
+'''
+
+import asyncio
+import re
+
+
+def resolve_host(host):
+    '''
+    Resolves the optional interface ident (e.g. "pulseCheck-S09797%usb"),
+    same rules as ape_device.connect
+    '''
+    check_interface = re.compile(r'(\w+-)?(S\d{5})%(usb|USB|eth|ETH|lan|LAN)', re.IGNORECASE)
+    matcher = check_interface.match(host)
+    if not matcher:
+        return host
+    product = matcher.group(1).lower()[:-1] if matcher.group(1) else ""
+    serial = matcher.group(2)
+    interface = matcher.group(3).lower()
+    if product not in ("", "pulsecheck"):
+        return host
+    if interface == "lan":
+        return product + '-' + serial if product else serial
+    if interface == "usb":
+        return "169.254." + str(int(serial[2:4])) + "." + str(int(serial[4:6]))
+    return "169.254.1" + str(int(serial[2:4])) + "." + str(int(serial[4:6]))
+
+
+class AsyncApeDevice:
+    def __init__(self, host="127.0.0.1", port=5025, name="APEDevice", timeout=5.0,
+                 ready_timeout=5.0, retries=1):
+        '''
+        :param host: host name or IP, optionally with the interface ident
+        :param port: TCP port
+        :param timeout: timeout of a single reply, seconds
+        :param ready_timeout: how long connect() waits for the device to answer *idn?
+        :param retries: how many times a command is retried after a reconnect
+        '''
+        self.host = resolve_host(host)
+        self.port = port
+        self.name = name
+        self.timeout = timeout
+        self.ready_timeout = ready_timeout
+        self.retries = retries
+        self.reader = None
+        self.writer = None
+        self._lock = asyncio.Lock()
+        self._idn = None
+
+    @property
+    def connected(self):
+        return self.writer is not None and not self.writer.is_closing()
+
+    async def connect(self):
+        '''
+        Opens the connection and waits until the device answers *idn?. The probe
+        is sent once and its reply awaited until ready_timeout, only a socket
+        error re-opens the connection and probes again.
+        '''
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.ready_timeout
+        while True:
+            try:
+                self.reader, self.writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), self.timeout)
+                self.writer.write(b'*idn?\r\n')
+                await self.writer.drain()
+                while True:
+                    line = await asyncio.wait_for(self.reader.readline(), max(deadline - loop.time(), 0))
+                    if not line:
+                        raise ConnectionError('[Connect] Connection closed')
+                    self._idn = line.replace(b'\x00', b'').decode().strip()
+                    if self._idn:
+                        break
+                await self._discard_pending()
+                return self._idn
+            except asyncio.TimeoutError:
+                await self.close()
+                raise ConnectionError(f'[Connect] {self.host}:{self.port} did not answer *idn?')
+            except (ConnectionError, OSError):
+                await self.close()
+                if loop.time() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+
+    async def _discard_pending(self, quiet=0.05):
+        '''Drops the lines still buffered or arriving within `quiet` seconds'''
+        while True:
+            try:
+                line = await asyncio.wait_for(self.reader.readline(), quiet)
+            except asyncio.TimeoutError:
+                return
+            if not line:
+                raise ConnectionError('[Connect] Connection closed')
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+        self.reader = self.writer = None
+
+    async def reconnect(self):
+        await self.close()
+        return await self.connect()
+
+    # ------------------------------------------------------------------
+    # Replies
+    # ------------------------------------------------------------------
+    async def _read_line(self):
+        line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+        if not line:
+            raise ConnectionError('[Receive] Connection closed')
+        return line.replace(b'\x00', b'').decode().rstrip()
+
+    async def _read_block(self):
+        '''Reads a definite-length block #<n><len><data>\\n, returns the data'''
+        async def read():
+            if await self.reader.readexactly(1) != b'#':
+                await self.reader.readline()
+                return bytearray()
+            header_len = int(await self.reader.readexactly(1))
+            data_len = int(await self.reader.readexactly(header_len)) if header_len else 0
+            data = await self.reader.readexactly(data_len) if data_len > 0 else b''
+            await self.reader.readline()            # trailing newline
+            return bytearray(data)
+        return await asyncio.wait_for(read(), self.timeout)
+
+    # ------------------------------------------------------------------
+    # Commands
+    # ------------------------------------------------------------------
+    async def pipeline(self, commands):
+        '''
+        Sends all the commands at once, then reads their replies in order.
+        :param commands: list of (command, block) tuples; block=True reads a
+                         definite-length block, block=None means no reply
+                         (setting commands)
+        :return: list of replies (str or bytearray), None for no reply
+        '''
+        payload = ''.join(command.rstrip() + '\r\n' for command, _ in commands).encode()
+        async with self._lock:
+            for attempt in range(self.retries + 1):
+                try:
+                    if not self.connected:
+                        await self.connect()
+                    self.writer.write(payload)
+                    await self.writer.drain()
+                    replies = []
+                    for _, block in commands:
+                        if block is None:
+                            replies.append(None)
+                        elif block:
+                            replies.append(await self._read_block())
+                        else:
+                            replies.append(await self._read_line())
+                    return replies
+                except (ConnectionError, OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    if attempt == self.retries:
+                        raise
+                    await self.reconnect()
+
+    async def query(self, command, block=False):
+        return (await self.pipeline([(command, block)]))[0]
+
+    async def send(self, command):
+        await self.pipeline([(command, None)])
+
+    async def idn(self):
+        return await self.query('*idn?')
+
+    async def stb(self):
+        return int(await self.query('*stb?'))
+
+    async def esr(self):
+        return int(await self.query('*esr?'))
+
+    async def next_error(self):
+        return await self.query('syst:err?')
+
+    async def check_status(self, status=None):
+        '''
+        Same as ape_device.checkStatus, raises if the device reports errors
+        :param status: already read status byte (e.g. from a pipeline), None reads it
+        '''
+        if status is None:
+            status = await self.stb()
+        if (status & 36) > 0:
+            errors = ''
+            check_status = status
+            while (check_status & 36) > 0:
+                await self.esr()
+                if (check_status & 4) > 0:
+                    errors = errors + await self.next_error() + '\r\n'
+                check_status = await self.stb()
+            raise Exception('[CheckStatus] Error(s) from Device:\r\n' + errors)
+        return True
@@ -2,60 +2,240 @@
 Client that follows the original polling protocol but now automatically waits
 5 seconds and retries whenever it fails to get a **valid** response from the
 server (network error, timeout, non‑2xx status, or invalid JSON).
+
+With `pipelined: true` the network and the hardware work overlap: a fetcher
+thread prefetches (and renders) up to `prefetch` tasks, the main thread runs
+them on the devices in order and an uploader thread posts the results in the
+same order. Tasks are executed once, duplicates (by task_id) are dropped.
 """
 import sys
+import gzip
+import pathlib
+import random
+import logging
+import zlib
 import requests
+from requests.adapters import HTTPAdapter
 import time
 import argparse
 import json
+import queue
+import numpy as np
+import threading
+from collections import deque
+from contextlib import contextmanager
 
 
-sys.path.append('../laser_train')
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent / 'laser_train'))
 from tools import parse_with_config_file, json_safe
+from metrics import timed
+from tracing import TRACER, ClockSync, now_us
+
+# Phase timings (seconds) and counters collected since the last response.
+# They are piggy-backed on the next response and reset.
+TIMINGS = {}
+COUNTS = {}
+# guards TIMINGS and COUNTS, the pipelined workers update them concurrently
+STATS_LOCK = threading.Lock()
+# id of the task being executed, used as the trace id of the spans
+CURRENT = {"task_id": None}
+CLOCK = ClockSync()
+
+log = logging.getLogger("laser.client")
+
+
+@contextmanager
+def phase(name, trace_name=None, task_id=None):
+    """Time a phase of the task (metrics) and record it on the timeline (tracing).
+
+    task_id defaults to the task being executed.
+    """
+    trace_id = CURRENT["task_id"] if task_id is None else task_id
+    elapsed = {}
+    try:
+        with timed(elapsed, name), TRACER.span(trace_name or name, trace_id=trace_id):
+            yield
+    finally:
+        # added at the end, the stats may have been taken in the meantime
+        with STATS_LOCK:
+            TIMINGS[name] = TIMINGS.get(name, 0.0) + elapsed.get(name, 0.0)
+
+
+def count(name, value=1):
+    """Increment a counter reported with the next response."""
+    with STATS_LOCK:
+        COUNTS[name] = COUNTS.get(name, 0) + value
 
 # ---------------------------------------------------------------------------
 # Functions the client is willing to execute
 # ---------------------------------------------------------------------------
 
 USE_MOCK = True
+DISPATCH = {}
 
-if USE_MOCK:
-    from mock import read_acf, send_mask
-else:
-    from slm_com import send_mask, connect
-    import ape_com as ape
-    from data_processing import vec_to_mask
 
-    def read_acf(arg):
-        delay, intensity = ape.read_acf(pulseCheck)
-        return [delay, intensity]
+def setup_dispatch(args):
+    """Fill DISPATCH with the mock functions or connect to the real devices."""
+    global USE_MOCK, vec_to_mask
+    USE_MOCK = args.use_mock
+
+    if USE_MOCK:
+        import mock
+        from mock import read_acf, send_mask
+        mock.ACQUISITION_TIME = args.mock_acquisition
+    else:
+        from slm_com import send_mask, connect
+        import ape_com as ape
+        from data_processing import vec_to_mask
+
+        connect()
+        device_dns_name = "pulsecheck-S09797"
+        tcp_port = 5025
+        scan_range = 50
+
+        pulseCheck = ape.connect(device_dns_name, tcp_port)
+
+        if args.acf_stream:
+            # frames are acquired continuously, read_acf takes the first one
+            # acquired after the mask was displayed + settle
+            from acf_stream import ACFStream
+            stream = ACFStream(lambda: ape.read_acf_arrays(pulseCheck)).start()
+            displayed = {"t": 0.0}
+            show_mask = send_mask
 
-DISPATCH = {f.__name__: f for f in [send_mask, read_acf]}
+            def send_mask(mask):
+                show_mask(mask)
+                displayed["t"] = time.monotonic()
+
+            def read_acf(arg):
+                with phase("read_acf", "acf_stream.first_after"):
+                    frame = stream.first_after(displayed["t"] + args.settle, timeout=30)
+                return [frame.delay, frame.intensity]
+        else:
+            def read_acf(arg):
+                with phase("read_acf", "ape_com.read_acf"):
+                    delay, intensity = ape.read_acf(pulseCheck)
+                return [delay, intensity]
+
+    DISPATCH.update({f.__name__: f for f in [send_mask, read_acf]})
 
 # ---------------------------------------------------------------------------
 # Helper that POSTS and keeps retrying until it gets a usable JSON reply
 # ---------------------------------------------------------------------------
 
+SESSION = None
+SERVER_URL = None
+COMPRESS = {"gzip": lambda b: gzip.compress(b, compresslevel=1), "deflate": zlib.compress}
+
+
+def setup_session(args):
+    """Open the pooled keep-alive HTTP session used by post_retry."""
+    global SESSION, SERVER_URL
+    SERVER_URL = f"http://{args.host}:{args.port}/{args.endpoint}"
+    SESSION = requests.Session()
+    # the pipelined mode posts from two threads at once
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0)
+    SESSION.mount("http://", adapter)
+    SESSION.mount("https://", adapter)
+    SESSION.headers.update({"Content-Type": "application/json"})
+
+
+def encode_body(args, payload):
+    """Serialize the payload, compressed when it is larger than compress_min_bytes."""
+    body = json.dumps(payload).encode()
+    if args.compress in COMPRESS and len(body) >= args.compress_min_bytes:
+        return COMPRESS[args.compress](body), {"Content-Encoding": args.compress}
+    return body, None
+
+
+def backoff(args, attempt):
+    """Exponential backoff with jitter: retry_delay * 2^attempt, capped, scaled by 0.5..1."""
+    delay = min(args.retry_max_delay, args.retry_delay * 2 ** attempt)
+    return delay * random.uniform(0.5, 1.0)
+
+
 def post_retry(args, action, **kw):
     """POST to SERVER_URL, returning the JSON body.
-    If the request fails or the response is invalid, wait RETRY_DELAY seconds
-    and try again. This satisfies the new requirement.
+    If the request fails or the response is invalid, back off (exponentially,
+    with jitter) and try again.
     """
+    if SESSION is None:
+        setup_session(args)
+    attempt = 0
     while True:
-        server_url = f"http://{args.host}:{args.port}/{args.endpoint}"
         try:
-            print(f'Type: {type(kw)}, keys: {kw.keys()}')
+            log.debug("POST %s, keys: %s", action, kw.keys())
+            with phase("http", f"http.{action}", kw.get("task_id")):
+                if args.inject_delay:
+                    time.sleep(args.inject_delay)   # simulated network latency
+                t_send = now_us()
+                body, headers = encode_body(args, json_safe({"action": action, **kw}))
+                resp = SESSION.post(SERVER_URL, data=body, headers=headers,
+                                    timeout=(args.connect_timeout, args.read_timeout))
+                resp.raise_for_status()
+                body = resp.json()  # may raise ValueError if body isn't JSON
+            if "server_time" in body:
+                CLOCK.add(t_send, *body["server_time"], now_us())
+            return body
+        except (requests.exceptions.RequestException, ValueError) as err:
+            count("retries")
+            delay = backoff(args, attempt)
+            attempt += 1
+            log.warning("⚠️  no valid response (%s); retrying in %.2fs", err, delay)
+            time.sleep(delay)
 
 
-            payload = json_safe({"action": action, **kw})
-            resp = requests.post(server_url, json=payload, timeout=30)
-            resp.raise_for_status()
-            return resp.json()  # may raise ValueError if body isn't JSON
-        except (requests.exceptions.RequestException, ValueError) as err:
-            print(f"⚠️  no valid response ({err}); retrying in {args.retry_delay}s")
-            time.sleep(args.retry_delay)
+def take_stats():
+    """Return the timings and counters collected so far and reset them."""
+    global TIMINGS, COUNTS
+    with STATS_LOCK:
+        timings, TIMINGS = TIMINGS, {}
+        counts, COUNTS = COUNTS, {}
+    return timings, counts
+
+
+def take_trace():
+    """Return the recorded trace events with the clock offset, None if tracing is off."""
+    if not TRACER.enabled:
+        return None
+    return {"events": TRACER.take(), "offset_us": CLOCK.offset_us}
+
+
+def prepare(func_name, func_args, task_id=None):
+    """Build the device call arguments of a task (renders the mask of send_mask).
+
+    The send_mask argument is a list of stripe values, or a dict
+    {"basis": kind, "coeffs": [...]} of a parametric phase mask (phase_basis.py).
+    """
+    if func_name != "send_mask":
+        return func_args
+    with phase("render", "data_processing.vec_to_mask", task_id):
+        if isinstance(func_args, dict):
+            from phase_basis import coeffs_to_mask
+            mask = coeffs_to_mask(func_args["coeffs"], func_args["basis"])
+            return [mask[0] if USE_MOCK else np.ascontiguousarray(mask)]
+        if USE_MOCK:
+            return [func_args]
+        return [vec_to_mask(func_args, int(1920/len(func_args)))]
 
 
+def execute(args, func_name, func_args):
+    """Run a prepared task on the devices, return its result (or the error)."""
+    func = DISPATCH[func_name]
+    try:
+        if func_name == "send_mask":
+            with phase("send_mask", "slm_com.send_mask"):
+                result = func(*func_args)
+            if not args.acf_stream:     # the stream waits for a post-settle frame itself
+                with phase("settle"):
+                    time.sleep(args.settle)
+        else:
+            with phase(func_name):
+                result = func(*func_args)
+    except Exception as ex:
+        result = f"error: {ex!r}"
+        log.error("%s failed: %s", func_name, result)
+    return result
 
 
 # ---------------------------------------------------------------------------
@@ -64,50 +244,109 @@ def post_retry(args, action, **kw):
 
 def main(args):
 
+    reply = post_retry(args, "query")
     while True:
-        reply = post_retry(args, "query") 
         kind, server_args = reply.get("action"), reply.get("args", [])
 
         if kind == "wait":
             (n,) = server_args
-            if args.verbose:
-                print(f"⏳ waiting {n}s")
-            time.sleep(n)
-            reply = post_retry(args, "query") 
+            log.info("⏳ waiting %ss", n)
+            with phase("poll_sleep"):
+                time.sleep(n)
+            reply = post_retry(args, "query")
 
         elif kind == "execute":
             func_name, func_args = server_args
+            CURRENT["task_id"] = reply.get("task_id")
             func = DISPATCH.get(func_name)
             if func is None:
-                if args.verbose:
-                    print(f"⚠️  unknown function '{func_name}' – skipping")
+                log.info("⚠️  unknown function '%s' – skipping", func_name)
                 time.sleep(1)
+                reply = post_retry(args, "query")
                 continue
 
-            if args.verbose:
-                print(f"▶️  executing {func_name}{tuple(func_args)}")
+            log.info("▶️  executing %s%r", func_name, func_args)
 
-            if func_name == "send_mask":
-                if USE_MOCK:
-                    func_args = [func_args]
-                else:
-                    func_args = [vec_to_mask(func_args, int(1920/len(func_args)))]
-                print (func_args)
-            try:
-                result = func(*func_args)
-            except Exception as ex:
-                result = f"error: {ex!r}"
-                print(f'EROOR: {result}')
+            result = execute(args, func_name, prepare(func_name, func_args))
 
             # Step 4 & 5 – send the result and instantly get next directive
-            result = func(*func_args)
-            reply  = post_retry(args, "response", result=result)           
+            timings, counts = take_stats()
+            reply  = post_retry(args, "response", result=result, task_id=CURRENT["task_id"],
+                                timings=timings, counts=counts, trace=take_trace())
+            CURRENT["task_id"] = None
 
             # loop continues with the new reply on the next iteration
 
         else:
-            if args.verbose:
-                print(f"⚠️  unknown directive: {reply}")
+            log.info("⚠️  unknown directive: %s", reply)
+            time.sleep(args.retry_delay)
+            reply = post_retry(args, "query")
+
+
+# ---------------------------------------------------------------------------
+# Pipelined mode
+# ---------------------------------------------------------------------------
+
+def fetcher(args, tasks):
+    """Network worker: prefetches the tasks and renders them ahead of the devices."""
+    seen = deque(maxlen=1024)
+    while True:
+        # ask for as many tasks as there are free prefetch slots
+        reply = post_retry(args, "query", max_tasks=max(1, tasks.maxsize - tasks.qsize()))
+        kind, server_args = reply.get("action"), reply.get("args", [])
+
+        if kind == "wait":
+            (n,) = server_args
+            with phase("poll_sleep"):
+                time.sleep(min(n, args.poll_interval))
+            continue
+        if kind == "execute":
+            batch = [reply]
+        elif kind == "batch":
+            batch = reply["tasks"]
+        else:
+            log.info("⚠️  unknown directive: %s", reply)
+            time.sleep(args.retry_delay)
+            continue
+
+        for task in batch:
+            func_name, func_args = task["args"]
+            task_id = task.get("task_id")
+            if task_id is not None:
+                if task_id in seen:
+                    count("duplicate_tasks")
+                    continue
+                seen.append(task_id)
+            if func_name not in DISPATCH:
+                log.info("⚠️  unknown function '%s' – skipping", func_name)
+                continue
+            # blocks while `prefetch` tasks are already waiting for the devices
+            tasks.put((task_id, func_name, prepare(func_name, func_args, task_id)))
+
+
+def uploader(args, results):
+    """Network worker: posts the results in the order they were produced."""
+    while True:
+        task_id, result = results.get()
+        timings, counts = take_stats()
+        # next=False: the reply must not carry a task, the fetcher gets them
+        post_retry(args, "response", result=result, task_id=task_id, next=False,
+                   timings=timings, counts=counts, trace=take_trace())
+
+
+def main_pipelined(args):
+    tasks = queue.Queue(maxsize=max(1, args.prefetch))
+    results = queue.Queue()
+    threading.Thread(target=fetcher, args=(args, tasks), daemon=True).start()
+    threading.Thread(target=uploader, args=(args, results), daemon=True).start()
+
+    while True:
+        task_id, func_name, func_args = tasks.get()
+        CURRENT["task_id"] = task_id
+        log.info("▶️  executing %s (task %s)", func_name, task_id)
+        result = execute(args, func_name, func_args)
+        results.put((task_id, result))
+        CURRENT["task_id"] = None
 
 
 if __name__ == "__main__":
@@ -121,15 +360,16 @@ if __name__ == "__main__":
         help="List of named configs from configs.yaml to load."
     )
 
-    if not USE_MOCK:
-        connect()
-        device_dns_name = "pulsecheck-S09797"
-        tcp_port = 5025
-        scan_range = 50
-
-        pulseCheck = ape.connect(device_dns_name, tcp_port)
-
     try:
-        main(parse_with_config_file(parser, defaults_name="defaults"))
+        args = parse_with_config_file(parser, defaults_name="defaults")
+        logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                            format="%(asctime)s %(levelname)s %(message)s")
+        setup_dispatch(args)
+        if args.trace:
+            TRACER.enable("lab client")
+        if args.pipelined:
+            main_pipelined(args)
+        else:
+            main(args)
     except KeyboardInterrupt:
         print("\nclient stopped")
@@ -1,21 +1,38 @@
 import ape_com as ape
-import slm_com as slm
 import data_processing as data
+import phase_basis
 import numpy as np
-import pandas
 import time
 import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-def init(N, pd, lb, ub):
+# Acquisition settings for the multi-fidelity evaluation. 'coarse' is used to
+# screen a whole generation, 'full' only for the masks that get promoted.
+FIDELITIES = {
+    'coarse': {'scan_range': 20, 'resolution': 1000, 'averaging': 1, 'settle': 0.3},
+    'full': {'scan_range': 50, 'resolution': 10000, 'averaging': 4, 'settle': 1},
+}
+
+# bench_io drives the one SLM of slm_com for every hardware pulseCheck, the
+# evaluators of the hardware take turns on it (see make_evaluator)
+SLM_LOCK = threading.Lock()
+
+def init(N, pd, lb, ub, seeds=None):
     '''
     Initialize the flock
     :param N: Flock (population) size
     :param pd: problem dimension
     :param lb: lower bound
     :param ub: upper bound
+    :param seeds: optional masks, shape (k, pd), used as the first crows
     :param path: path to file with masks
     :return: population
     '''
+    if seeds is not None:
+        return init_seeded(N, pd, lb, ub, seeds)
     '''
     dir_path = os.getcwd()
     path = f'{dir_path}/random_masks/{pd}_stripes_rand_masks.csv'
@@ -30,7 +47,8 @@ def init(N, pd, lb, ub):
 
 def fetch_init_masks(pd, population_size):
     '''
-
+    Reads the precomputed random masks. The CSV is parsed once and cached as
+    a .npy file next to it, which is used as long as it is newer than the CSV.
     :param pd: problem dimension (number of stripes)
     :param population_size:
     :return:
@@ -38,9 +56,17 @@ def fetch_init_masks(pd, population_size):
     filename = f'{pd}_stripes_rand_masks.csv'
     folderpath = os.path.join(os.getcwd(), 'random_masks')
     filepath = os.path.join(folderpath, filename)
+    cachepath = filepath[:-len('.csv')] + '.npy'
+
+    if os.path.exists(cachepath) and os.path.getmtime(cachepath) >= os.path.getmtime(filepath):
+        # reads only the rows needed, the copy is writable (crow_search moves it in place)
+        return np.array(np.load(cachepath, mmap_mode='r')[:population_size, :])
+
+    import pandas    # only needed for the CSV masks, keeps the import of cs cheap
 
     df = pandas.read_csv(filepath, delimiter=';')
     masks = df.to_numpy()
+    np.save(cachepath, masks)
     return masks[:population_size, :]
 
 def init_random(N, pd, lb, ub):
@@ -56,24 +82,153 @@ def init_random(N, pd, lb, ub):
     pop = np.random.randint(low=lb, high=ub, size=(N, pd))
     return pop
 
-def objective(pulseCheck, scan_range, vec, pd):
+def init_seeded(N, pd, lb, ub, seeds, jitter=0.05):
+    '''
+    Initialize the flock around the given masks. The seeds are copied as they
+    are, half of the remaining crows are jittered copies of the seeds and the
+    rest is random, so the flock keeps some diversity.
+    :param N: Flock (population) size
+    :param pd: problem dimension
+    :param lb: lower bound
+    :param ub: upper bound
+    :param seeds: masks, shape (k, pd)
+    :param jitter: std of the jitter as a fraction of (ub - lb)
+    :return: population
+    '''
+
+    seeds = np.asarray(seeds)[:N].reshape(-1, pd)
+    pop = init_random(N, pd, lb, ub)
+    pop[:len(seeds)] = seeds
+
+    n_jittered = (N - len(seeds)) // 2
+    if len(seeds) and n_jittered:
+        idx = np.arange(n_jittered) % len(seeds)
+        noise = np.random.normal(0, jitter * (ub - lb), size=(n_jittered, pd))
+        jittered = np.clip(seeds[idx] + noise, lb, ub - 1)
+        pop[len(seeds):len(seeds) + n_jittered] = jittered
+    return pop
+
+def bench_io(pulseCheck):
+    '''
+    Returns the SLM width and the functions displaying a mask and reading the ACF.
+    pulseCheck is either the device returned by ape_com.connect or a simulated
+    bench (simulator.SimulatedLaser), which displays the mask itself.
+    :return: slm_w, send_mask(mask), read_acf() -> (delay, acf), simulated
+    '''
+    if hasattr(pulseCheck, 'send_mask'):
+        return pulseCheck.n_columns, pulseCheck.send_mask, pulseCheck.read_acf, True
+    import slm_com as slm   # needs the SLM driver, not imported for the simulator
+    return slm.slm_w, slm.send_mask, lambda: ape.read_acf(pulseCheck), False
+
+def objective(pulseCheck, scan_range, vec, pd, fidelity=None, store=None, show=None, basis=None):
     '''
     Calculates the fitness of the bird
-    :param pulseCheck:
+    :param pulseCheck: device or simulated bench (see bench_io)
     :param scan_range:
     :param vec: vector containing the position of the bird
     :param pd: problem dimension
+    :param fidelity: key of FIDELITIES, None keeps the current device settings
+    :param store: ExperimentStore, every evaluation is appended to it (see record_evaluation)
+    :param show: function displaying the mask of vec, e.g. an uploaded slot of an SLM backend
+                 (see evaluate_population), None renders the mask and sends it
+    :param basis: phase basis kind (see phase_basis.py), vec holds its coefficients, None: stripes
     :return: fitness
     '''
 
+    slm_w, send_mask, read_acf, simulated = bench_io(pulseCheck)
+    settle = 0 if simulated else 1
+    if fidelity is not None:
+        settings = dict(FIDELITIES[fidelity])
+        settle = 0 if simulated else settings.pop('settle')
+        scan_range = settings['scan_range']
+        if simulated:
+            pulseCheck.scan_range, pulseCheck.n_points = scan_range, settings['resolution']
+        else:
+            ape.set_acquisition(pulseCheck, **settings)
+
     int_positions = vec.astype(int)
-    stripe_width = int(slm.slm_w/pd)
-    mask = data.vec_to_mask(int_positions, stripe_width)
-    slm.send_mask(mask)
-    time.sleep(1)
-    delay, acf = ape.read_acf(pulseCheck)
+    if show is None:
+        mask = phase_basis.render(int_positions, slm_w, basis)
+        t_start = time.time()
+        send_mask(mask)
+    else:
+        t_start = time.time()
+        show()
+    time.sleep(settle)
+    delay, acf = read_acf()
+    t_end = time.time()
+    if store is not None:
+        # calc_pulse_qual shifts the delay axis in place, keep the raw one
+        delay = np.array(delay)
+        raw_delay = delay.copy()
     fwhm, fit, fitness, acf_area = data.calc_pulse_qual(acf, delay, scan_range)
-     return fitness
+    if store is not None:
+        record_evaluation(store, int_positions, raw_delay, acf, fidelity, fitness=fitness, fwhm=fwhm,
+                          area=acf_area, scan_range=scan_range, t_start=t_start, t_end=t_end, settle=settle)
+    return fitness
+
+def record_evaluation(store, vec, delay, acf, fidelity=None, **metrics):
+    '''
+    Appends an evaluation to the experiment store. The evaluations of every
+    fidelity go to their own table ('evals' or 'evals_<fidelity>'), the delay
+    axis of a table is stored only once.
+    :param store: ExperimentStore
+    :param vec: evaluated stripe vector
+    :param delay: delay axis of the ACF
+    :param acf: ACF intensities
+    :param fidelity: key of FIDELITIES or None
+    :param metrics: scalar metrics (fitness, timestamps, ...)
+    '''
+    table = 'evals' if fidelity in (None, 'full') else f'evals_{fidelity}'
+    if not store.has_array(f'{table}_delay'):
+        store.save_array(f'{table}_delay', np.asarray(delay, dtype=np.float32))
+    store.append(table, vec=np.asarray(vec, dtype=np.int16), acf=np.asarray(acf, dtype=np.float32), **metrics)
+
+def evaluate_population(pulseCheck, scan_range, x, pd, multi_fidelity=False, promote_frac=0.25, store=None,
+                        backend=None, basis=None):
+    '''
+    Calculates the fitness of the whole flock.
+    With multi_fidelity the flock is screened with coarse scans first and only
+    the best promote_frac of it is measured again with full scans. Crows that
+    are not promoted get an infinite fitness, so they never replace a memory
+    measured with the full scan.
+    :param pulseCheck:
+    :param scan_range:
+    :param x: positions of the crows, shape (N, pd)
+    :param pd: problem dimension
+    :param multi_fidelity: screen the flock with coarse scans first
+    :param promote_frac: fraction of the flock promoted to the full scans
+    :param store: ExperimentStore for the evaluations
+    :param backend: SLM backend (see slm_backend.py), the masks of the whole flock are
+                    uploaded at once and shown by slot, the upload runs in the background
+                    while the crows before are evaluated. None sends every mask on its own.
+    :param basis: phase basis kind, the positions are basis coefficients (see phase_basis.py)
+    :return: list of fitness values
+    '''
+
+    show = [None] * len(x)
+    if backend is not None:
+        if basis is None:
+            masks = data.vecs_to_masks(x.astype(int), int(backend.width / pd))
+        else:
+            masks = phase_basis.coeffs_to_masks(x.astype(int), basis, backend.width)
+        slots = backend.upload(masks)
+        show = [lambda slot=slot: backend.show(slot) for slot in slots]
+
+    if not multi_fidelity:
+        return [objective(pulseCheck, scan_range, v, pd, store=store, show=show[i], basis=basis)
+                for i, v in enumerate(x)]
+
+    # all the coarse scans first, then all the full ones, so the device
+    # settings change only twice per generation
+    coarse = [objective(pulseCheck, scan_range, v, pd, 'coarse', store, show[i], basis) for i, v in enumerate(x)]
+    n_promoted = max(1, int(np.ceil(promote_frac * len(x))))
+    promoted = np.argsort(coarse)[:n_promoted]
+
+    ft = [np.inf] * len(x)
+    for idx in promoted:
+        ft[idx] = objective(pulseCheck, scan_range, x[idx], pd, 'full', store, show[idx], basis)
+    return ft
 
 def get_acf(pulseCheck, scan_range, vec, pd):
     '''
@@ -85,16 +240,20 @@ def get_acf(pulseCheck, scan_range, vec, pd):
     :return:
     '''
 
+    slm_w, send_mask, read_acf, simulated = bench_io(pulseCheck)
     int_positions = vec.astype(int)
-    stripe_width = int(slm.slm_w / pd)
+    stripe_width = int(slm_w / pd)
     mask = data.vec_to_mask(int_positions, stripe_width)
-    slm.send_mask(mask)
-    time.sleep(1)
-    delay, acf = ape.read_acf(pulseCheck)
+    send_mask(mask)
+    time.sleep(0 if simulated else 1)
+    delay, acf = read_acf()
     fwhm, fit, fitness, acf_area = data.calc_pulse_qual(acf, delay, scan_range)
     return fitness, delay, acf, fit
 
-def crow_search(pd, N, AP, fl, iter, lb, ub, pulseCheck, scan_range):
+def crow_search(pd, N, AP, fl, iter, lb, ub, pulseCheck, scan_range, multi_fidelity=False, promote_frac=0.25,
+                seeds=None, tol=0, patience=None, return_memory=False, store=None, resume=False, callback=None,
+                backend=None, basis=None, library=None, bench_id='default', active=None, reference=None,
+                drift=None, refine_evals=0):
     '''
     Crow search algorithm
     :param pd: problem dimension -> number of stripes
@@ -104,7 +263,31 @@ def crow_search(pd, N, AP, fl, iter, lb, ub, pulseCheck, scan_range):
     :param iter: max number of iterations
     :param lb: lower bound
     :param ub: upper bound
-    :return: fitness list, best mask
+    :param multi_fidelity: screen each generation with coarse scans (see evaluate_population)
+    :param promote_frac: fraction of the generation promoted to the full scans
+    :param seeds: masks used to initialize the flock (see init_seeded)
+    :param tol: minimal improvement of the best fitness that counts as progress
+    :param patience: stop after this many iterations without progress, None never stops early
+    :param return_memory: also return the final memory and its fitness values
+    :param store: ExperimentStore, every evaluation is recorded and the state is checkpointed every iteration
+    :param resume: continue from the last checkpoint in the store
+    :param callback: called as callback(iteration, best fitness) after every iteration, returning True stops the search
+    :param backend: SLM backend used to upload and play back each generation (see evaluate_population)
+    :param basis: phase basis kind (see phase_basis.py), the positions are then pd basis
+                  coefficients (in mask units, lb..ub) instead of stripe values
+    :param library: MaskLibrary (see mask_library.py), every evaluated position is added to it
+                    and, without seeds, the flock starts from the best and most diverse masks
+                    measured before on this bench
+    :param bench_id: bench the library entries belong to
+    :param active: boolean array (pd,), only these stripes are optimized, the others stay
+                   frozen at the reference (e.g. sensitivity.active_mask)
+    :param reference: values of the frozen stripes, default the first crow of the flock
+    :param drift: DriftTracker (see drift.py), its reference masks are measured whenever
+                  due and the memory is compared with the new positions on the
+                  drift-normalized scale, the raw fitness values and their times are kept
+    :param refine_evals: budget of the trust-region refinement of the best mask after the
+                         search (see refine.py), 0 skips it
+    :return: fitness list, best mask (and memory, fitness memory)
     '''
 
     # x - crows positions
@@ -112,18 +295,59 @@ def crow_search(pd, N, AP, fl, iter, lb, ub, pulseCheck, scan_range):
     # ft - fitness array, stores the fitness of the hiding-food locations
     # ft_mem - memory storing fitness values of the positions in memory
 
-    x = init(N, pd, lb, ub)     #initial population
-    fitness_list = []       #fitness list
-    #ft = (objective(pulseCheck, scan_range, v, pd) for v in x)
-    ft = []
-    for v in x:
-        ft.append(objective(pulseCheck, scan_range, v, pd)) # wypełnienie fitness
+    fidelity = 'full' if multi_fidelity else None
+    n_evals = 0
+    if drift is not None:
+        def measure_references():
+            drift.measure(lambda ref: objective(pulseCheck, scan_range, ref, pd, fidelity, basis=basis), n_evals)
+    state = store.load_checkpoint() if (store is not None and resume) else None
+    if state is not None:
+        x, mem = state['x'], state['mem']
+        fit_mem = list(state['fit_mem'])
+        fitness_list = list(state['fitness_list'])
+        first_iter = int(state['iteration']) + 1
+        print(f'Resuming from iteration {first_iter}')
+        if drift is not None:
+            # the checkpoint holds the raw fitness of the memory, it is
+            # normalized against the baseline of the resumed session
+            measure_references()
+    else:
+        kind = basis or 'stripes'
+        if seeds is None and library is not None:
+            seeds = library.seeds(pd, max(1, N // 4), bench_id, kind)
+            if len(seeds):
+                print(f'Warm start from {len(seeds)} library masks')
+            else:
+                seeds = None
+        x = init(N, pd, lb, ub, seeds)     #initial population
+        if active is not None:
+            frozen = ~np.asarray(active, dtype=bool)
+            reference = x[0].copy() if reference is None else np.asarray(reference)
+            x[:, frozen] = reference[frozen]
+        fitness_list = []       #fitness list
+        if drift is not None:
+            measure_references()
+        #ft = (objective(pulseCheck, scan_range, v, pd) for v in x)
+        ft = []
+        for v in x:
+            ft.append(objective(pulseCheck, scan_range, v, pd, fidelity, store, basis=basis)) # wypełnienie fitness
 
-    #initialize the memory
-    mem=x   # first hiding-food locations are
-    fit_mem = ft    # first fitness memory
+        if library is not None:
+            library.add(pd, x, ft, bench_id, kind)
 
-    for i in range(iter):
+        #initialize the memory
+        # a copy, not an alias: the memory keeps the hiding places while the
+        # crows move (with mem = x it followed every new position)
+        mem=x.copy()   # first hiding-food locations are
+        fit_mem = list(ft)    # first fitness memory
+        first_iter = 0
+        n_evals = N
+
+    # raw fitness of the memory and when it was measured, for the drift normalization
+    raw_mem = np.array(fit_mem, dtype=float)
+    t_mem = np.full(N, drift.clock() if drift is not None else 0.0)
+
+    for i in range(first_iter, iter):
         #num = np.random.randint(low=0, high=N, size = N) #Generation of random candidate crows for following (chasing)
         #xnew = np.zeros((N, pd))
 
@@ -142,11 +366,28 @@ def crow_search(pd, N, AP, fl, iter, lb, ub, pulseCheck, scan_range):
                 # crow j is aware, goes to random position
                 x[crow_i, :] = np.random.randint(lb, ub, pd)
 
+        if active is not None:
+            # the frozen stripes never move, resumed flocks included
+            frozen = ~np.asarray(active, dtype=bool)
+            x[:, frozen] = mem[0, frozen] if reference is None else np.asarray(reference)[frozen]
+
+        if drift is not None and drift.due(n_evals):
+            measure_references()
+
         #xn = xnew
         #ft = (objective(pulseCheck, scan_range, v, pd) for v in xn)  # Function for fitness evaluation of new solutions
-        ft = [] #fitness values placeholder
-        for position in x:
-            ft.append(objective(pulseCheck, scan_range, position, pd)) #check the fitness
+        ft = evaluate_population(pulseCheck, scan_range, x, pd, multi_fidelity, promote_frac, store, backend,
+                                 basis) #check the fitness
+        n_evals += N
+        if library is not None:
+            library.add(pd, x, ft, bench_id, basis or 'stripes')
+        if drift is not None:
+            # compare on the scale of the first reference round, the memory
+            # is re-normalized as the baseline gets revised
+            t_gen = drift.clock()
+            raw_ft = np.asarray(ft, dtype=float)
+            ft = list(drift.normalize(raw_ft, t_gen))
+            fit_mem = list(drift.normalize(raw_mem, t_mem))
 
         for crow in range(N):  # Update position and memory
             if np.all(x[crow, :] >= lb) and np.all(x[crow, :] <= ub):   # Check if within bounds
@@ -154,6 +395,8 @@ def crow_search(pd, N, AP, fl, iter, lb, ub, pulseCheck, scan_range):
                 if ft[crow] < fit_mem[crow]:
                     mem[crow, :] = x[crow, :]
                     fit_mem[crow] = ft[crow]
+                    if drift is not None:
+                        raw_mem[crow], t_mem[crow] = raw_ft[crow], t_gen
             else:
                 print(f'not within bounds')
 
@@ -162,7 +405,43 @@ def crow_search(pd, N, AP, fl, iter, lb, ub, pulseCheck, scan_range):
         min_fit_idx = np.argmin(fit_mem)
         fitness_list.append(min_fit)
         print(f'Best mask so far, iteration {i}: {mem[min_fit_idx]}')
-        print(f'Fitness measured rn with the best mask so far: {objective(pulseCheck, scan_range, mem[min_fit_idx], pd)}')
+        print(f'Fitness measured rn with the best mask so far: {objective(pulseCheck, scan_range, mem[min_fit_idx], pd, fidelity, basis=basis)}')
+
+        if store is not None:
+            store.checkpoint(iteration=i, x=x, mem=mem, fit_mem=raw_mem if drift is not None else fit_mem,
+                             fitness_list=fitness_list)
+
+        if patience is not None and len(fitness_list) > patience:
+            if fitness_list[-patience - 1] - min_fit <= tol:
+                print(f'Converged after {i + 1} iterations')
+                break
+
+        if callback is not None and callback(i, min_fit):
+            print(f'Stopped by the callback after {i + 1} iterations')
+            break
+
+    if library is not None:
+        library.flush()
+    if drift is not None:
+        print(f'Drift: {drift.stats()}')
+
+    if refine_evals:
+        import refine
+        best_idx = np.argmin(fit_mem)
+        # refine takes an exclusive ub: stripes wrap over the whole phase
+        # period 0..1023, coefficients are clipped to lb..ub
+        bounds = dict(lb=0, ub=1024, wrap=True) if basis is None else dict(lb=lb, ub=ub + 1, wrap=False)
+        result = refine.refine(make_batch_evaluator(pulseCheck, scan_range, pd, fidelity, store, backend, basis),
+                               mem[best_idx], refine_evals, active=active, **bounds)
+        print(f'Refined fitness: {result.fitness} (from {result.f0}) after {result.n_evals} evaluations')
+        # the memory may be old (and drift-normalized), refine's own baseline
+        # measurement of the same mask is the fair comparison
+        if result.fitness < result.f0:
+            refined = result.fitness
+            if drift is not None:
+                refined = float(drift.normalize(refined, drift.clock()))
+            mem[best_idx], fit_mem[best_idx] = result.x, refined
+            fitness_list.append(np.min(fit_mem))
 
     #ngbest = np.where(fit_mem == np.min(fit_mem))[0] #global best
     global_best = np.min(fit_mem)
@@ -171,6 +450,190 @@ def crow_search(pd, N, AP, fl, iter, lb, ub, pulseCheck, scan_range):
     min_fit_idx = np.argmin(fit_mem)
     global_best_position = mem[min_fit_idx]
     print(f'Best mask: [{global_best_position}]')
-    print(f'Fitness measured rn with the best mask: {objective(pulseCheck, scan_range, mem[min_fit_idx], pd)}')
+    print(f'Fitness measured rn with the best mask: {objective(pulseCheck, scan_range, mem[min_fit_idx], pd, fidelity, basis=basis)}')
     #return [g_best, ngbest, fitness_list]
-    return [global_best, global_best_position, fitness_list]
\ No newline at end of file
+    if return_memory:
+        return [global_best, global_best_position, fitness_list, mem, fit_mem]
+    return [global_best, global_best_position, fitness_list]
+
+
+def coarse_to_fine(stages, AP, fl, lb, ub, pulseCheck, scan_range, n_seeds=3, upsample_mode='hold', **kwargs):
+    '''
+    Hierarchical crow search. Every stage optimizes at its own number of
+    stripes, the best masks of a stage are upsampled (through the rendered
+    phase row, see data.upsample_vec) and seed the flock of the next stage.
+    Each stage is a dict with the keys: pd, N, iter and optionally AP, fl,
+    tol, patience, n_seeds, which override the common arguments, e.g.
+    [{'pd': 5, 'N': 10, 'iter': 20}, {'pd': 10, 'N': 10, 'iter': 20}, ...]
+    :param stages: list of stage dicts, pd of each stage must be a multiple of the previous one
+    :param AP: Awareness probability
+    :param fl: flight length
+    :param lb: lower bound
+    :param ub: upper bound
+    :param n_seeds: number of best masks passed to the next stage
+    :param upsample_mode: 'hold' or 'linear', see data.upsample_vec
+    :param kwargs: passed to crow_search (multi_fidelity, promote_frac, ...), not basis
+    :return: best fitness, best mask, list of fitness lists (one per stage)
+    '''
+
+    if kwargs.get('basis') is not None:
+        raise ValueError('coarse_to_fine upsamples stripe vectors between the stages, '
+                         'it does not work with a phase basis')
+    for prev, stage in zip(stages, stages[1:]):
+        if stage['pd'] % prev['pd']:
+            raise ValueError(f"pd of every stage must be a multiple of the previous one: "
+                             f"{prev['pd']} -> {stage['pd']}")
+
+    seeds = None
+    fitness_lists = []
+    for stage_idx, stage in enumerate(stages):
+        stage = dict(stage)
+        pd = stage.pop('pd')
+        stage_n_seeds = stage.pop('n_seeds', n_seeds)
+        params = dict(AP=AP, fl=fl, **kwargs)
+        params.update(stage)
+        print(f'Stage {stage_idx}: {pd} stripes')
+
+        best, best_position, fitness_list, mem, fit_mem = crow_search(
+            pd=pd, lb=lb, ub=ub, pulseCheck=pulseCheck, scan_range=scan_range,
+            seeds=seeds, return_memory=True, **params)
+        fitness_lists.append(fitness_list)
+
+        if stage_idx + 1 < len(stages):
+            factor = stages[stage_idx + 1]['pd'] // pd
+            best_idx = np.argsort(fit_mem)[:stage_n_seeds]
+            seeds = np.array([data.upsample_vec(mem[idx], factor, upsample_mode) for idx in best_idx])
+
+    return [best, best_position, fitness_lists]
+
+
+def make_evaluator(pulseCheck, scan_range, pd, fidelity=None, basis=None):
+    '''
+    Wraps objective() into a function of the crow position only, to be used
+    with crow_search_steady_state. Create one evaluator per simulated bench
+    (simulator.SimulatedLaser displays its own masks). The hardware has a single
+    SLM (slm_com), so the evaluators of hardware pulseChecks share SLM_LOCK and
+    measure one at a time, mask and ACF read together.
+    :param pulseCheck:
+    :param scan_range:
+    :param pd: problem dimension
+    :param fidelity: key of FIDELITIES or None
+    :param basis: phase basis kind, see objective
+    :return: evaluator(vec) -> fitness
+    '''
+    if hasattr(pulseCheck, 'send_mask'):
+        def evaluator(vec):
+            return objective(pulseCheck, scan_range, vec, pd, fidelity, basis=basis)
+    else:
+        def evaluator(vec):
+            with SLM_LOCK:
+                return objective(pulseCheck, scan_range, vec, pd, fidelity, basis=basis)
+    return evaluator
+
+def make_batch_evaluator(pulseCheck, scan_range, pd, fidelity=None, store=None, backend=None, basis=None):
+    '''
+    Wraps evaluate_population() into a function of a batch of positions, used
+    by the local refinement (refine.py)
+    :param fidelity: key of FIDELITIES or None
+    :return: evaluator(X (B, pd)) -> B fitness values
+    '''
+    def evaluator(X):
+        X = np.asarray(X)
+        if fidelity is None:
+            return evaluate_population(pulseCheck, scan_range, X, pd, store=store, backend=backend, basis=basis)
+        return [objective(pulseCheck, scan_range, v, pd, fidelity, store, basis=basis) for v in X]
+    return evaluator
+
+def move_crow(x, mem, fit_mem, crow_i, AP, fl, lb, ub):
+    '''
+    Generates a new position of a single crow.
+    The crow follows a random crow that already has a memory, or goes to
+    a random position if that crow is aware (or no crow has a memory yet).
+    :return: new position of the crow
+    '''
+    pd = x.shape[1]
+    known = np.flatnonzero(np.isfinite(fit_mem))
+    rand_num = np.random.rand()
+    if len(known) and rand_num > AP:
+        crow_j = np.random.choice(known)
+        return x[crow_i, :] + fl * rand_num * (mem[crow_j, :] - x[crow_i, :])
+    return np.random.randint(lb, ub, pd)
+
+def crow_search_steady_state(pd, N, AP, fl, n_evals, lb, ub, evaluators, max_in_flight=None, seeds=None):
+    '''
+    Steady-state (asynchronous) crow search algorithm.
+    Instead of waiting for a whole generation, the memory of a crow is
+    updated as soon as its evaluation returns and the next move of that crow
+    is issued right away. Evaluations run on a thread pool, each of them
+    borrows a free evaluator (e.g. one per bench or simulator worker).
+    :param pd: problem dimension -> number of stripes
+    :param N: Flock (population) size
+    :param AP: Awareness probability
+    :param fl: flight length
+    :param n_evals: total number of evaluations (budget)
+    :param lb: lower bound
+    :param ub: upper bound
+    :param evaluators: list of callables evaluator(vec) -> fitness, see make_evaluator
+    :param max_in_flight: max number of concurrent evaluations, defaults to len(evaluators)
+    :param seeds: masks used to initialize the flock (see init_seeded)
+    :return: best fitness, best mask, fitness list (best fitness after every evaluation)
+    '''
+
+    if max_in_flight is None:
+        max_in_flight = len(evaluators)
+    max_in_flight = min(max_in_flight, N)
+
+    free = queue.Queue()
+    for evaluator in evaluators:
+        free.put(evaluator)
+
+    def run(vec):
+        evaluator = free.get()
+        try:
+            return evaluator(vec)
+        finally:
+            free.put(evaluator)
+
+    x = init(N, pd, lb, ub, seeds).astype(float)
+    mem = x.copy()
+    fit_mem = np.full(N, np.inf)
+    fitness_list = []
+
+    waiting = deque(range(N))     # crows ready to be evaluated
+    pending = {}                  # future -> (crow, evaluated position)
+    submitted = 0
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        while pending or (waiting and submitted < n_evals):
+            while waiting and len(pending) < max_in_flight and submitted < n_evals:
+                crow = waiting.popleft()
+                position = x[crow].copy()
+                pending[pool.submit(run, position)] = (crow, position)
+                submitted += 1
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                crow, position = pending.pop(future)
+                try:
+                    ft = future.result()
+                except Exception as ex:
+                    print(f'Evaluation of crow {crow} failed: {ex!r}')
+                    ft = np.inf
+
+                if np.all(position >= lb) and np.all(position <= ub):
+                    if ft < fit_mem[crow]:
+                        mem[crow, :] = position
+                        fit_mem[crow] = ft
+                else:
+                    print(f'not within bounds')
+
+                fitness_list.append(np.min(fit_mem))
+                x[crow, :] = move_crow(x, mem, fit_mem, crow, AP, fl, lb, ub)
+                waiting.append(crow)
+
+    min_fit_idx = np.argmin(fit_mem)
+    global_best = fit_mem[min_fit_idx]
+    global_best_position = mem[min_fit_idx]
+    print(f'The best fitness, overall: {global_best}')
+    print(f'Best mask: [{global_best_position}]')
+    return [global_best, global_best_position, fitness_list]
@@ -1,8 +1,16 @@
 import numpy as np
-from scipy.integrate import trapz, trapezoid
 import datetime
 import os
-import matplotlib.pyplot as plt
+import pulse_fit
+
+# matplotlib is imported in plot_fitness only, importing this module stays cheap
+
+def trapezoid(y, dx=1.0):
+    '''
+    Trapezoidal integral of uniformly sampled y, same as scipy.integrate.trapezoid(y, dx=dx)
+    '''
+    y = np.asarray(y)
+    return dx * (y.sum() - 0.5 * (y[0] + y[-1]))
 
 def vec_to_mask(vec, stripe_width):
     new_vec = []
@@ -29,6 +37,48 @@ def vec_to_half_mask(vec, stripe_width):
 
     return mask
 
+def vecs_to_masks(vecs, stripe_width, height=1200):
+    '''
+    Batch version of vec_to_mask, renders the masks of a whole population.
+    The rows of a mask are views of one rendered row (read-only), use
+    np.ascontiguousarray(masks[i]) where a contiguous frame is needed.
+    :param vecs: stripe vectors, shape (N, pd)
+    :param stripe_width: width of a stripe in pixels
+    :param height: height of the SLM in pixels
+    :return: masks, shape (N, height, pd * stripe_width), int16
+    '''
+    rows = np.repeat(np.asarray(vecs).astype(np.int16), stripe_width, axis=1)
+    return np.broadcast_to(rows[:, None, :], (rows.shape[0], height, rows.shape[1]))
+
+def upsample_vec(vec, factor=2, mode='hold', width=1920):
+    '''
+    Upsamples a stripe vector to factor times more stripes. The new stripes
+    are sampled from the rendered phase row at their centres, so with
+    mode='hold' the rendered mask stays exactly the same. mode='linear'
+    interpolates the phase between the old stripe centres, unwrapped over
+    0..1023, so the interpolation does not jump across the 2pi wrap.
+    :param vec: stripe vector (0..1023)
+    :param factor: upsampling factor
+    :param mode: 'hold' or 'linear'
+    :param width: width of the SLM in pixels
+    :return: upsampled stripe vector
+    '''
+    vec = np.asarray(vec, dtype=float)
+    n_new = len(vec) * factor
+    stripe_width = int(width / len(vec))
+    new_width = int(width / n_new)
+    centers = np.arange(n_new) * new_width + new_width / 2
+
+    if mode == 'hold':
+        row = np.repeat(vec, stripe_width)
+        return row[centers.astype(int)]
+    if mode == 'linear':
+        old_centers = np.arange(len(vec)) * stripe_width + stripe_width / 2
+        phase = np.unwrap(vec / 1024 * 2 * np.pi)
+        new_phase = np.interp(centers, old_centers, phase)
+        return np.mod(np.round(new_phase / (2 * np.pi) * 1024), 1024)
+    raise ValueError(f'Unknown upsampling mode: {mode}')
+
 def find_nearest(array, value):
     array = np.asarray(array)
     idx = (np.abs(array - value)).argmin()
@@ -48,27 +98,52 @@ def normalize_delay(delay, acf):
 
     return delayn
 
-def calc_pulse_qual(acf, delay, scan_range):
+def calc_pulse_qual(acf, delay, scan_range, fwhm_method='nearest'):
+    '''
+    Pulse quality: the FWHM (fs) penalized by how much the ACF area differs
+    from the area of a sech^2 with that FWHM.
+    :param fwhm_method: 'nearest' (default, the fitness values of the stored runs)
+                        the samples closest to the half maximum (grid resolution),
+                        'interp' interpolates the half-maximum crossings
+                        (pulse_fit.fwhm_interp), 'fit' a least-squares sech^2 fit
+                        (pulse_fit.fit): its FWHM, and the fitted trace as the fit
+                        and for the area
+    :return: fwhm, fit, pulse_qual, area
+    '''
     # normalize the ACF
 
     delay = normalize_delay(delay, acf)
 
     normalized = (acf - np.min(acf)) / (np.max(acf) - np.min(acf))
 
-    # find the index of peak value
-    i = np.where(normalized==1)
-    i = i[0][0]
-
-    arr_left = normalized[0:i]
-    arr_right = normalized[i:]
-
-    # find the half values
-    i_left = find_nearest(np.flip(arr_left), 0.5)
-    i_right = find_nearest(arr_right, 0.5)
-
-    left_delay = np.flip(delay[0:i])
-    right_delay = delay[i:]
-    fwhm = abs(right_delay[i_right] - left_delay[i_left]) * 1000
+    fwhm = np.nan
+    fit = None
+    if fwhm_method == 'interp':
+        fwhm = pulse_fit.fwhm_interp(delay, normalized)[0] * 1000
+    elif fwhm_method == 'fit':
+        result = pulse_fit.fit(delay, normalized, 'sech2')
+        fwhm = result.fwhm[0] * 1000
+        if np.isfinite(fwhm):
+            fit = pulse_fit.model(delay, result.params[0], 'sech2')[0]
+    elif fwhm_method != 'nearest':
+        raise ValueError(f'Unknown FWHM method: {fwhm_method}')
+
+    if not np.isfinite(fwhm):
+        # nearest samples, also when a flank does not cross the half maximum
+        # find the index of peak value
+        i = np.where(normalized==1)
+        i = i[0][0]
+
+        arr_left = normalized[0:i]
+        arr_right = normalized[i:]
+
+        # find the half values
+        i_left = find_nearest(np.flip(arr_left), 0.5)
+        i_right = find_nearest(arr_right, 0.5)
+
+        left_delay = np.flip(delay[0:i])
+        right_delay = delay[i:]
+        fwhm = abs(right_delay[i_right] - left_delay[i_left]) * 1000
 
     step = scan_range / len(normalized)
     start = -1 * scan_range / 2
@@ -78,7 +153,8 @@ def calc_pulse_qual(acf, delay, scan_range):
     area = trapezoid(normalized, dx = step)
 
     # calculate the sech^2 fit
-    fit = (1 / (np.cosh((1762 / fwhm)*np.array(delay)))) ** 2
+    if fit is None:
+        fit = (1 / (np.cosh((1762 / fwhm)*np.array(delay)))) ** 2
 
     # calculate the new coefficient
     # integral of the fit
@@ -101,7 +177,22 @@ def save_to_csv(parent_dir, genes, population_size, n_iter, AP, fl, fitness_list
     np.savetxt(f'{path}/acf.csv', acf, delimiter=';')
     np.savetxt(f'{path}/fit.csv', fit, delimiter=';')
 
+def save_to_store(store, genes, population_size, n_iter, AP, fl, fitness_list, best, delay, acf, fit):
+    '''
+    Binary replacement of save_to_csv, saves the run summary into an
+    ExperimentStore (see experiment_store.py) next to the per-evaluation records.
+    '''
+    store.save_array('run_params', np.array([genes, population_size, n_iter, AP, fl], dtype=float))
+    store.save_array('fitness_list', fitness_list)
+    store.save_array('vec', best)
+    store.save_array('delay', delay)
+    store.save_array('acf', acf)
+    store.save_array('fit', fit)
+    store.flush()
+
 def plot_fitness(fitness, title):
+    import matplotlib.pyplot as plt
+
     plt.plot(fitness)
     plt.xlabel('Iterations')
     plt.ylabel('Fitness')
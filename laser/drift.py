@@ -0,0 +1,164 @@
+'''
+Drift compensation with interleaved reference-mask measurements.
+
+A few fixed reference masks are measured again every `every` evaluations
+(or `every_s` seconds). Their values relative to their first measurement
+give the drift of the bench over time:
+
+    factor(t) = geometric mean over the references of  value(t) / value(t0)
+
+interpolated linearly between the reference measurements (and held
+constant before the first and after the last one). Any value measured at
+time t is then brought onto the scale of the start of the run:
+
+    normalized = value / factor(t)              (mode 'multiplicative')
+    normalized = value - offset(t)              (mode 'additive')
+
+Because the baseline is interpolated, values measured between two reference
+measurements are revised once the later one is in, so normalize() should be
+applied to the raw values whenever they are compared (see cs.crow_search).
+
+    tracker = DriftTracker(references, every=50)
+    tracker.measure(evaluate)                   # evaluate(mask) -> value
+    ...
+    if tracker.due(n_evals):
+        tracker.measure(evaluate)
+    fit = tracker.normalize(raw_fit, t_measured)
+'''
+
+import time
+import numpy as np
+
+
+class DriftTracker:
+    def __init__(self, references, every=None, every_s=None, mode='multiplicative', window=1,
+                 clock=time.monotonic):
+        '''
+        :param references: reference masks (stripe vectors), shape (k, pd)
+        :param every: measure the references every this many evaluations
+        :param every_s: and/or every this many seconds
+        :param mode: 'multiplicative' (value / factor) or 'additive' (value - offset)
+        :param window: number of consecutive reference rounds averaged (moving average
+                       of the baseline, suppresses the measurement noise)
+        :param clock: time source, the times passed to normalize() must use it too
+        '''
+        if mode not in ('multiplicative', 'additive'):
+            raise ValueError(f'Unknown drift mode: {mode}')
+        self.references = np.atleast_2d(np.asarray(references))
+        self.every = every
+        self.every_s = every_s
+        self.mode = mode
+        self.window = window
+        self.clock = clock
+        self.times = []             # one entry per round of reference measurements
+        self.values = []            # (k,) values of the references in that round
+        self._last_evals = 0
+        self._last_time = None
+
+    # ------------------------------------------------------------------
+    # Measurements
+    # ------------------------------------------------------------------
+    def due(self, n_evals=None):
+        '''
+        True if the references should be measured again
+        :param n_evals: evaluations done so far (for `every`)
+        '''
+        if not self.times:
+            return True
+        if self.every is not None and n_evals is not None and n_evals - self._last_evals >= self.every:
+            return True
+        return self.every_s is not None and self.clock() - self._last_time >= self.every_s
+
+    def record(self, values, t=None, n_evals=None):
+        '''
+        Records a round of reference measurements
+        :param values: value of every reference, in the order of `references`
+        :param t: time of the measurement, default now
+        :param n_evals: evaluations done so far
+        '''
+        values = np.asarray(values, dtype=float).ravel()
+        if len(values) != len(self.references):
+            raise ValueError(f'{len(values)} values for {len(self.references)} references')
+        if not np.all(np.isfinite(values)):
+            raise ValueError(f'Non-finite reference values: {values}')
+        if self.mode == 'multiplicative' and np.any(values == 0):
+            raise ValueError(f'Zero reference values, no multiplicative drift (use mode additive): {values}')
+        t = self.clock() if t is None else t
+        self.times.append(t)
+        self.values.append(values)
+        self._last_time = t
+        if n_evals is not None:
+            self._last_evals = n_evals
+
+    def measure(self, evaluate, n_evals=None):
+        '''
+        Measures all the references and records them
+        :param evaluate: evaluate(reference) -> value, e.g. cs.make_evaluator(...)
+        :return: the values
+        '''
+        values = [evaluate(ref) for ref in self.references]
+        self.record(values, n_evals=n_evals)
+        return values
+
+    # ------------------------------------------------------------------
+    # Baseline
+    # ------------------------------------------------------------------
+    def _rounds(self):
+        '''Per-round drift (factor or offset), averaged over the references and the window'''
+        values = np.array(self.values)
+        if self.mode == 'multiplicative':
+            drift = np.exp(np.log(np.abs(values) / np.abs(values[0])).mean(axis=1))
+        else:
+            drift = (values - values[0]).mean(axis=1)
+        if self.window > 1 and len(drift) > 1:
+            kernel = np.ones(min(self.window, len(drift)))
+            drift = np.convolve(drift, kernel, 'same') / np.convolve(np.ones(len(drift)), kernel, 'same')
+        return np.array(self.times), drift
+
+    def baseline(self, t):
+        '''
+        Drift at the time(s) t: the factor (multiplicative) or the offset (additive)
+        '''
+        neutral = 1.0 if self.mode == 'multiplicative' else 0.0
+        if not self.times:
+            return np.full(np.shape(t), neutral) if np.ndim(t) else neutral
+        times, drift = self._rounds()
+        return np.interp(t, times, drift)
+
+    def normalize(self, values, t):
+        '''
+        Brings values measured at the time(s) t onto the scale of the first reference round
+        :param values: raw values (fitness, rewards, ...)
+        :param t: measurement time of every value (or one time for all)
+        '''
+        values = np.asarray(values, dtype=float)
+        drift = self.baseline(np.broadcast_to(np.asarray(t, dtype=float), values.shape))
+        if self.mode == 'multiplicative':
+            return values / drift
+        return values - drift
+
+    def stats(self):
+        '''
+        :return: dict with the number of rounds, the current drift, its range, the
+                 drift rate per hour (linear fit) and the scatter of the references
+                 around their common drift (measurement noise)
+        '''
+        if not self.times:
+            return {'rounds': 0}
+        times, drift = self._rounds()
+        values = np.array(self.values)
+        if self.mode == 'multiplicative':
+            residual = np.log(np.abs(values) / np.abs(values[0])) - np.log(drift)[:, None]
+        else:
+            residual = (values - values[0]) - drift[:, None]
+        rate = 0.0
+        if len(times) > 1 and times[-1] > times[0]:
+            rate = float(np.polyfit((times - times[0]) / 3600, drift, 1)[0])
+        return {
+            'rounds': len(times),
+            'current': float(drift[-1]),
+            'min': float(drift.min()),
+            'max': float(drift.max()),
+            'rate_per_hour': rate,
+            'reference_scatter': float(residual[1:].std()) if len(times) > 1 else 0.0,
+        }
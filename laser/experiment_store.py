@@ -0,0 +1,210 @@
+'''
+Append-only binary store for the experiment data.
+
+Every evaluation is appended as a record (a dict of scalars and arrays) to
+a table. Records are buffered and written in chunks, each chunk becomes a
+segment directory with one .npy file per column. A segment is written to a
+temporary directory and renamed when complete, so a crash can only lose the
+records that were not flushed yet, never corrupt the ones that were.
+
+Layout:
+    path/
+        arrays/<name>.npy                   arrays stored once (e.g. delay axis)
+        <table>/seg_000000/<column>.npy     committed segments
+        checkpoint.npz                      last optimizer checkpoint
+
+The segments are loaded memory-mapped, so even tens of thousands of ACFs
+can be analysed without reading them into memory first.
+'''
+
+import os
+import shutil
+import numpy as np
+
+SEGMENT_PREFIX = 'seg_'
+TMP_SUFFIX = '.tmp'
+
+
+def _fsync_dir(path):
+    '''Makes the directory entries (renames) durable, no-op where unsupported'''
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _save_npy(path, array):
+    '''Saves an array to a .npy file and flushes it to the disk'''
+    with open(path, 'wb') as f:
+        np.save(f, array)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class ExperimentStore:
+    def __init__(self, path, chunk_size=64):
+        '''
+        Opens (or creates) the store.
+        :param path: directory of the store
+        :param chunk_size: number of records per segment
+        '''
+        self.path = path
+        self.chunk_size = chunk_size
+        self._buffers = {}
+        self._next_segment = {}
+        os.makedirs(os.path.join(path, 'arrays'), exist_ok=True)
+
+    # ------------------------------------------------------------------
+    # Records
+    # ------------------------------------------------------------------
+    def append(self, table='evals', **record):
+        '''
+        Appends a record to the table. All records of a table must have the
+        same columns and the same array shapes.
+        :param table: name of the table
+        :param record: column values (scalars or arrays)
+        '''
+        buffer = self._buffers.setdefault(table, [])
+        if buffer and record.keys() != buffer[0].keys():
+            raise ValueError(f'Record columns {sorted(record)} do not match table {table}')
+        buffer.append(record)
+        if len(buffer) >= self.chunk_size:
+            self.flush(table)
+
+    def flush(self, table=None):
+        '''
+        Writes the buffered records to new segments.
+        :param table: table to flush, None flushes all tables
+        '''
+        tables = list(self._buffers) if table is None else [table]
+        for name in tables:
+            buffer = self._buffers.get(name)
+            if not buffer:
+                continue
+
+            table_dir = os.path.join(self.path, name)
+            os.makedirs(table_dir, exist_ok=True)
+            seg_name = f'{SEGMENT_PREFIX}{self._segment_number(name):06d}'
+            tmp_dir = os.path.join(table_dir, seg_name + TMP_SUFFIX)
+            if os.path.exists(tmp_dir):
+                shutil.rmtree(tmp_dir)
+            os.makedirs(tmp_dir)
+
+            for column in buffer[0]:
+                values = np.asarray([record[column] for record in buffer])
+                _save_npy(os.path.join(tmp_dir, f'{column}.npy'), values)
+
+            os.replace(tmp_dir, os.path.join(table_dir, seg_name))
+            _fsync_dir(table_dir)
+            self._next_segment[name] += 1
+            self._buffers[name] = []
+
+    def _segment_number(self, table):
+        '''Returns the number of the next segment of the table'''
+        if table not in self._next_segment:
+            self._next_segment[table] = len(self._segment_dirs(table))
+        return self._next_segment[table]
+
+    def _segment_dirs(self, table):
+        '''Returns the committed segment directories of the table, in order'''
+        table_dir = os.path.join(self.path, table)
+        if not os.path.isdir(table_dir):
+            return []
+        names = sorted(name for name in os.listdir(table_dir)
+                       if name.startswith(SEGMENT_PREFIX) and not name.endswith(TMP_SUFFIX))
+        return [os.path.join(table_dir, name) for name in names]
+
+    def segments(self, table='evals', mmap_mode='r'):
+        '''
+        Returns the committed segments of the table.
+        :param table: name of the table
+        :param mmap_mode: passed to np.load, None reads the data into memory
+        :return: list of dicts column -> array
+        '''
+        segments = []
+        for seg_dir in self._segment_dirs(table):
+            columns = {}
+            for file_name in sorted(os.listdir(seg_dir)):
+                if file_name.endswith('.npy'):
+                    columns[file_name[:-4]] = np.load(os.path.join(seg_dir, file_name), mmap_mode=mmap_mode)
+            segments.append(columns)
+        return segments
+
+    def load(self, table='evals', columns=None):
+        '''
+        Loads the committed records of the table, concatenated over segments.
+        :param table: name of the table
+        :param columns: columns to load, None loads all of them
+        :return: dict column -> array
+        '''
+        segments = self.segments(table)
+        if not segments:
+            return {}
+        if columns is None:
+            columns = list(segments[0])
+        return {column: np.concatenate([seg[column] for seg in segments]) for column in columns}
+
+    def n_segments(self, table='evals'):
+        '''Returns the number of committed segments of the table'''
+        return len(self._segment_dirs(table))
+
+    def buffered(self, table='evals'):
+        '''Returns the records of the table appended but not flushed yet (a copy)'''
+        return list(self._buffers.get(table, ()))
+
+    def __len__(self):
+        return sum(len(next(iter(seg.values()))) for seg in self.segments() if seg)
+
+    # ------------------------------------------------------------------
+    # Arrays stored once
+    # ------------------------------------------------------------------
+    def has_array(self, name):
+        return os.path.exists(os.path.join(self.path, 'arrays', f'{name}.npy'))
+
+    def save_array(self, name, array):
+        '''
+        Stores an array shared by many records (e.g. the delay axis)
+        :param name: name of the array
+        :param array: the array
+        '''
+        path = os.path.join(self.path, 'arrays', f'{name}.npy')
+        _save_npy(path + TMP_SUFFIX, np.asarray(array))
+        os.replace(path + TMP_SUFFIX, path)
+
+    def load_array(self, name, mmap_mode='r'):
+        return np.load(os.path.join(self.path, 'arrays', f'{name}.npy'), mmap_mode=mmap_mode)
+
+    # ------------------------------------------------------------------
+    # Checkpoints
+    # ------------------------------------------------------------------
+    def checkpoint(self, **state):
+        '''
+        Flushes all the records and saves the optimizer state atomically.
+        :param state: arrays and scalars describing the state
+        '''
+        self.flush()
+        path = os.path.join(self.path, 'checkpoint.npz')
+        with open(path + TMP_SUFFIX, 'wb') as f:
+            np.savez(f, **state)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + TMP_SUFFIX, path)
+
+    def load_checkpoint(self):
+        '''
+        :return: dict with the last saved state or None if there is no checkpoint
+        '''
+        path = os.path.join(self.path, 'checkpoint.npz')
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as f:
+            return {key: f[key] for key in f.files}
+
+    def close(self):
+        self.flush()
@@ -0,0 +1,207 @@
+'''
+Fake pulseCheck: a local asyncio SCPI server for hardware-free testing.
+
+Implements the commands used by ape_device / ape_com:
+    *idn?, *stb?, *esr?, syst:err?, CALCULATE:DATA:ALL?
+and accepts the acquisition setting commands (ape_com.ACQUISITION_COMMANDS).
+CALCULATE:DATA:ALL? answers with an IEEE 488.2 definite-length block
+(#<n><len><float32 delay/intensity pairs>\\n), like the real device.
+
+The ACF content comes from a SimulatedLaser (simulator.py), from any
+callable returning (delay, intensity), e.g. replayed data, or from a fixed
+synthetic sech^2 trace. Acquisition latency, partial-packet delivery and
+injected errors are configurable, several connections are served at once.
+
+Usage:
+    python fake_pulsecheck.py --port 5025 --latency 0.1 --simulate
+    # then: ape_com.connect("127.0.0.1", 5025)
+'''
+
+import argparse
+import asyncio
+import random
+import threading
+import numpy as np
+
+IDN = 'APE,pulseCheck NX (fake),S00000,1.0'
+NO_ERROR = '0,"No error"'
+
+
+def synthetic_source(n_points=10000, scan_range=50, fwhm=0.5):
+    '''Returns a source of a fixed sech^2 ACF'''
+    delay = np.linspace(-scan_range / 2, scan_range / 2, n_points)
+    # intensity ACF of a sech^2 pulse, 2.7196 = 1.7627 * 1.543 (ACF fwhm -> sech parameter)
+    x = 2.7196 * delay / fwhm
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        intensity = 3 / np.sinh(x) ** 2 * (x / np.tanh(x) - 1)
+    intensity = np.nan_to_num(intensity, nan=1.0).astype(np.float32)
+    delay = delay.astype(np.float32)
+
+    def source():
+        return delay, intensity
+    return source
+
+
+def encode_block(delay, intensity):
+    '''
+    Encodes the ACF as a definite-length block, interleaved float32 pairs
+    :return: bytes
+    '''
+    data = np.empty(2 * len(delay), dtype=np.float32)
+    data[0::2] = delay
+    data[1::2] = intensity
+    payload = data.tobytes()
+    length = str(len(payload))
+    return b'#' + str(len(length)).encode() + length.encode() + payload + b'\n'
+
+
+class FakePulseCheck:
+    def __init__(self, laser=None, source=None, latency=0.0, chunk_size=None, chunk_delay=0.0,
+                 error_rate=0.0, idn=IDN):
+        '''
+        :param laser: SimulatedLaser, its read_acf() provides the data
+        :param source: callable returning (delay, intensity), used when laser is None
+        :param latency: acquisition time of CALCULATE:DATA:ALL?, seconds
+        :param chunk_size: send the data block in chunks of this many bytes (partial packets)
+        :param chunk_delay: pause between the chunks, seconds
+        :param error_rate: probability that a data query fails (empty block + error in the queue)
+        :param idn: identification string
+        '''
+        if source is None:
+            source = laser.read_acf if laser is not None else synthetic_source()
+        self.laser = laser
+        self.source = source
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.error_rate = error_rate
+        self.idn = idn
+        self.settings = {}
+        self.errors = []
+        self.n_queries = 0
+        self.server = None
+
+    # ------------------------------------------------------------------
+    # SCPI
+    # ------------------------------------------------------------------
+    async def execute(self, command, writer):
+        '''Executes a single command and writes the answer (if any)'''
+        self.n_queries += 1
+        cmd = command.strip().lower()
+
+        if cmd == '*idn?':
+            writer.write(f'{self.idn}\n'.encode())
+        elif cmd == '*stb?':
+            writer.write(f'{4 if self.errors else 0}\n'.encode())
+        elif cmd == '*esr?':
+            writer.write(b'0\n')
+        elif cmd == 'syst:err?':
+            writer.write(f'{self.errors.pop(0) if self.errors else NO_ERROR}\n'.encode())
+        elif cmd == 'calculate:data:all?':
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if random.random() < self.error_rate:
+                self.errors.append('-230,"Data corrupt or stale"')
+                writer.write(b'#10\n')
+            else:
+                await self.write_block(encode_block(*self.source()), writer)
+        elif '?' not in cmd and cmd:
+            # setting command, e.g. SENSE:RANGE 50
+            header, _, value = cmd.partition(' ')
+            self.settings[header] = value
+            self.apply_setting(header, value)
+        else:
+            self.errors.append(f'-113,"Undefined header;{command.strip()}"')
+        await writer.drain()
+
+    def apply_setting(self, header, value):
+        '''Passes the scan range / resolution to the simulated laser'''
+        if self.laser is None:
+            return
+        try:
+            if header == 'sense:range':
+                self.laser.scan_range = float(value)
+            elif header == 'sense:resolution':
+                self.laser.n_points = int(value)
+        except ValueError:
+            self.errors.append(f'-224,"Illegal parameter value;{value}"')
+
+    async def write_block(self, block, writer):
+        if not self.chunk_size:
+            writer.write(block)
+            return
+        for start in range(0, len(block), self.chunk_size):
+            writer.write(block[start:start + self.chunk_size])
+            await writer.drain()
+            if self.chunk_delay:
+                await asyncio.sleep(self.chunk_delay)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                await self.execute(line.decode(errors='replace'), writer)
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+        finally:
+            writer.close()
+
+    # ------------------------------------------------------------------
+    # Running
+    # ------------------------------------------------------------------
+    async def start(self, host='127.0.0.1', port=5025):
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self, host='127.0.0.1', port=5025):
+        address = await self.start(host, port)
+        print(f'Fake pulseCheck listening on {address[0]}:{address[1]}')
+        async with self.server:
+            await self.server.serve_forever()
+
+    def run_in_thread(self, host='127.0.0.1', port=0):
+        '''
+        Starts the server in a daemon thread with its own event loop
+        :param port: 0 picks a free port
+        :return: (host, port)
+        '''
+        ready = threading.Event()
+        address = []
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            address.extend(loop.run_until_complete(self.start(host, port)))
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        ready.wait()
+        return address[0], address[1]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fake pulseCheck SCPI server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5025)
+    parser.add_argument('--latency', type=float, default=0.0, help='acquisition time, s')
+    parser.add_argument('--points', type=int, default=10000, help='number of ACF points')
+    parser.add_argument('--chunk-size', type=int, default=None, help='partial packet size, bytes')
+    parser.add_argument('--chunk-delay', type=float, default=0.0, help='pause between packets, s')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='probability of a failed data query')
+    parser.add_argument('--simulate', action='store_true', help='use the SimulatedLaser for the ACF')
+    args = parser.parse_args()
+
+    laser, source = None, synthetic_source(args.points)
+    if args.simulate:
+        from simulator import SimulatedLaser
+        laser, source = SimulatedLaser(n_points=args.points), None
+
+    fake = FakePulseCheck(laser=laser, source=source, latency=args.latency, chunk_size=args.chunk_size,
+                          chunk_delay=args.chunk_delay, error_rate=args.error_rate)
+    try:
+        asyncio.run(fake.serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        print('\nfake pulseCheck stopped')
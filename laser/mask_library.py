@@ -0,0 +1,176 @@
+'''
+Persistent library of every measured mask and its fitness.
+
+The masks are kept per bench and per mask parametrization, in the
+append-only segments of an ExperimentStore (crash-safe, memory-mapped):
+
+    path/<bench_id>/<kind>_<pd>/seg_000000/{vec,fitness,time}.npy
+
+kind is 'stripes' for stripe vectors or a phase_basis kind for coefficient
+vectors. Each (bench_id, kind, pd) partition is loaded into an in-memory
+index (vectors, fitness, fitness order) once and reloaded only when new
+segments were written, so the lookups are plain numpy on a few arrays:
+
+    library = MaskLibrary('mask_library')
+    library.add(20, x, ft, bench_id='S09797')        # a population and its fitness
+    best_vecs, best_fit = library.top_k(20, 5, bench_id='S09797')
+    seeds = library.seeds(20, 8, bench_id='S09797')  # best and diverse, for cs.init
+
+Lower fitness is better, as in the crow search. The distance between two
+stripe vectors is the wrapped phase distance (values modulo 1024).
+'''
+
+import glob
+import os
+import time
+import numpy as np
+from experiment_store import ExperimentStore
+
+PERIOD = 1024
+
+
+class MaskLibrary:
+    def __init__(self, path, chunk_size=256):
+        '''
+        :param path: directory of the library
+        :param chunk_size: number of masks per segment
+        '''
+        self.store = ExperimentStore(path, chunk_size=chunk_size)
+        self._index = {}            # table -> (n_segments, vecs, fitness)
+
+    @staticmethod
+    def table(pd, bench_id='default', kind='stripes'):
+        return f'{bench_id}/{kind}_{pd}'
+
+    # ------------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------------
+    def add(self, pd, vecs, fitness, bench_id='default', kind='stripes'):
+        '''
+        Adds measured masks
+        :param vecs: array (N, pd) of stripe values (or basis coefficients)
+        :param fitness: N fitness values
+        '''
+        vecs = np.asarray(vecs).reshape(-1, pd)
+        fitness = np.asarray(fitness, dtype=float).ravel()
+        table = self.table(pd, bench_id, kind)
+        now = time.time()
+        for vec, fit in zip(vecs, fitness):
+            if np.isfinite(fit):
+                self.store.append(table, vec=np.rint(vec).astype(np.int16), fitness=np.float32(fit), time=now)
+
+    def flush(self):
+        self.store.flush()
+
+    def close(self):
+        self.store.close()
+
+    # ------------------------------------------------------------------
+    # Index
+    # ------------------------------------------------------------------
+    def index(self, pd, bench_id='default', kind='stripes'):
+        '''
+        Returns the index of a partition, the written segments plus the buffered records
+        :return: vecs (N, pd) int16, fitness (N,) float32, order (indices by ascending fitness)
+        '''
+        table = self.table(pd, bench_id, kind)
+        n_segments = self.store.n_segments(table)
+        cached = self._index.get(table)
+        if cached is None or cached[0] != n_segments:
+            data = self.store.load(table, ['vec', 'fitness'])
+            vecs = np.asarray(data.get('vec', np.zeros((0, pd), np.int16)))
+            fitness = np.asarray(data.get('fitness', np.zeros(0, np.float32)))
+            cached = self._index[table] = (n_segments, vecs, fitness)
+        _, vecs, fitness = cached
+
+        buffered = self.store.buffered(table)
+        if buffered:
+            vecs = np.concatenate([vecs, [r['vec'] for r in buffered]])
+            fitness = np.concatenate([fitness, [r['fitness'] for r in buffered]])
+        return vecs, fitness, np.argsort(fitness, kind='stable')
+
+    # ------------------------------------------------------------------
+    # Lookups
+    # ------------------------------------------------------------------
+    @staticmethod
+    def distance(vecs, vec, kind='stripes'):
+        '''Euclidean distance of each row of vecs to vec, phase-wrapped for stripes'''
+        diff = np.abs(np.asarray(vecs, dtype=float) - np.asarray(vec, dtype=float))
+        if kind == 'stripes':
+            diff = np.minimum(diff, PERIOD - diff)
+        return np.sqrt((diff ** 2).sum(axis=-1))
+
+    def top_k(self, pd, k, bench_id='default', kind='stripes', unique=True):
+        '''
+        The k best masks
+        :param unique: skip repeated measurements of the same mask
+        :return: vecs (k, pd), fitness (k,)
+        '''
+        vecs, fitness, order = self.index(pd, bench_id, kind)
+        if unique:
+            _, first = np.unique(vecs[order], axis=0, return_index=True)
+            order = order[np.sort(first)]
+        order = order[:k]
+        return vecs[order], fitness[order]
+
+    def nearest(self, pd, vec, k=1, bench_id='default', kind='stripes'):
+        '''
+        The k masks closest to vec
+        :return: vecs (k, pd), fitness (k,), distances (k,)
+        '''
+        vecs, fitness, _ = self.index(pd, bench_id, kind)
+        if len(vecs) == 0:
+            return vecs, fitness, np.zeros(0)
+        dist = self.distance(vecs, vec, kind)
+        k = min(k, len(dist))
+        idx = np.argpartition(dist, k - 1)[:k]
+        idx = idx[np.argsort(dist[idx])]
+        return vecs[idx], fitness[idx], dist[idx]
+
+    def seeds(self, pd, k, bench_id='default', kind='stripes', pool=None, min_distance=None):
+        '''
+        Best and diverse masks to seed a population (see cs.init_seeded).
+        Starts from the best mask and adds, from the `pool` best masks, the one
+        farthest from the masks already chosen (farthest-point sampling), or
+        with min_distance the best ones at least that far from all chosen.
+        :param pool: number of best masks considered, default 10 * k
+        :return: array (<= k, pd), empty if the partition is empty
+        '''
+        vecs, _ = self.top_k(pd, pool or 10 * k, bench_id, kind)
+        if len(vecs) <= 1 or k <= 1:
+            return vecs[:k]
+        chosen = [0]
+        closest = self.distance(vecs, vecs[0], kind)
+        while len(chosen) < min(k, len(vecs)):
+            if min_distance is None:
+                nxt = int(np.argmax(closest))
+            else:
+                far = np.flatnonzero(closest >= min_distance)
+                if len(far) == 0:
+                    break
+                nxt = int(far[0])           # vecs are ordered by fitness
+            if closest[nxt] == 0:
+                break
+            chosen.append(nxt)
+            closest = np.minimum(closest, self.distance(vecs, vecs[nxt], kind))
+        return vecs[chosen]
+
+    # ------------------------------------------------------------------
+    # Import
+    # ------------------------------------------------------------------
+    def import_csv_runs(self, parent_dir, bench_id='default'):
+        '''
+        Adds the best masks of the cs_optim_* folders written by data_processing.save_to_csv
+        :return: number of runs imported
+        '''
+        n = 0
+        for folder in sorted(glob.glob(os.path.join(parent_dir, 'cs_optim_*'))):
+            try:
+                vec = np.loadtxt(os.path.join(folder, 'vec.csv'), delimiter=';', ndmin=1)
+                fitness = np.loadtxt(os.path.join(folder, 'fitness_list.csv'), delimiter=';', ndmin=1)
+            except OSError:
+                continue
+            self.add(len(vec), vec[None, :], [fitness[-1]], bench_id)
+            n += 1
+        self.flush()
+        return n
@@ -3,7 +3,12 @@ Mock functions for the client. To be replaced with the actual functions.
 """
 
 from random import randint, random
+import time
 import numpy as np
+
+# Seconds the mock acquisition takes, set by the client (mock_acquisition)
+ACQUISITION_TIME = 0
+
 def send_mask(mask):
     """
     Send a mask to the the laser. An action from the RL perspective.
@@ -15,7 +20,9 @@ def read_acf(args):
     Read the ACF from the the laser. A state from the RL perspective.
     """
     print (f"Reading ACF")
-    
+    if ACQUISITION_TIME:
+        time.sleep(ACQUISITION_TIME)
+
     list1 = [random() for _ in range(10000)]
     list2 = [random() for _ in range(10000)]
     return list1, list2
@@ -0,0 +1,104 @@
+'''
+Parametric spectral-phase masks.
+
+Instead of one value per stripe, a mask is described by a short vector of
+coefficients of a smooth basis along the SLM columns (the spectrum):
+
+- 'taylor':   x^2, x^3, ... the dispersion terms (GDD, TOD, ...)
+- 'legendre': Legendre polynomials P2, P3, ... (orthogonal on the aperture,
+              the 1D counterpart of the Zernike polynomials)
+- 'bspline':  cubic B-splines with uniform knots, the coefficients are
+              roughly the phase at the knots
+
+x runs from -1 to 1 across the columns, the constant and linear terms are
+left out (they do not change the pulse). The coefficients are in mask units
+(1024 = 2pi) and scale terms that are at most 1 in magnitude, so a
+coefficient c changes the phase by at most c mask units.
+
+The phase row is one matrix product against a cached basis matrix, then it
+is wrapped to 0..1023 and broadcast to the frame:
+
+    mask = coeffs_to_mask([300, -120, 40, 0, 10], 'legendre')
+'''
+
+from functools import lru_cache
+import numpy as np
+
+KINDS = ('taylor', 'legendre', 'bspline')
+
+
+@lru_cache(maxsize=None)
+def basis(kind, n_terms, width=1920):
+    '''
+    Basis matrix, cached per (kind, n_terms, width)
+    :param kind: 'taylor', 'legendre' or 'bspline'
+    :param n_terms: number of coefficients
+    :param width: number of SLM columns
+    :return: read-only array (width, n_terms)
+    '''
+    x = np.linspace(-1, 1, width)
+    if kind == 'taylor':
+        matrix = np.stack([x ** k for k in range(2, n_terms + 2)], axis=1)
+    elif kind == 'legendre':
+        matrix = np.polynomial.legendre.legvander(x, n_terms + 1)[:, 2:]
+    elif kind == 'bspline':
+        from scipy.interpolate import BSpline
+
+        degree = 3
+        if n_terms <= degree:
+            raise ValueError(f'bspline needs more than {degree} terms')
+        inner = np.linspace(-1, 1, n_terms - degree + 1)
+        knots = np.concatenate([[-1] * degree, inner, [1] * degree])
+        matrix = BSpline.design_matrix(x, knots, degree).toarray()
+    else:
+        raise ValueError(f'Unknown phase basis: {kind}')
+    matrix.flags.writeable = False
+    return matrix
+
+
+def wrap(phase):
+    '''Wraps a phase in mask units to the SLM values 0..1023 (int16)'''
+    return np.mod(np.rint(phase), 1024).astype(np.int16)
+
+
+def coeffs_to_row(coeffs, kind, width=1920):
+    '''
+    Phase row (mask units, not wrapped) of the coefficients
+    :param coeffs: coefficient vector
+    :return: array (width,)
+    '''
+    coeffs = np.asarray(coeffs, dtype=float)
+    return basis(kind, len(coeffs), width) @ coeffs
+
+
+def coeffs_to_mask(coeffs, kind, width=1920, height=1200):
+    '''
+    Mask of the coefficients, the counterpart of data_processing.vec_to_mask.
+    The rows are views of one row (read-only).
+    :return: array (height, width), int16, values 0..1023
+    '''
+    row = wrap(coeffs_to_row(coeffs, kind, width))
+    return np.broadcast_to(row, (height, width))
+
+
+def coeffs_to_masks(coeffs, kind, width=1920, height=1200):
+    '''
+    Batch version of coeffs_to_mask, the counterpart of data_processing.vecs_to_masks
+    :param coeffs: array (N, n_terms)
+    :return: array (N, height, width), int16
+    '''
+    coeffs = np.asarray(coeffs, dtype=float)
+    rows = wrap(coeffs @ basis(kind, coeffs.shape[1], width).T)
+    return np.broadcast_to(rows[:, None, :], (rows.shape[0], height, width))
+
+
+def render(vec, width=1920, basis_kind=None):
+    '''
+    Mask of a position of the search: stripes (basis_kind None) or coefficients
+    :param vec: stripe values or coefficients
+    :return: array (1200, width), int16
+    '''
+    if basis_kind is None:
+        import data_processing as data
+        return data.vec_to_mask(np.asarray(vec).astype(int), int(width / len(vec)))
+    return coeffs_to_mask(vec, basis_kind, width)
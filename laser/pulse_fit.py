@@ -0,0 +1,187 @@
+'''
+Sub-sample FWHM and batched least-squares fits of autocorrelation traces.
+
+All the functions take a stack of ACFs, shape (B, N), on a common delay axis
+(N,) and work on the whole stack at once; a single ACF (N,) works as well.
+
+- fwhm_interp: FWHM from the half-maximum crossings on both flanks, linearly
+  interpolated between the samples, so it changes smoothly with the trace
+  instead of in steps of the delay grid (find_nearest).
+- fit: least-squares fit of  offset + amplitude * shape((delay - centre) / width)
+  with shape sech^2 or gaussian, by Levenberg-Marquardt with analytic
+  Jacobians, every trace with its own damping. Returns the parameters, their
+  standard errors (from the covariance s^2 (J^T J)^-1) and the FWHM.
+
+    result = fit(delay, acfs, 'sech2')
+    result.fwhm, result.fwhm_err         # in the units of delay
+'''
+
+from collections import namedtuple
+import numpy as np
+
+# FWHM of the shape as a multiple of the width parameter
+FWHM_FACTOR = {
+    'sech2': 2 * np.arccosh(np.sqrt(2)),        # sech^2(u) = 1/2 at u = acosh(sqrt 2)
+    'gaussian': 2 * np.sqrt(np.log(2)),         # exp(-u^2) = 1/2 at u = sqrt(ln 2)
+}
+# ACF FWHM / pulse FWHM (deconvolution factor)
+DECONVOLUTION = {'sech2': 1.543, 'gaussian': np.sqrt(2)}
+
+PARAMS = ('amplitude', 'width', 'centre', 'offset')
+
+FitResult = namedtuple('FitResult', ['params', 'errors', 'fwhm', 'fwhm_err', 'pulse_fwhm',
+                                     'rms', 'converged', 'iterations'])
+
+
+def _as_stack(acfs):
+    acfs = np.asarray(acfs, dtype=np.float64)
+    return acfs[None, :] if acfs.ndim == 1 else acfs
+
+
+def fwhm_interp(delay, acfs):
+    '''
+    FWHM from the interpolated half-maximum crossings next to the peak
+    :param delay: delay axis (N,), ascending
+    :param acfs: ACFs (B, N) or (N,)
+    :return: FWHM per trace (B,) in the units of delay, nan where a flank
+             does not fall below the half maximum
+    '''
+    y = _as_stack(acfs)
+    x = np.asarray(delay, dtype=np.float64)
+    n = y.shape[1]
+    low = y.min(axis=1, keepdims=True)
+    span = y.max(axis=1, keepdims=True) - low
+    y = (y - low) / np.where(span > 0, span, 1.0)
+    peak = np.argmax(y, axis=1)[:, None]
+    idx = np.arange(n)[None, :]
+    below = y < 0.5
+
+    # last sample below half on the left, first one on the right
+    left = np.where(below & (idx < peak), idx, -1).max(axis=1)
+    right = np.where(below & (idx > peak), idx, n).min(axis=1)
+    ok = (left >= 0) & (right < n)
+    left, right = np.clip(left, 0, n - 2), np.clip(right, 1, n - 1)
+    rows = np.arange(len(y))
+
+    def crossing(i0, i1):
+        y0, y1 = y[rows, i0], y[rows, i1]
+        frac = (0.5 - y0) / np.where(y1 != y0, y1 - y0, 1.0)
+        return x[i0] + frac * (x[i1] - x[i0])
+
+    fwhm = crossing(right - 1, right) - crossing(left, left + 1)
+    return np.where(ok, fwhm, np.nan)
+
+
+def _sech2(u):
+    # sech(u) = 2 e^-|u| / (1 + e^-2|u|), no overflow of cosh for large |u|
+    e = np.exp(-np.abs(u))
+    sech = 2 * e / (1 + e * e)
+    return sech * sech
+
+
+def model(delay, params, shape='sech2'):
+    '''
+    Model traces
+    :param params: (B, 4) amplitude, width, centre, offset
+    :return: (B, N)
+    '''
+    p = np.atleast_2d(params)
+    u = (np.asarray(delay)[None, :] - p[:, 2:3]) / p[:, 1:2]
+    s = _sech2(u) if shape == 'sech2' else np.exp(-u * u)
+    return p[:, 0:1] * s + p[:, 3:4]
+
+
+def _model_jacobian(x, p, shape):
+    '''Model (B, N) and its Jacobian (B, N, 4) with respect to the parameters'''
+    a, w, c = p[:, 0:1], p[:, 1:2], p[:, 2:3]
+    u = (x[None, :] - c) / w
+    if shape == 'sech2':
+        s = _sech2(u)
+        ds_du = -2 * s * np.tanh(u)
+    else:
+        s = np.exp(-u * u)
+        ds_du = -2 * u * s
+    jac = np.empty(u.shape + (4,))
+    jac[..., 0] = s
+    jac[..., 1] = -a * ds_du * u / w            # du/dw = -u / w
+    jac[..., 2] = -a * ds_du / w                # du/dc = -1 / w
+    jac[..., 3] = 1.0
+    return a * s + p[:, 3:4], jac
+
+
+def initial_guess(delay, acfs, shape='sech2'):
+    '''Parameters from the extrema, the peak position and the interpolated FWHM'''
+    y = _as_stack(acfs)
+    x = np.asarray(delay, dtype=np.float64)
+    low, high = y.min(axis=1), y.max(axis=1)
+    fwhm = fwhm_interp(x, y)
+    fwhm = np.where(np.isfinite(fwhm), fwhm, (x[-1] - x[0]) / 4)
+    return np.stack([high - low, fwhm / FWHM_FACTOR[shape], x[np.argmax(y, axis=1)], low], axis=1)
+
+
+def fit(delay, acfs, shape='sech2', p0=None, max_iter=50, tol=1e-8, damping=1e-3):
+    '''
+    Levenberg-Marquardt fit of every trace of the stack
+    :param delay: delay axis (N,)
+    :param acfs: ACFs (B, N) or (N,)
+    :param shape: 'sech2' or 'gaussian'
+    :param p0: initial parameters (B, 4), default initial_guess
+    :param max_iter: maximal number of iterations
+    :param tol: relative decrease of the residual sum of squares that counts as converged
+    :param damping: initial damping (scaled to the diagonal of J^T J)
+    :return: FitResult, fwhm/pulse_fwhm in the units of delay
+    '''
+    if shape not in FWHM_FACTOR:
+        raise ValueError(f'Unknown shape: {shape}')
+    y = _as_stack(acfs)
+    x = np.asarray(delay, dtype=np.float64)
+    n_traces, n = y.shape
+    p = initial_guess(x, y, shape) if p0 is None else np.array(np.atleast_2d(p0), dtype=np.float64)
+    lam = np.full(n_traces, damping)
+    converged = np.zeros(n_traces, dtype=bool)
+
+    f, jac = _model_jacobian(x, p, shape)
+    r = y - f
+    cost = (r * r).sum(axis=1)
+    iterations = 0
+    for iterations in range(1, max_iter + 1):
+        active = ~converged
+        if not active.any():
+            break
+        jtj = np.einsum('bni,bnj->bij', jac[active], jac[active])
+        jtr = np.einsum('bni,bn->bi', jac[active], r[active])
+        diag = np.einsum('bii->bi', jtj)
+        lhs = jtj + (lam[active][:, None] * np.maximum(diag, 1e-12))[:, :, None] * np.eye(4)
+        try:
+            step = np.linalg.solve(lhs, jtr[..., None])[..., 0]
+        except np.linalg.LinAlgError:              # a degenerate trace (e.g. flat)
+            step = (np.linalg.pinv(lhs) @ jtr[..., None])[..., 0]
+
+        trial = p[active] + step
+        trial[:, 1] = np.abs(trial[:, 1])           # the width is defined up to its sign
+        f_new, jac_new = _model_jacobian(x, trial, shape)
+        r_new = y[active] - f_new
+        cost_new = (r_new * r_new).sum(axis=1)
+
+        better = cost_new < cost[active]
+        rows = np.flatnonzero(active)
+        acc = rows[better]
+        done = better & ((cost[active] - cost_new) <= tol * cost[active])
+        p[acc], jac[acc], r[acc], cost[acc] = trial[better], jac_new[better], r_new[better], cost_new[better]
+        lam[acc] = np.maximum(lam[acc] / 3, 1e-12)
+        lam[rows[~better]] *= 4
+        converged[rows[done]] = True
+        # a damping this large means no step improves the fit any more
+        converged[rows[~better & (lam[rows] > 1e10)]] = True
+
+    # standard errors: cov = s^2 (J^T J)^-1
+    dof = max(n - 4, 1)
+    s2 = cost / dof
+    jtj = np.einsum('bni,bnj->bij', jac, jac)
+    cov = np.linalg.pinv(jtj) * s2[:, None, None]
+    errors = np.sqrt(np.clip(np.einsum('bii->bi', cov), 0, None))
+
+    fwhm = FWHM_FACTOR[shape] * p[:, 1]
+    fwhm_err = FWHM_FACTOR[shape] * errors[:, 1]
+    return FitResult(p, errors, fwhm, fwhm_err, fwhm / DECONVOLUTION[shape],
+                     np.sqrt(cost / n), converged, iterations)
@@ -0,0 +1,271 @@
+'''
+Batched trust-region refinement of a mask around a good position.
+
+The global search (cs.crow_search) finds the basin, the last few units of
+fitness are cheaper to get with a local model. Every iteration measures a
+batch of structured perturbations around the current mask, 2 m points
+x +- radius q_k along m orthonormal directions (the last successful step
+first, the others random in the active stripes), and fits the quadratic
+model, in the coordinates t = Q^T s of the displacement s,
+
+    f(x + s) ~ f(x) + g . t + 1/2 sum_k h_k t_k^2
+
+to the measured values (least squares on the actual displacements, which
+differ from radius q_k after the quantization). The model step (Newton
+along the directions with positive curvature, to the boundary along the
+others, at most radius long) is measured next and the region is grown or
+shrunk with the ratio of the actual to the predicted decrease. When the
+model step fails but a perturbation of the batch improved, the mask moves
+there (pattern search).
+
+All masks are quantized to integers in lb..ub-1 (wrapped modulo the phase
+period or clipped) and go through a FitnessCache, so a mask that was
+measured already is never measured again; the budget counts the new
+measurements only.
+
+    evaluate = cs.make_batch_evaluator(pulseCheck, scan_range, pd)
+    result = refine(evaluate, best_mask, budget=40)
+    result.x, result.fitness
+
+Usage (simulator, or --device host:port for the bench):
+    python refine.py --vec cs_optim_2024_01_01/vec.csv --budget 40
+'''
+
+import argparse
+from collections import namedtuple
+import numpy as np
+
+RefineResult = namedtuple('RefineResult', ['x', 'fitness', 'f0', 'n_evals', 'radius', 'history'])
+
+
+def quantize(x, lb=0, ub=1024, wrap=True):
+    '''
+    Integer mask values in lb..ub-1
+    :param wrap: wrap modulo ub - lb (phase), otherwise clip
+    '''
+    x = np.rint(np.asarray(x, dtype=float))
+    if wrap:
+        return (lb + np.mod(x - lb, ub - lb)).astype(int)
+    return np.clip(x, lb, ub - 1).astype(int)
+
+
+class FitnessCache:
+    def __init__(self, evaluate):
+        '''
+        Batch evaluator that measures every (quantized) mask only once
+        :param evaluate: evaluate(X (B, pd)) -> B fitness values, e.g. cs.make_batch_evaluator(...)
+        '''
+        self.evaluate = evaluate
+        self.values = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, X):
+        '''
+        :param X: integer masks (B, pd)
+        :return: fitness (B,), the masks not in the cache are measured in one batch
+        '''
+        X = np.atleast_2d(np.asarray(X, dtype=int))
+        keys = [x.astype(np.int16).tobytes() for x in X]
+        new = {}
+        for key, x in zip(keys, X):
+            if key not in self.values and key not in new:
+                new[key] = x
+        if new:
+            fitness = self.evaluate(np.array(list(new.values())))
+            self.values.update(zip(new, (float(f) for f in fitness)))
+        self.misses += len(new)
+        self.hits += len(keys) - len(new)
+        return np.array([self.values[key] for key in keys])
+
+
+def displacement(points, x, lb=0, ub=1024, wrap=True):
+    '''
+    points - x, with wrap the shortest way round the phase period ub - lb
+    (1023 -> 0 is a step of +1)
+    '''
+    diff = np.asarray(points) - np.asarray(x)
+    if wrap:
+        period = ub - lb
+        diff = np.mod(diff + period / 2, period) - period / 2
+    return diff
+
+
+def _directions(pd, m, active, last_step, rng):
+    '''m orthonormal directions (pd, m) in the active stripes, the last step first'''
+    idx = np.flatnonzero(active)
+    m = min(m, len(idx))
+    basis = rng.standard_normal((len(idx), m))
+    if last_step is not None and np.any(last_step[idx]):
+        basis[:, 0] = last_step[idx]
+    q, _ = np.linalg.qr(basis)
+    directions = np.zeros((pd, m))
+    directions[idx] = q
+    return directions
+
+
+def _fit_model(t, df):
+    '''
+    Least-squares g, h of df ~ g . t + 1/2 sum h t^2
+    :param t: displacements in the direction coordinates (n, m)
+    :param df: fitness changes (n,)
+    '''
+    m = t.shape[1]
+    design = np.hstack([t, 0.5 * t * t])
+    coeffs = np.linalg.lstsq(design, df, rcond=None)[0]
+    return coeffs[:m], coeffs[m:]
+
+
+def _model_step(g, h, radius):
+    '''Step t of at most radius and its predicted decrease'''
+    t = np.where(h > 0, -g / np.where(h > 0, h, 1.0), -np.sign(g) * radius)
+    norm = np.linalg.norm(t)
+    if norm > radius:
+        t *= radius / norm
+    return t, -(g @ t + 0.5 * h @ (t * t))
+
+
+def refine(evaluate, x0, budget=40, f0=None, radius=64.0, min_radius=1.0, max_radius=256.0, n_dirs=4,
+           lb=0, ub=1024, wrap=True, active=None, grow=2.0, shrink=0.5, cache=None, rng=None, callback=None):
+    '''
+    Trust-region refinement of x0
+    :param evaluate: batch evaluator, evaluate(X (B, pd)) -> B fitness values (lower is better),
+                     e.g. cs.make_batch_evaluator(...)
+    :param x0: start mask (pd,), e.g. the best mask of crow_search
+    :param budget: number of new measurements
+    :param f0: fitness of x0, None measures it (e.g. on today's bench)
+    :param radius: initial trust radius (Euclidean, mask units)
+    :param min_radius: stop when the radius shrinks below this (the quantization step is 1)
+    :param max_radius: largest trust radius
+    :param n_dirs: directions per iteration, an iteration costs 2 * n_dirs + 1 measurements
+    :param lb: lower bound of the values
+    :param ub: upper bound of the values, exclusive (the phase period for stripes: 0, 1024)
+    :param wrap: wrap the values modulo ub - lb (stripe phases), otherwise clip (basis coefficients)
+    :param active: boolean array (pd,), only these stripes are moved (see sensitivity.active_mask)
+    :param grow: factor of the radius after a good model step on the boundary
+    :param shrink: factor of the radius after a poor one
+    :param cache: FitnessCache to share between calls, default a new one around evaluate
+    :param rng: numpy Generator
+    :param callback: called as callback(n_evals, fitness, radius) after every iteration
+    :return: RefineResult(x, fitness, f0, n_evals, radius, history), f0 is the fitness
+             of x0 the refinement started from (compare fitness with it, both are
+             measured in the same session), history has one (n_evals, fitness,
+             radius) entry per iteration
+    '''
+    rng = rng or np.random.default_rng()
+    cache = cache or FitnessCache(evaluate)
+    start = cache.misses
+    x = quantize(x0, lb, ub, wrap)
+    pd = len(x)
+    active = np.ones(pd, dtype=bool) if active is None else np.asarray(active, dtype=bool)
+
+    fx = f0 = float(cache(x[None, :])[0]) if f0 is None else float(f0)
+    history = []
+    last_step = None
+    while radius >= min_radius:
+        remaining = budget - (cache.misses - start)
+        m = min(n_dirs, (remaining - 1) // 2, int(active.sum()))
+        if m < 1:
+            break
+        q = _directions(pd, m, active, last_step, rng)
+        m = q.shape[1]
+        offsets = radius * np.vstack([q.T, -q.T])
+        points = quantize(x + offsets, lb, ub, wrap)
+        values = cache(points)
+
+        t = displacement(points, x, lb, ub, wrap) @ q
+        g, h = _fit_model(t, values - fx)
+        t_step, predicted = _model_step(g, h, radius)
+        candidate = quantize(x + q @ t_step, lb, ub, wrap)
+        f_cand = float(cache(candidate[None, :])[0])
+
+        best = int(np.argmin(values))
+        if f_cand < fx:
+            rho = (fx - f_cand) / predicted if predicted > 0 else 0.0
+            if rho > 0.75 and np.linalg.norm(t_step) >= 0.99 * radius:
+                radius = min(radius * grow, max_radius)
+            elif rho < 0.25:
+                radius *= shrink
+            last_step = displacement(candidate[None, :], x, lb, ub, wrap)[0]
+            x, fx = candidate, f_cand
+        elif values[best] < fx:
+            # the model missed, the best perturbation still improved
+            last_step = displacement(points[best:best + 1], x, lb, ub, wrap)[0]
+            x, fx = points[best], float(values[best])
+        else:
+            radius *= shrink
+            last_step = None
+
+        n_evals = cache.misses - start
+        history.append((n_evals, fx, radius))
+        if callback is not None:
+            callback(n_evals, fx, radius)
+    return RefineResult(x, fx, f0, cache.misses - start, radius, history)
+
+
+if __name__ == '__main__':
+    import cs
+
+    parser = argparse.ArgumentParser(description='Trust-region refinement of a mask on the simulated laser or the bench')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--vec', help='start mask, vec.csv of a cs_optim_* run (";" separated)')
+    source.add_argument('--library', help='MaskLibrary directory, starts from its best mask (needs --pd)')
+    parser.add_argument('--pd', type=int, default=None)
+    parser.add_argument('--bench-id', default='default')
+    parser.add_argument('--budget', type=int, default=40)
+    parser.add_argument('--radius', type=float, default=64)
+    parser.add_argument('--dirs', type=int, default=4)
+    parser.add_argument('--lb', type=int, default=0)
+    parser.add_argument('--ub', type=int, default=1024)
+    parser.add_argument('--device', default=None, help='host:port of the pulseCheck, default the simulator')
+    parser.add_argument('--scan-range', type=float, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--store', default=None, help='ExperimentStore directory the measurements are recorded to')
+    parser.add_argument('--out', default=None, help='file the refined mask is written to (";" separated)')
+    args = parser.parse_args()
+
+    library = None
+    if args.vec:
+        x0 = np.loadtxt(args.vec, delimiter=';', ndmin=1)
+    else:
+        from mask_library import MaskLibrary
+        if args.pd is None:
+            parser.error('--library needs --pd')
+        library = MaskLibrary(args.library)
+        vecs, fitness = library.top_k(args.pd, 1, args.bench_id)
+        if not len(vecs):
+            parser.error(f'no {args.pd} stripe masks of {args.bench_id} in the library')
+        x0 = vecs[0]
+        print(f'Best library mask, fitness {fitness[0]:.6g} when measured')
+    pd = len(x0)
+
+    if args.device:
+        import ape_com as ape
+        import slm_com
+        host, port = args.device.rsplit(':', 1)
+        slm_com.connect()
+        pulseCheck, scan_range = ape.connect(host, int(port)), args.scan_range
+    else:
+        from simulator import SimulatedLaser
+        pulseCheck = SimulatedLaser(seed=args.seed)
+        scan_range = pulseCheck.scan_range
+    store = None
+    if args.store:
+        from experiment_store import ExperimentStore
+        store = ExperimentStore(args.store)
+
+    evaluate = cs.make_batch_evaluator(pulseCheck, scan_range, pd, store=store)
+    f0 = float(evaluate(quantize(x0, args.lb, args.ub)[None, :])[0])
+    print(f'Start fitness {f0:.6g}')
+    result = refine(evaluate, x0, args.budget - 1, f0, args.radius, n_dirs=args.dirs, lb=args.lb, ub=args.ub,
+                    rng=np.random.default_rng(args.seed),
+                    callback=lambda n, f, r: print(f'{n:4d} evaluations  fitness {f:.6g}  radius {r:.3g}'))
+    print(f'Refined fitness {result.fitness:.6g} after {result.n_evals + 1} evaluations')
+    print(f'Refined mask: {result.x}')
+    if store is not None:
+        store.flush()
+    if library is not None:
+        library.add(pd, result.x[None, :], [result.fitness], args.bench_id)
+        library.close()
+    if args.out:
+        np.savetxt(args.out, result.x[None, :], fmt='%d', delimiter=';')
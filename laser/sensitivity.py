@@ -0,0 +1,183 @@
+'''
+Stripe sensitivity profiler.
+
+Perturbs a reference mask with simultaneous random perturbations (SPSA
+style) and estimates, for every stripe (or block of stripes), the slope and
+the curvature of the fitness around the reference. Each perturbation
+touches a random subset of the blocks (each block with probability
+`density`, with a random sign), and is measured at +delta and -delta:
+
+    d_k = (f(x + delta D_k) - f(x - delta D_k)) / (2 delta)   ~ D_k . gradient
+    s_k = (f(x + delta D_k) + f(x - delta D_k) - 2 f(x)) / delta^2
+                                                      ~ sum_i D_ki^2 H_ii
+
+The off-diagonal terms average out over the random signs, so the gradient
+and the diagonal curvature are the least-squares solutions of these two
+linear systems. Neighbouring stripes shape neighbouring frequencies, so
+the solutions are regularized towards a smooth map (penalty on the second
+differences between the blocks); with it about pd / 2 pairs already give
+the map, i.e. 2 * n_pairs + n_ref evaluations instead of 2 * pd.
+
+The sensitivity of a stripe is the fitness change expected for a step of
+delta: |g| delta + |h| delta^2 / 2. Stripes whose sensitivity stays within
+the measurement noise can be frozen (see active_mask and the `active`
+argument of cs.crow_search).
+
+Usage (simulator):
+    python sensitivity.py --pd 40 --pairs 30 --store sens_store
+'''
+
+import argparse
+import numpy as np
+
+SENSITIVITY_ARRAY = 'sensitivity'          # ExperimentStore array: rows gradient, curvature, sensitivity
+REFERENCE_ARRAY = 'sensitivity_reference'
+
+
+def block_index(pd, block=1):
+    '''Block of every stripe, blocks of `block` neighbouring stripes'''
+    return np.arange(pd) // block
+
+
+def _solve(design, values, smooth, ridge):
+    '''
+    Regularized least-squares solution of design @ beta = values, penalizing
+    the second differences of beta (smooth) and its norm (ridge), both
+    relative to the mean diagonal of the normal equations
+    '''
+    n = design.shape[1]
+    gram = design.T @ design
+    scale = max(np.trace(gram) / n, 1e-12)
+    penalty = ridge * np.eye(n)
+    if n > 2:
+        d2 = np.diff(np.eye(n), 2, axis=0)
+        penalty = penalty + smooth * d2.T @ d2
+    return np.linalg.solve(gram + scale * penalty, design.T @ values)
+
+
+def profile(evaluate, reference, n_pairs=None, delta=64, block=1, density=0.1, n_ref=4,
+            lb=0, ub=1024, smooth=1.0, ridge=1e-3, wrap=True, rng=None, store=None):
+    '''
+    Profiles the sensitivity of the fitness to every stripe of the reference
+    :param evaluate: fitness of a stripe vector, e.g. cs.make_evaluator(...) or SimulatedLaser.objective
+    :param reference: reference stripe vector (pd,)
+    :param n_pairs: number of perturbation pairs, default max(8, number of blocks / 2)
+    :param delta: perturbation size, mask units
+    :param block: stripes per block, the blocks are perturbed (and estimated) together
+    :param density: probability that a block is perturbed in a pair
+    :param n_ref: evaluations of the reference (baseline and noise level)
+    :param lb: lower bound of the stripe values
+    :param ub: upper bound of the stripe values
+    :param smooth: smoothness penalty of the map (second differences between blocks)
+    :param ridge: ridge penalty
+    :param wrap: wrap the perturbed values into lb..ub (phase), otherwise clip
+    :param rng: numpy Generator
+    :param store: ExperimentStore the map is saved to (see save)
+    :return: dict with gradient, curvature, sensitivity (per stripe), noise, baseline, n_evals
+    '''
+    rng = rng or np.random.default_rng()
+    reference = np.asarray(reference, dtype=float)
+    pd = len(reference)
+    blocks = block_index(pd, block)
+    n_blocks = blocks[-1] + 1
+    n_pairs = n_pairs or max(8, n_blocks // 2)
+
+    # the whole design is drawn up front: D (n_pairs, n_blocks) in {-1, 0, 1}
+    signs = rng.choice([-1.0, 1.0], size=(n_pairs, n_blocks))
+    design = signs * (rng.random((n_pairs, n_blocks)) < density)
+    empty = ~design.any(axis=1)
+    design[empty, rng.integers(n_blocks, size=empty.sum())] = 1.0    # every pair perturbs something
+
+    def clamp(vec):
+        if wrap:
+            return lb + np.mod(vec - lb, ub - lb)
+        return np.clip(vec, lb, ub - 1)
+
+    baseline_evals = np.array([evaluate(reference) for _ in range(n_ref)])
+    f0 = baseline_evals.mean()
+    plus = np.empty(n_pairs)
+    minus = np.empty(n_pairs)
+    for k in range(n_pairs):
+        step = delta * design[k, blocks]
+        plus[k] = evaluate(clamp(reference + step))
+        minus[k] = evaluate(clamp(reference - step))
+
+    slope = (plus - minus) / (2 * delta)
+    second = (plus + minus - 2 * f0) / delta ** 2
+    gradient = _solve(design, slope, smooth, ridge)
+    curvature = _solve(design ** 2, second, smooth, ridge)
+
+    sensitivity = np.abs(gradient) * delta + 0.5 * np.abs(curvature) * delta ** 2
+    result = {
+        'gradient': gradient[blocks],
+        'curvature': curvature[blocks],
+        'sensitivity': sensitivity[blocks],
+        'noise': float(baseline_evals.std(ddof=1)) if n_ref > 1 else 0.0,
+        'baseline': float(f0),
+        'delta': delta,
+        'n_evals': n_ref + 2 * n_pairs,
+    }
+    if store is not None:
+        save(store, result, reference)
+    return result
+
+
+def save(store, result, reference):
+    '''Saves the map (rows gradient, curvature, sensitivity) and the reference to the store'''
+    store.save_array(SENSITIVITY_ARRAY, np.stack([result['gradient'], result['curvature'], result['sensitivity']]))
+    store.save_array(REFERENCE_ARRAY, np.asarray(reference))
+
+
+def load(store):
+    '''
+    :return: dict with gradient, curvature, sensitivity and reference, None if not profiled
+    '''
+    if not store.has_array(SENSITIVITY_ARRAY):
+        return None
+    gradient, curvature, sensitivity = np.array(store.load_array(SENSITIVITY_ARRAY))
+    return {'gradient': gradient, 'curvature': curvature, 'sensitivity': sensitivity,
+            'reference': np.array(store.load_array(REFERENCE_ARRAY))}
+
+
+def active_mask(sensitivity, noise=0.0, threshold=2.0, keep=None):
+    '''
+    Stripes worth optimizing
+    :param sensitivity: per-stripe sensitivity (profile()['sensitivity'])
+    :param noise: std of the fitness measurement
+    :param threshold: a stripe is active if its sensitivity exceeds threshold * noise
+    :param keep: keep (at least) this fraction of the stripes, the most sensitive ones
+    :return: boolean array, True for the stripes to optimize
+    '''
+    sensitivity = np.asarray(sensitivity)
+    active = sensitivity > threshold * noise
+    if keep is not None:
+        n_keep = max(1, int(np.ceil(keep * len(sensitivity))))
+        active[np.argsort(sensitivity)[::-1][:n_keep]] = True
+    return active
+
+
+if __name__ == '__main__':
+    from simulator import SimulatedLaser
+
+    parser = argparse.ArgumentParser(description='Stripe sensitivity profile on the simulated laser')
+    parser.add_argument('--pd', type=int, default=40)
+    parser.add_argument('--pairs', type=int, default=None)
+    parser.add_argument('--delta', type=float, default=64)
+    parser.add_argument('--block', type=int, default=1)
+    parser.add_argument('--density', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--store', default=None, help='ExperimentStore directory the map is saved to')
+    args = parser.parse_args()
+
+    laser = SimulatedLaser(seed=args.seed)
+    store = None
+    if args.store:
+        from experiment_store import ExperimentStore
+        store = ExperimentStore(args.store)
+    reference = np.full(args.pd, 512)
+    result = profile(laser.objective, reference, args.pairs, args.delta, args.block, args.density,
+                     rng=np.random.default_rng(args.seed), store=store)
+    active = active_mask(result['sensitivity'], result['noise'])
+    print(f'{result["n_evals"]} evaluations, baseline {result["baseline"]:.4g}, noise {result["noise"]:.3g}')
+    for i, (s, a) in enumerate(zip(result['sensitivity'], active)):
+        print(f'stripe {i:3d}  sensitivity {s:10.4g}  {"active" if a else "frozen"}')
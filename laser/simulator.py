@@ -0,0 +1,95 @@
+'''
+Simulated laser + pulse shaper + autocorrelator.
+
+The SLM columns are mapped linearly onto the laser spectrum. A mask value
+0..1023 adds 0..2pi of spectral phase to its column, on top of the residual
+chirp of the laser (GDD and TOD). The intensity autocorrelation of the
+resulting pulse is returned on the delay axis of the pulseCheck, so the
+simulator can stand in for slm_com.send_mask + ape_com.read_acf.
+'''
+
+import numpy as np
+
+
+class SimulatedLaser:
+    def __init__(self, n_columns=1920, span_thz=10.0, bandwidth_thz=4.0, gdd=0.02, tod=0.0005,
+                 scan_range=50, n_points=10000, noise=0.005, n_fft=8192, seed=None):
+        '''
+        :param n_columns: number of SLM columns (pixels along the spectrum)
+        :param span_thz: optical frequency span covered by the columns, THz
+        :param bandwidth_thz: FWHM of the (gaussian) power spectrum, THz
+        :param gdd: residual group delay dispersion of the laser, ps^2
+        :param tod: residual third order dispersion of the laser, ps^3
+        :param scan_range: scan range of the autocorrelator, ps
+        :param n_points: number of points of the ACF
+        :param noise: std of the additive noise, relative to the ACF peak
+        :param n_fft: FFT size (zero padding of the spectrum)
+        :param seed: seed of the noise generator
+        '''
+        self.n_columns = n_columns
+        self.scan_range = scan_range
+        self.n_points = n_points
+        self.noise = noise
+        self.n_fft = n_fft
+        self.rng = np.random.default_rng(seed)
+
+        d_nu = span_thz / n_columns                      # THz per column
+        nu = (np.arange(n_columns) - n_columns / 2) * d_nu
+        omega = 2 * np.pi * nu                           # rad/ps
+        sigma = bandwidth_thz / (2 * np.sqrt(2 * np.log(2)))
+        self.amplitude = np.exp(-nu ** 2 / (4 * sigma ** 2))
+        self.laser_phase = gdd / 2 * omega ** 2 + tod / 6 * omega ** 3
+        self.dt = 1 / (n_fft * d_nu)                     # ps
+        self.mask_row = np.zeros(n_columns)
+
+    def send_mask(self, mask):
+        '''
+        Displays the mask, only the first row matters (the mask is uniform vertically).
+        A row narrower than the SLM (pd not dividing the width) is padded with its
+        last column, a wider one is cut.
+        :param mask: 2D mask (rows x columns) or a single row, values 0..1023
+        '''
+        mask = np.asarray(mask)
+        row = (mask[0] if mask.ndim == 2 else mask).astype(float)[:self.n_columns]
+        self.mask_row = np.pad(row, (0, self.n_columns - len(row)), mode='edge')
+
+    def acf(self, mask_row=None):
+        '''
+        Noise-free intensity ACF of the pulse shaped with the given row
+        :param mask_row: row of the mask, None uses the displayed one
+        :return: delay (ps), intensity on the autocorrelator delay axis
+        '''
+        row = self.mask_row if mask_row is None else np.asarray(mask_row, dtype=float)
+        phase = self.laser_phase + 2 * np.pi * row / 1024
+        spectrum = np.zeros(self.n_fft, dtype=complex)
+        spectrum[:self.n_columns] = self.amplitude * np.exp(1j * phase)
+        intensity = np.abs(np.fft.ifft(spectrum)) ** 2
+        # intensity autocorrelation via the Wiener-Khinchin theorem
+        acf = np.fft.fftshift(np.fft.ifft(np.abs(np.fft.fft(intensity)) ** 2).real)
+        tau = (np.arange(self.n_fft) - self.n_fft // 2) * self.dt
+
+        delay = np.linspace(-self.scan_range / 2, self.scan_range / 2, self.n_points)
+        return delay, np.interp(delay, tau, acf / acf.max(), left=0, right=0)
+
+    def read_acf(self):
+        '''
+        Measured ACF of the displayed mask (with noise), like ape_com.read_acf
+        :return: delay, intensity (float32)
+        '''
+        delay, intensity = self.acf()
+        intensity = intensity + self.noise * self.rng.standard_normal(len(intensity))
+        return delay.astype(np.float32), intensity.astype(np.float32)
+
+    def objective(self, vec, scan_range=None):
+        '''
+        Fitness of a stripe vector, the simulated counterpart of cs.objective
+        :param vec: stripe vector (0..1023)
+        :return: fitness (see data_processing.calc_pulse_qual)
+        '''
+        import data_processing as data
+
+        vec = np.asarray(vec).astype(int)
+        self.send_mask(np.repeat(vec, self.n_columns // len(vec)))
+        delay, acf = self.read_acf()
+        fwhm, fit, fitness, area = data.calc_pulse_qual(acf, delay, scan_range or self.scan_range)
+        return fitness
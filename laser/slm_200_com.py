@@ -81,6 +81,60 @@ def SLM_Change_Mode(mode, SLM_number):
     return r_mode
 
 
+'''MEMORY MODE'''
+
+
+def SLM_Memory_Write_Data(data, memory_number, width=1920, height=1200, flags=0, SLM_number=1):
+    """
+    Writes array data into the internal pattern memory of the SLM-200 (USB),
+    the device has to be in the memory mode (SLM_Change_Mode(0, ...)).
+
+    :param data: pointer to array of unsigned short data (height x width)
+    :param memory_number: number of the memory slot
+    :param width: data width value
+    :param height: data height value
+    :param flags: use this to change the data format, default: 0
+    :param SLM_number: device number (1-8), default: 1
+    :return: SLM_status
+    """
+
+    r_write = slm.SLM_Ctrl_WriteMI(SLM_number, memory_number, width, height, flags, data)
+
+    if r_write != 0 and str(r_write) in SLM_states:
+        print(f'Writing memory {memory_number}: {SLM_states[str(r_write)]}')
+
+    return r_write
+
+
+def SLM_Memory_Display(memory_number, SLM_number=1):
+    """
+    Displays a pattern from the internal memory of the SLM-200.
+
+    :param memory_number: number of the memory slot
+    :param SLM_number: device number (1-8), default: 1
+    :return: SLM_status
+    """
+
+    r_disp = slm.SLM_Ctrl_WriteDS(SLM_number, memory_number)
+
+    if r_disp != 0 and str(r_disp) in SLM_states:
+        print(f'Displaying memory {memory_number}: {SLM_states[str(r_disp)]}')
+
+    return r_disp
+
+
+def SLM_Memory_Erase(memory_number, SLM_number=1):
+    """
+    Erases a pattern from the internal memory of the SLM-200.
+
+    :param memory_number: number of the memory slot
+    :param SLM_number: device number (1-8), default: 1
+    :return: SLM_status
+    """
+
+    return slm.SLM_Ctrl_WriteME(SLM_number, memory_number)
+
+
 '''DVI CONNECTION'''
 
 
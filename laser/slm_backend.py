@@ -0,0 +1,234 @@
+'''
+SLM device backends.
+
+All the backends display single masks and play back a preloaded population:
+
+    slots = backend.upload(masks)      # starts uploading in the background
+    for slot in slots:
+        backend.show(slot)             # waits for that slot only, then displays it
+
+- DVIBackend streams every mask over DVI (slm_com.send_mask), upload only
+  keeps the masks, so the playback code is the same for every backend.
+- MemoryBackend writes the masks into the internal pattern memory of the
+  SLM-200 over USB and then switches patterns by index. The upload runs in
+  a background thread, mask i can be shown as soon as it is written, so the
+  upload overlaps the evaluation of the masks before it. Two banks of
+  memory slots are used alternately, a new population never overwrites the
+  one uploaded just before it.
+- FakeBackend needs no hardware (Linux, tests); with a SimulatedLaser the
+  displayed mask goes to the simulator.
+
+The SLM driver (Windows DLL) is imported only when a hardware backend is opened.
+'''
+
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+SLM_W = 1920
+SLM_H = 1200
+
+
+class SLMBackend(ABC):
+    width = SLM_W
+    height = SLM_H
+
+    def open(self):
+        return self
+
+    def close(self):
+        pass
+
+    @abstractmethod
+    def display(self, mask):
+        '''Displays a single mask (height x width)'''
+
+    @abstractmethod
+    def upload(self, masks):
+        '''
+        Starts uploading the masks of a population
+        :param masks: array (N, height, width), e.g. data_processing.vecs_to_masks
+        :return: list of N slot handles for show()
+        '''
+
+    @abstractmethod
+    def show(self, slot):
+        '''Displays an uploaded mask, waits until its upload is finished'''
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DVIBackend(SLMBackend):
+    def __init__(self, connect=True):
+        '''
+        :param connect: open the DVI connection in open()
+        '''
+        self.connect = connect
+        self._masks = None
+
+    def open(self):
+        import slm_com
+        self._slm = slm_com
+        if self.connect:
+            slm_com.connect()
+        return self
+
+    def display(self, mask):
+        return self._slm.send_mask(np.ascontiguousarray(mask, dtype=np.int16))
+
+    def upload(self, masks):
+        self._masks = masks
+        return list(range(len(masks)))
+
+    def show(self, slot):
+        return self.display(self._masks[slot])
+
+
+class MemoryBackend(SLMBackend):
+    def __init__(self, slm_number=1, first_slot=1, bank_size=63, spare_slot=None, n_slots=128,
+                 dvi_mode_on_close=True):
+        '''
+        :param slm_number: USB device number (1-8)
+        :param first_slot: first memory slot used
+        :param bank_size: slots per bank, the largest population that can be uploaded
+        :param spare_slot: slot of the single masks (display), default the one after the two banks
+        :param n_slots: memory slots of the device, numbered 1..n_slots
+        :param dvi_mode_on_close: switch the SLM back to the DVI mode in close()
+        '''
+        last_bank_slot = first_slot + 2 * bank_size - 1
+        spare_slot = last_bank_slot + 1 if spare_slot is None else spare_slot
+        if first_slot < 1 or last_bank_slot > n_slots:
+            raise ValueError(f'two banks of {bank_size} slots from slot {first_slot} '
+                             f'do not fit into the {n_slots} memory slots')
+        if not 1 <= spare_slot <= n_slots or first_slot <= spare_slot <= last_bank_slot:
+            raise ValueError(f'spare slot {spare_slot} is outside the memory or inside a bank')
+        self.slm_number = slm_number
+        self.first_slot = first_slot
+        self.bank_size = bank_size
+        self.spare_slot = spare_slot
+        self.dvi_mode_on_close = dvi_mode_on_close
+        self._bank = 0
+        self._ready = {}                    # slot -> future of its upload
+        self._lock = threading.Lock()       # one USB transfer at a time
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='slm-upload')
+
+    def open(self):
+        import slm_200_com
+        self._slm = slm_200_com
+        slm_200_com.SLM_USB_Open_Connection(self.slm_number)
+        slm_200_com.SLM_Change_Mode(0, self.slm_number)        # 0: memory mode
+        return self
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+        if self.dvi_mode_on_close:
+            self._slm.SLM_Change_Mode(1, self.slm_number)
+        self._slm.SLM_USB_Close_Connection(self.slm_number)
+
+    def _write(self, slot, mask):
+        import ctypes
+
+        data = np.ascontiguousarray(mask, dtype=np.uint16)
+        with self._lock:
+            status = self._slm.SLM_Memory_Write_Data(
+                data.ctypes.data_as(ctypes.POINTER(ctypes.c_ushort)), slot,
+                data.shape[1], data.shape[0], 0, self.slm_number)
+        if status != 0:
+            raise RuntimeError(f'[SLM] writing memory slot {slot} failed with status {status}')
+
+    def upload(self, masks):
+        if len(masks) > self.bank_size:
+            raise ValueError(f'{len(masks)} masks do not fit into a bank of {self.bank_size} slots')
+        start = self.first_slot + self._bank * self.bank_size
+        self._bank = 1 - self._bank
+        slots = list(range(start, start + len(masks)))
+        for slot, mask in zip(slots, masks):
+            self._ready[slot] = self._pool.submit(self._write, slot, mask)
+        return slots
+
+    def show(self, slot):
+        future = self._ready.pop(slot, None)
+        if future is not None:
+            future.result()                 # re-raises a failed upload
+        with self._lock:
+            status = self._slm.SLM_Memory_Display(slot, self.slm_number)
+        if status != 0:
+            raise RuntimeError(f'[SLM] displaying memory slot {slot} failed with status {status}')
+        return status
+
+    def display(self, mask):
+        # single masks go through the spare slot, outside the two banks
+        self._write(self.spare_slot, mask)
+        return self.show(self.spare_slot)
+
+
+class FakeBackend(SLMBackend):
+    def __init__(self, laser=None, upload_time=0.0):
+        '''
+        :param laser: SimulatedLaser the displayed masks are sent to, None only keeps them
+        :param upload_time: simulated upload time per mask, seconds
+        '''
+        self.laser = laser
+        self.upload_time = upload_time
+        self.displayed = None
+        self.n_uploaded = 0
+        self._masks = {}
+        self._ready = {}
+        self._next_slot = 0
+        self._banks = [[], []]      # slots of the last two populations
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fake-upload')
+
+    @property
+    def width(self):
+        return self.laser.n_columns if self.laser is not None else SLM_W
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+    def _write(self, slot, mask):
+        if self.upload_time:
+            time.sleep(self.upload_time)
+        self._masks[slot] = mask
+        self.n_uploaded += 1
+
+    def upload(self, masks):
+        slots = list(range(self._next_slot, self._next_slot + len(masks)))
+        self._next_slot += len(masks)
+        # like the two memory banks: drop the population before the previous one
+        for slot in self._banks.pop(0):
+            self._masks.pop(slot, None)
+        self._banks.append(slots)
+        for slot, mask in zip(slots, masks):
+            self._ready[slot] = self._pool.submit(self._write, slot, mask)
+        return slots
+
+    def show(self, slot):
+        future = self._ready.pop(slot, None)
+        if future is not None:
+            future.result()
+        self.display(self._masks[slot])
+
+    def display(self, mask):
+        self.displayed = mask
+        if self.laser is not None:
+            self.laser.send_mask(mask)
+
+
+BACKENDS = {'dvi': DVIBackend, 'memory': MemoryBackend, 'fake': FakeBackend}
+
+
+def make_backend(kind, **kwargs):
+    '''
+    Creates and opens a backend
+    :param kind: 'dvi', 'memory' or 'fake'
+    :param kwargs: passed to the backend
+    '''
+    if kind not in BACKENDS:
+        raise ValueError(f'Unknown SLM backend: {kind}')
+    return BACKENDS[kind](**kwargs).open()
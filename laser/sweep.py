@@ -0,0 +1,205 @@
+'''
+Hyperparameter sweep of the crow search on the simulated laser.
+
+The sweep is declared in the `sweep` section of configs.yaml (named
+variants can override it, see tools.read_configs). Every configuration of
+the grid (or every random sample) is run `repeats` times with different
+seeds, in a process pool across the cores. Each run gets its own
+SimulatedLaser, so nothing is shared between the processes except the
+progress used by the early stopping.
+
+Early stopping (median stopping rule): after `grace` iterations, a run
+whose best fitness is worse than the `quantile` of the best fitness the
+other runs had at the same iteration is stopped, once at least `min_runs`
+runs reached it.
+
+The results are written as one columnar .npz (one array per column, the
+fitness curves as a 2D array padded with nan) and the configurations are
+printed ranked by their mean best fitness.
+
+Usage:
+    python sweep.py                   # the `sweep` section
+    python sweep.py --config sweep_quick    # `sweep` updated with `sweep_quick`
+'''
+
+import argparse
+import contextlib
+import io
+import itertools
+import multiprocessing
+import os
+import pathlib
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent / 'laser_train'))
+from tools import read_configs
+
+CONFIG_FILE = pathlib.Path(__file__).resolve().parent / 'configs.yaml'
+
+
+def expand(params, mode='grid', n_trials=10, rng=None):
+    '''
+    Expands the parameter space into a list of configurations
+    :param params: dict name -> list of values, or (random mode only)
+                   dict(low=, high=, log=False, int=False) for a range
+    :param mode: 'grid' (every combination) or 'random' (n_trials samples)
+    :return: list of dicts
+    '''
+    names = list(params)
+    if mode == 'grid':
+        for name in names:
+            if not isinstance(params[name], list):
+                raise ValueError(f'grid sweep: {name} must be a list of values')
+        return [dict(zip(names, values)) for values in itertools.product(*(params[n] for n in names))]
+    if mode != 'random':
+        raise ValueError(f'Unknown sweep mode: {mode}')
+
+    rng = rng or np.random.default_rng()
+    configs = []
+    for _ in range(n_trials):
+        config = {}
+        for name in names:
+            spec = params[name]
+            if isinstance(spec, list):
+                value = spec[rng.integers(len(spec))]
+            elif spec.get('log'):
+                value = float(np.exp(rng.uniform(np.log(spec['low']), np.log(spec['high']))))
+            else:
+                value = float(rng.uniform(spec['low'], spec['high']))
+            if isinstance(spec, dict) and spec.get('int'):
+                value = int(round(value))
+            config[name] = value
+        configs.append(config)
+    return configs
+
+
+def should_stop(progress, run_id, iteration, best, grace, quantile, min_runs):
+    '''Median stopping rule, see the module docstring'''
+    if iteration < grace:
+        return False
+    others = [curve[iteration] for rid, curve in progress.items()
+              if rid != run_id and len(curve) > iteration]
+    if len(others) < min_runs:
+        return False
+    return best > np.quantile(others, quantile)
+
+
+def run_one(task):
+    '''
+    Runs a single configuration in a worker process
+    :param task: dict with run_id, config_id, params, seed, fixed, simulator, early_stop, progress
+    :return: dict with the results of the run
+    '''
+    import cs
+    from simulator import SimulatedLaser
+
+    params = {**task['fixed'], **task['params']}
+    run_id, seed = task['run_id'], task['seed']
+    np.random.seed(seed)        # the crow search draws from the global generator
+    laser = SimulatedLaser(seed=seed, **task['simulator'])
+    pd, N, AP, fl = int(params['pd']), int(params['N']), params['AP'], params['fl']
+    lb, ub, n_iter = params['lb'], params['ub'], int(params['iter'])
+    progress, early_stop = task['progress'], task['early_stop']
+    curve = []
+
+    def callback(iteration, best):
+        curve.append(best)
+        progress[run_id] = list(curve)
+        return early_stop is not None and should_stop(progress, run_id, iteration, best, **early_stop)
+
+    t0 = time.perf_counter()
+    # the crow search prints every iteration, keep the sweep output readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        if params.get('algorithm', 'generational') == 'steady_state':
+            best, position, fitness_list = cs.crow_search_steady_state(
+                pd, N, AP, fl, N * n_iter, lb, ub, [laser.objective])
+            curve = list(fitness_list[N - 1::N])
+        else:
+            best, position, fitness_list = cs.crow_search(
+                pd, N, AP, fl, n_iter, lb, ub, laser, laser.scan_range, callback=callback)
+    return {
+        'run_id': run_id,
+        'config_id': task['config_id'],
+        'seed': seed,
+        'params': task['params'],
+        'best': float(best),
+        'iterations': len(curve),
+        'stopped': len(curve) < n_iter,
+        'seconds': time.perf_counter() - t0,
+        'curve': curve,
+    }
+
+
+def summarize(results, n_iter):
+    '''Collects the results into columns (arrays), ordered by run_id'''
+    results = sorted(results, key=lambda r: r['run_id'])
+    columns = {key: np.array([r[key] for r in results])
+               for key in ('run_id', 'config_id', 'seed', 'best', 'iterations', 'stopped', 'seconds')}
+    for name in results[0]['params']:
+        columns[f'param_{name}'] = np.array([r['params'][name] for r in results])
+    curves = np.full((len(results), n_iter), np.nan)
+    for row, r in enumerate(results):
+        curves[row, :len(r['curve'])] = r['curve'][:n_iter]
+    columns['curves'] = curves
+    return columns
+
+
+def run_sweep(sweep):
+    '''
+    Runs the sweep
+    :param sweep: namespace with the keys of the `sweep` config section
+    :return: columnar summary (dict of arrays)
+    '''
+    rng = np.random.default_rng(sweep.seed)
+    configs = expand(sweep.params, sweep.mode, getattr(sweep, 'n_trials', 10), rng)
+    seeds = rng.integers(0, 2**31 - 1, size=(len(configs), sweep.repeats))
+    workers = sweep.workers or os.cpu_count()
+    print(f'{len(configs)} configurations x {sweep.repeats} repeats on {workers} workers')
+
+    with multiprocessing.Manager() as manager:
+        progress = manager.dict()
+        tasks = [{'run_id': config_id * sweep.repeats + r, 'config_id': config_id, 'params': config,
+                  'seed': int(seeds[config_id, r]), 'fixed': sweep.fixed, 'simulator': sweep.simulator,
+                  'early_stop': sweep.early_stop, 'progress': progress}
+                 for config_id, config in enumerate(configs) for r in range(sweep.repeats)]
+        results = []
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(run_one, task) for task in tasks]
+            for future in as_completed(futures):
+                r = future.result()
+                results.append(r)
+                status = 'stopped' if r['stopped'] else 'done'
+                print(f'[{len(results)}/{len(tasks)}] run {r["run_id"]} {r["params"]}: '
+                      f'best {r["best"]:.4g} after {r["iterations"]} iterations ({status}, {r["seconds"]:.1f} s)')
+
+    return summarize(results, int(sweep.fixed['iter']))
+
+
+def print_ranking(summary, top=10):
+    '''Prints the configurations ranked by their mean best fitness over the repeats'''
+    names = [key for key in summary if key.startswith('param_')]
+    config_ids = np.unique(summary['config_id'])
+    means = np.array([summary['best'][summary['config_id'] == c].mean() for c in config_ids])
+    print('\nrank  mean best  ' + '  '.join(name[len('param_'):] for name in names))
+    for rank, idx in enumerate(np.argsort(means)[:top]):
+        row = np.flatnonzero(summary['config_id'] == config_ids[idx])[0]
+        values = '  '.join(f'{summary[name][row]:.4g}' for name in names)
+        print(f'{rank + 1:4d}  {means[idx]:9.4g}  {values}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Hyperparameter sweep of the crow search on the simulator')
+    parser.add_argument('--config', default=None, help='config section overriding the sweep section')
+    parser.add_argument('--config-file', default=str(CONFIG_FILE))
+    parser.add_argument('--out', default=None, help='summary .npz, overrides the config')
+    args = parser.parse_args()
+
+    sweep = read_configs(args.config_file, 'sweep', args.config)
+    summary = run_sweep(sweep)
+    out = args.out or sweep.out
+    np.savez(out, **summary)
+    print(f'summary saved to {out}')
+    print_ranking(summary)
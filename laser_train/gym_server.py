@@ -3,27 +3,43 @@
 Gymnasium environment *and* Flask server in one file.
 
 step(action)
-    ├─ puts ("send_mask", [action]) into task_q
-    ├─ …blocks until client POSTs {"action":"response", "result": …}
-    └─ returns (obs=result, reward=0, terminated=False, truncated=False, info={})
+    ├─ puts ("send_mask", [action]) into task_q, ("read_acf", [""]) is chained
+    │  to it: queued when the mask is shown, or handed out in the same batch
+    ├─ …blocks until client POSTs {"action":"response", "result": …} for both
+    │  (matched by task_id, several clients may answer out of order)
+    └─ returns (obs=result, reward, terminated=False, truncated=False, info)
+
+reward comes from the cheap postprocess.reward_fn (0 without one); heavy
+analyses run on a worker pool (postprocess.py) and their results arrive in
+info["analysis"] of a later step, step() never waits for them.
 
 The Flask route keeps answering client /rpc calls with either
     {"action":"wait", "args":[1]}          or
     {"action":"execute", "args":["send_mask", [action]]}
-exactly like your previous server.py.
+exactly like your previous server.py. The reply to a response carries the
+next queued task, unless the client posts "next": false. A query with
+"max_tasks": n > 1 (pipelined client) gets up to n queued tasks at once:
+    {"action":"batch", "tasks":[{"args":[...], "task_id":…}, …]}
 """
 from __future__ import annotations
-import threading, queue, time, json
+import threading, queue, time, json, itertools
+from collections import deque
 from typing import Any
 
 import numpy as np
 import gymnasium as gym
 from gymnasium import spaces
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 import random
 
-import sys
-sys.path.append('../laser')
+from metrics import METRICS, CONTENT_TYPE
+from tracing import TRACER, now_us
+from tools import request_json
+from postprocess import PostProcessor
+from scheduler import SchedulerClient
+
+import sys, pathlib
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent / "laser"))
 #from data_processing.py import vec_to_mask
 
 # ──────────────────────────────────────────────────────────────────────────
@@ -35,20 +51,104 @@ class RemoteMaskEnv(gym.Env):
     def __init__(self,
                  host: str = "0.0.0.0",
                  port: int = 9400,
-                 default_wait: int = 1):
-        """Start the Flask server in a background thread and expose a Gym env."""
+                 default_wait: int = 1,
+                 n_stripes: int = 20,
+                 trace: bool = False,
+                 basis: str | None = None,
+                 coeff_bound: float = 2048.0,
+                 postprocess: PostProcessor | None = None,
+                 bench_url: str | None = None,
+                 experiment: str = "rl",
+                 weight: float = 1.0,
+                 priority: int = 0,
+                 latency: str = "interactive",
+                 library=None,
+                 bench_id: str = "default",
+                 active=None,
+                 reference=None,
+                 drift=None,
+                 task_timeout: float | None = 30.0,
+                 step_timeout: float | None = None):
+        """Start the Flask server in a background thread and expose a Gym env.
+
+        n_stripes is the number of mask stripes, i.e. the action dimension.
+        trace enables the timeline tracing (see tracing.py, dump_trace()).
+        basis selects a parametric phase mask (laser/phase_basis.py): the
+        action is then n_stripes basis coefficients in -coeff_bound..coeff_bound
+        (mask units) and the client renders the mask from them.
+        postprocess computes the reward and runs the background analyses of
+        every ACF (see postprocess.py).
+        bench_url shares a bench with other experiments: instead of serving
+        the client itself, the env submits its steps as jobs of `experiment`
+        to the scheduling server (server.py) at that URL, with the given
+        weight, priority and latency class (see scheduler.py).
+        library is a MaskLibrary (laser/mask_library.py): reset() then starts
+        the episode from the best mask measured before on bench_id (info
+        holds the best and most diverse masks, "seed_masks"), and the steps
+        whose "pulse_qual" analysis completes are added to it.
+        active (boolean, n_stripes) freezes the other stripes at reference
+        (laser/sensitivity.py: active_mask), whatever the agent sends there.
+        drift is a DriftTracker (laser/drift.py): its reference masks are
+        measured whenever due (scored with the reward function) and the
+        rewards are normalized against the drift baseline, info["drift"]
+        holds the current drift.
+        A task handed out to a client is leased: without a response within
+        task_timeout seconds (reply lost, client gone) it is queued again
+        under the same task_id, a late duplicate response is dropped.
+        step_timeout bounds the wait of step() for its results, TimeoutError.
+        """
         super().__init__()
 
+        self.basis = basis
+        self.postprocess = postprocess or PostProcessor()
+        self._step_id = 0
+        self.library = library
+        if drift is not None and self.postprocess.reward_fn is None:
+            raise ValueError("drift needs a reward function (postprocess.reward_fn) "
+                             "to score the reference masks")
+        self.drift = drift
+        self._n_steps = 0
+        self._frozen = None if active is None else ~np.asarray(active, dtype=bool)
+        self._reference = None if reference is None else np.asarray(reference)
+        self.bench_id = bench_id
+        self._actions: dict[int, Any] = {}     # step -> action, until its analysis is in
+        if basis is None:
+            low, high = 0.0, 1023.0
+        else:
+            low, high = -coeff_bound, coeff_bound
         self.action_space = spaces.Box(
-            low=0.0,
-            high=1023.0,
-            shape=(20,),
+            low=low,
+            high=high,
+            shape=(n_stripes,),
             dtype=np.int32,                # continuous, uniform bounds per dim
         )
 
-        self._task_q: "queue.Queue[tuple[str, list[Any]]]" = queue.Queue()
-        self._result_q: "queue.Queue[Any]" = queue.Queue()
+        # tasks are (task_id, func_name, func_args, enqueue_time)
+        self._task_q: "queue.Queue[tuple[int, str, list[Any], float]]" = queue.Queue()
+        # task_id of a task -> the task that may only run once it is done
+        self._chained: "dict[int, tuple[int, str, list[Any], float]]" = {}
+        self._chain_lock = threading.Lock()
+        # task_id -> result, step() waits on the condition for its own ids
+        self._results: "dict[int, Any]" = {}
+        self._results_cond = threading.Condition()
+        # task_id -> (task, dispatch time) of the tasks handed out, not answered
+        self._leased: "dict[int, tuple[tuple[int, str, list[Any], float], float]]" = {}
+        self._lease_lock = threading.Lock()
+        self._task_timeout = task_timeout
+        self._step_timeout = step_timeout
         self._DEFAULT_WAIT = default_wait
+        self._task_ids = itertools.count()
+        # ids of the answered tasks, to drop responses re-sent by a retry
+        self._done_ids: "deque[int]" = deque(maxlen=1024)
+        self._done_lock = threading.Lock()
+        if trace:
+            TRACER.enable("trainer + rpc server")
+
+        self._bench = None
+        self._server = None
+        if bench_url is not None:
+            self._bench = SchedulerClient(bench_url, experiment, weight, priority, latency)
+            return
   
         # ------------------------------------------------------------------
         # Build the Flask app and launch it
@@ -57,86 +157,292 @@ class RemoteMaskEnv(gym.Env):
         
         @app.post("/rpc")
         def rpc():
-            data = request.get_json(force=True) or {}
+            t_recv = now_us()
+
+            def reply(payload):
+                # server timestamps let the client estimate its clock offset
+                if TRACER.enabled:
+                    payload["server_time"] = [t_recv, now_us()]
+                return jsonify(payload)
+
+            def next_task(max_tasks=1):
+                self._requeue_expired()
+                # Does the env have a task ready for the client?
+                tasks = []
+                while len(tasks) < max_tasks:
+                    try:
+                        task_id, func_name, func_args, t_put = self._task_q.get_nowait()
+                    except queue.Empty:
+                        break
+                    self._lease((task_id, func_name, func_args, t_put))
+                    METRICS.observe("queue_wait_seconds", time.time() - t_put)
+                    TRACER.complete("queue_wait", t_put * 1e6, t_recv - t_put * 1e6,
+                                    trace_id=task_id, task=func_name)
+                    tasks.append({"args": [func_name, func_args], "task_id": task_id})
+                    if len(tasks) < max_tasks:
+                        # the same client runs the batch in order, the
+                        # chained task can go along with its predecessor
+                        with self._chain_lock:
+                            follower = self._chained.pop(task_id, None)
+                        if follower is not None:
+                            self._lease(follower)
+                            f_id, f_name, f_args, _ = follower
+                            tasks.append({"args": [f_name, f_args], "task_id": f_id})
+                METRICS.set("queue_depth", self._task_q.qsize())
+                if not tasks:
+                    return reply({"action": "wait",
+                                  "args": [self._DEFAULT_WAIT]})
+                if max_tasks > 1:
+                    return reply({"action": "batch", "tasks": tasks})
+                return reply({"action": "execute", **tasks[0]})
+
+            data = request_json(request) or {}
             act = data.get("action")
+            METRICS.inc("rpc_requests_total", action=str(act))
             if act == "query":
-                # Does the env have a task ready for the client?
-                try:
-                    func_name, func_args = self._task_q.get_nowait()
-                    print ('DEB', func_name, func_args)
-                    return jsonify({"action": "execute",
-                                    "args": [func_name, func_args]})
-                except queue.Empty:
-                    return jsonify({"action": "wait",
-                                    "args": [self._DEFAULT_WAIT]})
+                return next_task(int(data.get("max_tasks", 1)))
 
             elif act == "response":
-                res = data.get("result")
-                # Push result back to the waiting step()
-                self._result_q.put(res)
-                # Tell client to wait a moment before next poll
-                return jsonify({"action": "wait",
-                                "args": [self._DEFAULT_WAIT]})
+                task_id = data.get("task_id")
+                METRICS.record_client(data.get("timings"), data.get("counts"))
+                trace = data.get("trace")
+                if trace:
+                    TRACER.merge(trace["events"], trace.get("offset_us", 0.0))
+                with self._done_lock:
+                    duplicate = task_id is not None and task_id in self._done_ids
+                    if not duplicate:
+                        if task_id is not None:
+                            self._done_ids.append(task_id)
+                if task_id is not None:
+                    with self._lease_lock:
+                        self._leased.pop(task_id, None)
+                if not duplicate and task_id is not None:
+                    # the chained task may run now (before next_task below,
+                    # so this client is the first to get it)
+                    with self._chain_lock:
+                        follower = self._chained.pop(task_id, None)
+                    if follower is not None:
+                        self._task_q.put(follower)
+                    # Push result back to the waiting step()
+                    with self._results_cond:
+                        self._results[task_id] = data.get("result")
+                        self._results_cond.notify_all()
+                if duplicate:
+                    METRICS.inc("duplicate_responses_total")
+                    return reply({"action": "wait",
+                                  "args": [self._DEFAULT_WAIT]})
+                TRACER.complete("rpc.response", t_recv, now_us() - t_recv, trace_id=task_id)
+                if data.get("next", True):
+                    # save the client a poll: hand out the next task right away
+                    return next_task()
+                return reply({"action": "wait",
+                              "args": [self._DEFAULT_WAIT]})
             else:
                 print ('ERROR: ', act)
                 return jsonify({"error": "unknown action"}), 400
 
-        # run() blocks, so put it in a daemon thread
+        @app.after_request
+        def count_bytes(response):
+            if request.path == "/rpc":
+                METRICS.inc("rpc_request_bytes_total", request.content_length or 0)
+                METRICS.inc("rpc_response_bytes_total", response.calculate_content_length() or 0)
+            return response
+
+        @app.get("/trace")
+        def trace():
+            return jsonify(TRACER.to_chrome())
+
+        @app.get("/metrics")
+        def metrics():
+            METRICS.set("queue_depth", self._task_q.qsize())
+            return Response(METRICS.render(), mimetype=CONTENT_TYPE)
+
+        # HTTP/1.1 keeps the client connections alive between the polls;
+        # a persistent connection holds its handler thread, hence threaded
+        from werkzeug.serving import WSGIRequestHandler, make_server
+
+        class KeepAliveHandler(WSGIRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+        # make_server binds the port right away, so the env is ready as soon
+        # as __init__ returns; serve_forever() blocks, so it gets a daemon thread
+        self._server = make_server(host, port, app, threaded=True,
+                                   request_handler=KeepAliveHandler)
         self._server_thread = threading.Thread(
-            target=app.run,
-            kwargs=dict(host=host, port=port, threaded=False),
+            target=self._server.serve_forever,
             daemon=True,
         )
         self._server_thread.start()
-        # Give the server a moment to bind the port
-        time.sleep(0.5)
 
     # ------------------------------------------------------------------
     # Gymnasium API
     # ------------------------------------------------------------------
     def reset(self, *, seed: int | None = None, options=None):
         super().reset(seed=seed)
+        options = options or {}
+        if self.library is not None:
+            # warm start: begin at the previous optimum instead of anywhere
+            seeds = self.library.seeds(self.action_space.shape[0], options.get("n_seeds", 1),
+                                       self.bench_id, self.basis or "stripes")
+            if len(seeds) and options.get("warm_start", True):
+                obs, _, _, _, info = self.step(seeds[0])
+                return obs, {**info, "seed_masks": seeds}
+            return np.array([0.0], dtype=np.float64), {"seed_masks": seeds}
         # Nothing to do on the server side for a reset; just return dummy obs
         self._last_obs = 0.0
         return np.array([self._last_obs], dtype=np.float64), {}
 
 
+    def _put_task(self, func_name: str, func_args: Any, after: int | None = None) -> int:
+        """Queue a task; with after, only once the task `after` is done."""
+        task_id = next(self._task_ids)
+        task = (task_id, func_name, func_args, time.time())
+        if after is None:
+            self._task_q.put(task)
+        else:
+            with self._chain_lock:
+                self._chained[after] = task
+        METRICS.set("queue_depth", self._task_q.qsize())
+        return task_id
+
+    def _lease(self, task):
+        """Remember a handed-out task until its response is in."""
+        with self._lease_lock:
+            self._leased[task[0]] = (task, time.monotonic())
+
+    def _requeue_expired(self):
+        """Queue the leased tasks again that got no response in task_timeout."""
+        if self._task_timeout is None:
+            return
+        now = time.monotonic()
+        with self._lease_lock:
+            expired = [tid for tid, (_, t) in self._leased.items() if now - t > self._task_timeout]
+            tasks = [self._leased.pop(tid)[0] for tid in expired]
+        for task in sorted(tasks):
+            METRICS.inc("requeued_tasks_total", task=task[1])
+            self._task_q.put(task)
+
+    def _wait_result(self, task_id: int) -> Any:
+        """Block until the response of task_id is in and return its result."""
+        with self._results_cond:
+            if not self._results_cond.wait_for(lambda: task_id in self._results, self._step_timeout):
+                raise TimeoutError(f"no response to task {task_id} in {self._step_timeout} s")
+            return self._results.pop(task_id)
+
+    def dump_trace(self, path: str):
+        """Write the merged trainer/server/client timeline (Chrome-trace JSON)."""
+        TRACER.dump(path)
+
     def step(self, action):
         """
-        1. Enqueue the task (“send_mask” with the given action as its arg).
-        2. Block until the client POSTs a response.
-        3. Return that response as the observation.
+        1. Enqueue the tasks (“send_mask” with the given action as its arg,
+           then “read_acf” chained to it: a client gets the read together
+           with the mask in a batch, or once the mask is shown).
+        2. Block until the client POSTs the responses (matched by task_id).
+        3. Return the ACF as the observation.
         """
-        # 1. Tell the client what to do
-
+        t_step = time.perf_counter()
+        t_step_us = now_us()
+        if self._frozen is not None:
+            action = np.array(action)
+            action[self._frozen] = self._reference[self._frozen]
+        if self.library is not None:
+            self._actions[self._step_id] = np.asarray(action)
+        if self.drift is not None and self.drift.due(self._n_steps):
+            self._measure_references()
+        self._n_steps += 1
+        result, task_ids = self._measure(action)
+        return self._finish_step(result, t_step, t_step_us, task_ids)
 
-        self._task_q.put(("send_mask", action))
+    def _measure(self, action):
+        """Display the mask of the action and read the ACF: (result, task ids)."""
+        # 1. Tell the client what to do (JSON: agents hand in numpy arrays)
+        action = np.asarray(action).tolist()
+        if self.basis is not None:
+            action = {"basis": self.basis, "coeffs": action}
+        if self._bench is not None:
+            return self._measure_shared(action), []
+        mask_id = self._put_task("send_mask", action)
+        # Read the ACF of this mask, never before it is shown
+        acf_id = self._put_task("read_acf", [''], after=mask_id)
 
         # 2. Wait for the client's result (this **blocks**)
-        _ = self._result_q.get()
+        with METRICS.span("wait_result", task="send_mask"), \
+                TRACER.span("wait_result", trace_id=mask_id):
+            self._wait_result(mask_id)
 
-        # Read the ACF (probably current state)
-        self._task_q.put(("read_acf", ['']))
-        
         # 2. Wait for the client's result (this **blocks**)
-        result = self._result_q.get()
+        with METRICS.span("wait_result", task="read_acf"), \
+                TRACER.span("wait_result", trace_id=acf_id):
+            result = self._wait_result(acf_id)
+        return result, [mask_id, acf_id]
 
-        # Flatten the list of lists - result contains [delays, intensities]
-        result = [item for sublist in result for item in sublist]
-        # 3. Build Gymnasium‑style return values
-        obs = np.array([result], dtype=np.float64)
-        reward = 0.0                 # put your own logic here
+    def _measure_shared(self, action):
+        """_measure() on a shared bench: one job, the two tasks run back to back."""
+        with METRICS.span("wait_result", task="job"):
+            _, result = self._bench.run([("send_mask", action), ("read_acf", [''])])
+        return result
+
+    def _measure_references(self):
+        """One round of the drift reference masks, scored like the steps."""
+        values = []
+        with METRICS.span("drift_references"):
+            for ref in self.drift.references:
+                delay, intensity = self._measure(ref)[0]
+                values.append(self.postprocess.reward(np.asarray(delay), np.asarray(intensity)))
+        self.drift.record(values, n_evals=self._n_steps)
+
+    def _finish_step(self, result, t_step, t_step_us, task_ids):
+        with METRICS.span("score"):
+            # result contains [delays, intensities]
+            delay = np.asarray(result[0], dtype=np.float64)
+            intensity = np.asarray(result[1], dtype=np.float64)
+            # 3. Build Gymnasium‑style return values
+            obs = np.concatenate([delay, intensity])[None, :]
+            reward = self.postprocess.reward(delay, intensity)
+            if self.drift is not None:
+                reward = float(self.drift.normalize(reward, self.drift.clock()))
+            # the heavy analyses go to the pool, finished ones come back here
+            self.postprocess.submit(self._step_id, delay, intensity)
+            analysis = self.postprocess.collect()
+            if self.library is not None:
+                self._add_to_library(analysis)
         terminated = False
         truncated = False
-        info = {"info": ""}
+        info = {"info": "", "step_id": self._step_id, "analysis": analysis}
+        if self.drift is not None:
+            info["drift"] = float(self.drift.baseline(self.drift.clock()))
+        self._step_id += 1
 
+        METRICS.inc("steps_total")
+        METRICS.observe("step_seconds", time.perf_counter() - t_step)
+        TRACER.complete("step", t_step_us, now_us() - t_step_us, tasks=task_ids)
         return obs, reward, terminated, truncated, info
 
+    def _add_to_library(self, analysis):
+        """Add the masks of the steps whose pulse quality came in."""
+        n_terms = self.action_space.shape[0]
+        for step_id, results in analysis.items():
+            action = self._actions.pop(step_id, None)
+            quality = results.get("pulse_qual", {}).get("pulse_qual")
+            if action is not None and quality is not None:
+                self.library.add(n_terms, action, [quality], self.bench_id, self.basis or "stripes")
+        # steps that never get a pulse_qual analysis must not pile up
+        for step_id in [s for s in self._actions if s < self._step_id - 1024]:
+            del self._actions[step_id]
+
     # (Optional) tidy shutdown if you ever close the env explicitly
     def close(self):
         super().close()
-        # The Flask dev server stops when the main program exits, so nothing
-        # special is required here.
+        self.postprocess.close()
+        if self.library is not None:
+            # the analyses finished while closing the pool
+            self._add_to_library(self.postprocess.collect())
+            self.library.flush()
+        # stop serving and release the port
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
 
 
 # ──────────────────────────────────────────────────────────────────────────
@@ -148,7 +454,7 @@ if __name__ == "__main__":
     print("RESET  →", obs)
 
     for step_id in range(4):             # will queue 4 send_mask jobs
-        action = [random.randint(0, 1023) for _ in range(20)]
+        action = [random.randint(0, 1023) for _ in range(env.action_space.shape[0])]
         print(f"STEP {step_id}: waiting for client…")
         obs, r, term, trunc, info = env.step(action)
         print("   result from client →", obs.shape, type(obs))
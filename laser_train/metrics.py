@@ -0,0 +1,131 @@
+"""
+Low-overhead metrics: counters, gauges and histograms rendered in the
+Prometheus text format (served on /metrics by the servers).
+
+Usage:
+    METRICS.inc("steps_total")
+    with METRICS.span("step"):              # observes step_seconds
+        ...
+    timings = {}
+    with timed(timings, "send_mask"):       # accumulates into a plain dict
+        ...
+"""
+from __future__ import annotations
+import threading, time
+from contextlib import contextmanager
+from bisect import bisect_left
+
+# seconds, from 100 µs to 1 min
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _fmt_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)      # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict = {}
+        self._gauges: dict = {}
+        self._histograms: dict = {}
+        self._start = time.time()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram()
+            hist.observe(value)
+
+    @contextmanager
+    def span(self, name: str, **labels):
+        """Observe the duration of the block in the `<name>_seconds` histogram."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - t0, **labels)
+
+    def render(self) -> str:
+        """Return all the metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            self._gauges[_key("uptime_seconds", {})] = time.time() - self._start
+            typed = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} counter")
+                    typed.add(name)
+                lines.append(f"{name}{_fmt_labels(labels)} {value}")
+            for (name, labels), value in sorted(self._gauges.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} gauge")
+                    typed.add(name)
+                lines.append(f"{name}{_fmt_labels(labels)} {value}")
+            for (name, labels), hist in sorted(self._histograms.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for le, count in zip(hist.buckets, hist.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_fmt_labels(labels, [('le', le)])} {cumulative}")
+                lines.append(f"{name}_bucket{_fmt_labels(labels, [('le', '+Inf')])} {hist.count}")
+                lines.append(f"{name}_sum{_fmt_labels(labels)} {hist.sum}")
+                lines.append(f"{name}_count{_fmt_labels(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def record_client(self, timings: dict | None, counts: dict | None):
+        """Merge the timings and counters piggy-backed on a client response."""
+        for phase, seconds in (timings or {}).items():
+            self.observe("client_phase_seconds", seconds, phase=phase)
+        for name, value in (counts or {}).items():
+            self.inc(f"client_{name}_total", value)
+
+
+METRICS = Metrics()
+
+# Content type of the Prometheus text format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@contextmanager
+def timed(timings: dict, name: str):
+    """Add the duration of the block (seconds) to timings[name]."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - t0
@@ -0,0 +1,172 @@
+"""
+ACF post-processing off the step path.
+
+PostProcessor splits the work done on every measured ACF in two:
+
+reward_fn
+    cheap, computed synchronously in step() because the agent needs it now.
+
+analyses
+    heavy work (pulse quality, sech² fit, spectral features, …) submitted to a
+    thread or process pool. step() never waits for it: finished results are
+    handed out with the info of a later step (info["analysis"]) and, with a
+    store, appended to the ExperimentStore table "analysis_<name>".
+
+    post = PostProcessor(reward_fn=peak_reward,
+                         analyses={"pulse_qual": partial(pulse_qual, scan_range=50)},
+                         executor="process", store=ExperimentStore("runs/x"))
+    reward = post.reward(delay, intensity)
+    post.submit(step_id, delay, intensity)
+    info["analysis"] = post.collect()         # {step_id: {name: result}}
+
+The analyses in a process pool must be picklable (module-level functions or
+functools.partial of them).
+"""
+from __future__ import annotations
+import threading, time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+from typing import Any, Callable
+
+import numpy as np
+
+from metrics import METRICS
+
+import sys, pathlib
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent / "laser"))
+
+Analysis = Callable[[np.ndarray, np.ndarray], "dict[str, Any]"]
+
+
+# ──────────────────────────────────────────────────────────────────────────
+#  Analyses (module level, so they can run in a process pool)
+# ──────────────────────────────────────────────────────────────────────────
+def peak_reward(delay: np.ndarray, intensity: np.ndarray) -> float:
+    """Peak over mean of the background-free ACF: grows as the pulse gets shorter."""
+    y = np.asarray(intensity, dtype=np.float64)
+    y = y - y.min()
+    mean = y.mean()
+    return float(y.max() / mean) if mean > 0 else 0.0
+
+
+def pulse_qual(delay: np.ndarray, intensity: np.ndarray, scan_range: float = 50) -> dict[str, Any]:
+    """FWHM and pulse quality of data_processing.calc_pulse_qual."""
+    import data_processing as data
+    # calc_pulse_qual shifts the delay axis in place, work on a copy
+    fwhm, fit, quality, area = data.calc_pulse_qual(np.asarray(intensity), np.array(delay), scan_range)
+    return {"fwhm": float(fwhm), "pulse_qual": float(quality), "area": float(area)}
+
+
+def sech2_fit(delay: np.ndarray, intensity: np.ndarray) -> dict[str, Any]:
+    """Least-squares sech² fit (pulse_fit.fit): FWHM, pulse duration and their errors."""
+    import pulse_fit
+    r = pulse_fit.fit(delay, intensity, "sech2")
+    return {"fit_fwhm": float(r.fwhm[0]), "fit_fwhm_err": float(r.fwhm_err[0]),
+            "pulse_fwhm": float(r.pulse_fwhm[0]), "fit_rms": float(r.rms[0]),
+            "fit_converged": bool(r.converged[0])}
+
+
+def acf_moments(delay: np.ndarray, intensity: np.ndarray) -> dict[str, Any]:
+    """Peak position, centroid and rms width of the background-free ACF."""
+    delay = np.asarray(delay, dtype=np.float64)
+    y = np.asarray(intensity, dtype=np.float64)
+    y = y - y.min()
+    total = y.sum() or 1.0
+    centroid = float((delay * y).sum() / total)
+    return {"peak_delay": float(delay[np.argmax(y)]),
+            "centroid": centroid,
+            "rms_width": float(np.sqrt(((delay - centroid) ** 2 * y).sum() / total))}
+
+
+# ──────────────────────────────────────────────────────────────────────────
+#  Post-processor
+# ──────────────────────────────────────────────────────────────────────────
+class PostProcessor:
+    def __init__(self,
+                 reward_fn: Callable[[np.ndarray, np.ndarray], float] | None = None,
+                 analyses: dict[str, Analysis] | None = None,
+                 executor: str = "thread",
+                 max_workers: int = 2,
+                 store=None):
+        """reward_fn runs in step(); analyses run on a "thread" or "process"
+        pool of max_workers. store is an optional ExperimentStore the analysis
+        results are appended to."""
+        if executor not in ("thread", "process"):
+            raise ValueError(f"Unknown executor: {executor}")
+        self.reward_fn = reward_fn
+        self.analyses = dict(analyses or {})
+        self.store = store
+        self._pool = None
+        if self.analyses:
+            pool_cls = ThreadPoolExecutor if executor == "thread" else ProcessPoolExecutor
+            self._pool = pool_cls(max_workers=max_workers)
+        self._cond = threading.Condition()
+        self._store_lock = threading.Lock()             # the store is not thread-safe
+        self._remaining: dict[int, int] = {}            # step -> analyses not done yet
+        self._done: dict[int, dict[str, Any]] = {}
+
+    def reward(self, delay: np.ndarray, intensity: np.ndarray) -> float:
+        if self.reward_fn is None:
+            return 0.0
+        return float(self.reward_fn(delay, intensity))
+
+    def submit(self, step_id: int, delay: np.ndarray, intensity: np.ndarray):
+        """Start the analyses of a step, returns immediately."""
+        if self._pool is None:
+            return
+        t_submit = time.perf_counter()
+        with self._cond:
+            # registered first: a fast analysis may finish before submit returns
+            self._remaining[step_id] = len(self.analyses)
+            METRICS.set("analysis_pending", len(self._remaining))
+        for name, fn in self.analyses.items():
+            # every analysis gets its own arrays, one may modify them in place
+            future = self._pool.submit(fn, np.array(delay), np.array(intensity))
+            future.add_done_callback(
+                lambda f, name=name: self._finished(step_id, name, f, t_submit))
+
+    def _finished(self, step_id: int, name: str, future: Future, t_submit: float):
+        # runs in a pool thread (or the callback thread of the process pool)
+        try:
+            result = future.result()
+        except Exception as ex:
+            METRICS.inc("analysis_errors_total", analysis=name)
+            result = {"error": repr(ex)}
+        else:
+            METRICS.observe("analysis_seconds", time.perf_counter() - t_submit, analysis=name)
+        with self._cond:
+            self._done.setdefault(step_id, {})[name] = result
+            self._remaining[step_id] -= 1
+            if self._remaining[step_id] == 0:
+                del self._remaining[step_id]
+                self._cond.notify_all()
+        if self.store is not None and "error" not in result:
+            # outside the condition: a segment flush must not hold up collect()
+            with self._store_lock:
+                self.store.append(f"analysis_{name}", step=step_id, **result)
+
+    def collect(self) -> dict[int, dict[str, Any]]:
+        """Results finished since the last call, {step_id: {name: result}}.
+        A step shows up once all its analyses are done."""
+        with self._cond:
+            ready = [s for s in self._done if s not in self._remaining]
+            return {s: self._done.pop(s) for s in ready}
+
+    def result(self, step_id: int, timeout: float | None = None) -> dict[str, Any]:
+        """Wait for the analyses of one step (for when the agent does need them)."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: step_id not in self._remaining, timeout):
+                raise TimeoutError(f"analysis of step {step_id} not done in {timeout} s")
+            return self._done.pop(step_id, {})
+
+    def drain(self, timeout: float | None = None) -> dict[int, dict[str, Any]]:
+        """Wait for everything submitted so far, return the uncollected results."""
+        with self._cond:
+            self._cond.wait_for(lambda: not self._remaining, timeout)
+        return self.collect()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+        if self.store is not None:
+            with self._store_lock:
+                self.store.flush()
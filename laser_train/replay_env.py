@@ -0,0 +1,158 @@
+"""
+Record-and-replay for RemoteMaskEnv.
+
+RecordingWrapper
+    wraps any env and streams every transition (action, observation,
+    reward, flags, timing) into an ExperimentStore table. The step path only
+    puts the transition on a queue, a writer thread appends it to the store.
+
+ReplayMaskEnv
+    serves logged transitions back as a Gymnasium environment, without the
+    laser, e.g. for offline RL or surrogate training.
+
+load_transitions / iterate_batches
+    dataset helpers reading the memory-mapped segments directly.
+"""
+from __future__ import annotations
+import threading, queue, time
+from typing import Any
+
+import numpy as np
+import gymnasium as gym
+from gymnasium import spaces
+
+import sys, pathlib
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent / "laser"))
+from experiment_store import ExperimentStore
+
+TABLE = "transitions"
+
+
+# ──────────────────────────────────────────────────────────────────────────
+#  Recording
+# ──────────────────────────────────────────────────────────────────────────
+class RecordingWrapper(gym.Wrapper):
+    def __init__(self, env: gym.Env, path: str, chunk_size: int = 256):
+        """Record every transition of `env` into the store at `path`."""
+        super().__init__(env)
+        self.store = ExperimentStore(path, chunk_size=chunk_size)
+        self._q: "queue.Queue[dict[str, Any] | None]" = queue.Queue()
+        self._episode = 0
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            record = self._q.get()
+            if record is None:
+                self.store.flush()
+                return
+            self.store.append(TABLE, **record)
+
+    def reset(self, **kwargs):
+        self._episode += 1
+        return self.env.reset(**kwargs)
+
+    def step(self, action):
+        t_start = time.time()
+        obs, reward, terminated, truncated, info = self.env.step(action)
+        t_end = time.time()
+        self._q.put({
+            "action": np.asarray(action, dtype=np.float32).ravel(),
+            "obs": np.asarray(obs, dtype=np.float32).ravel(),
+            "reward": float(reward),
+            "terminated": bool(terminated),
+            "truncated": bool(truncated),
+            "episode": self._episode,
+            "t_start": t_start,
+            "t_end": t_end,
+        })
+        return obs, reward, terminated, truncated, info
+
+    def close(self):
+        # drain the queue and write the last, partial segment
+        self._q.put(None)
+        self._writer.join()
+        super().close()
+
+
+# ──────────────────────────────────────────────────────────────────────────
+#  Dataset helpers
+# ──────────────────────────────────────────────────────────────────────────
+def load_transitions(path: str, columns: list[str] | None = None):
+    """Return all the recorded transitions as a dict column -> array."""
+    return ExperimentStore(path).load(TABLE, columns)
+
+
+def iterate_batches(path: str, batch_size: int = 256, shuffle: bool = True,
+                    columns: list[str] | None = None, seed: int | None = None):
+    """Yield batches (dict column -> array) of recorded transitions.
+
+    Batches are gathered segment by segment from the memory-mapped files,
+    so the whole dataset never has to fit in memory.
+    """
+    rng = np.random.default_rng(seed)
+    segments = ExperimentStore(path).segments(TABLE)
+    order = rng.permutation(len(segments)) if shuffle else range(len(segments))
+    for seg_idx in order:
+        seg = segments[seg_idx]
+        keys = columns or list(seg)
+        n = len(seg[keys[0]])
+        idx = rng.permutation(n) if shuffle else np.arange(n)
+        for start in range(0, n, batch_size):
+            # sorted indices keep the reads from the memmap sequential
+            batch = np.sort(idx[start:start + batch_size])
+            yield {k: np.asarray(seg[k][batch]) for k in keys}
+
+
+# ──────────────────────────────────────────────────────────────────────────
+#  Replay environment
+# ──────────────────────────────────────────────────────────────────────────
+class ReplayMaskEnv(gym.Env):
+    metadata = {"render_modes": []}
+
+    def __init__(self, path: str, mode: str = "sequential"):
+        """Replay the transitions recorded by RecordingWrapper.
+
+        mode="sequential" ignores the action and returns the logged
+        transitions in order (the logged action is in info["action"]),
+        mode="nearest" returns the transition whose logged action is the
+        closest to the given one.
+        """
+        super().__init__()
+        if mode not in ("sequential", "nearest"):
+            raise ValueError(f"Unknown replay mode: {mode}")
+        self.mode = mode
+        self.data = load_transitions(path)
+        if not self.data:
+            raise ValueError(f"No transitions recorded in {path}")
+
+        n_actions = self.data["action"].shape[1]
+        self.action_space = spaces.Box(
+            low=0.0, high=1023.0, shape=(n_actions,), dtype=np.int32)
+        self._actions = self.data["action"].astype(np.float32)
+        self._idx = 0
+
+    def __len__(self):
+        return len(self._actions)
+
+    def reset(self, *, seed: int | None = None, options=None):
+        super().reset(seed=seed)
+        if self.mode == "sequential" and self._idx >= len(self):
+            self._idx = 0
+        self._last_obs = 0.0
+        return np.array([self._last_obs], dtype=np.float64), {}
+
+    def step(self, action):
+        if self.mode == "nearest":
+            dist = np.sum((self._actions - np.asarray(action, dtype=np.float32)) ** 2, axis=1)
+            idx = int(np.argmin(dist))
+        else:
+            idx = self._idx % len(self)
+            self._idx += 1
+
+        obs = np.asarray(self.data["obs"][idx], dtype=np.float64)[None, :]
+        info = {"action": self._actions[idx], "index": idx,
+                "step_time": float(self.data["t_end"][idx] - self.data["t_start"][idx])}
+        return (obs, float(self.data["reward"][idx]), bool(self.data["terminated"][idx]),
+                bool(self.data["truncated"][idx]), info)
@@ -0,0 +1,315 @@
+"""
+Fair-share scheduling of several experiments on one bench (SLM + pulseCheck).
+
+Experiments (an RL run, a crow search, calibration scans, …) submit *jobs*:
+short lists of tasks that must run back to back on the bench, e.g.
+[("send_mask", mask), ("read_acf", [""])] – a read must not see another
+experiment's mask. The scheduler switches between experiments only between
+jobs, never inside one.
+
+Which job runs next:
+
+1. priority   – a strictly higher priority always goes first.
+2. latency    – a job waiting longer than the target of its latency class
+                ("interactive": LATENCY_TARGETS seconds) goes next, earliest
+                deadline first.
+3. weight     – otherwise weighted fair queuing on the measured service:
+                every experiment has a virtual time that advances by
+                bench seconds / weight as its tasks complete, and the
+                experiment with the smallest virtual time runs. A weight-2
+                experiment so gets about twice the bench time of a weight-1
+                experiment, whatever its tasks cost. An experiment that was
+                idle starts at the smallest virtual time of the busy ones,
+                it cannot bank credit while idle.
+
+A task that gets no response within task_timeout (the bench client died or
+the response was lost) is taken back: its job is queued again from its first
+task, at the head of its experiment, up to max_attempts times; after that its
+future fails with TaskLost. A late response to a taken-back task is ignored.
+
+The bench time of a task is the time from when it was handed out (or the
+previous response, if later) until its response, i.e. the bench is assumed
+to run one task at a time. It is accounted per experiment; utilization() and
+/metrics report it.
+
+    sched = BenchScheduler()
+    sched.register("rl", weight=2, latency="interactive")
+    future = sched.submit("rl", [("send_mask", action), ("read_acf", [""])])
+    # server: sched.next_tasks() on a client query, sched.complete() on a response
+    mask_result, acf = future.result()
+"""
+from __future__ import annotations
+import itertools, threading, time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any
+
+from metrics import METRICS
+
+LATENCY_TARGETS = {"interactive": 0.5, "batch": None}      # seconds of queueing
+
+
+class TaskLost(RuntimeError):
+    """A job whose tasks got no response in any of its attempts."""
+
+
+@dataclass
+class Experiment:
+    name: str
+    weight: float = 1.0
+    priority: int = 0
+    latency: str = "batch"
+    vtime: float = 0.0                  # bench seconds received / weight
+    queue: "deque[Job]" = field(default_factory=deque)
+    busy_seconds: float = 0.0
+    tasks_done: int = 0
+    jobs_done: int = 0
+
+
+@dataclass
+class Job:
+    experiment: Experiment
+    tasks: list                         # [(func_name, func_args), …]
+    future: Future
+    submitted: float
+    results: list = field(default_factory=list)
+    next_index: int = 0                 # next task to hand out
+    attempts: int = 0                   # times the job was handed out
+
+
+class BenchScheduler:
+    def __init__(self, clock=time.monotonic, task_timeout: float | None = 60.0, max_attempts: int = 3):
+        """task_timeout: seconds a handed-out task may go without a response
+        before its job is queued again (None never), max_attempts: times a job
+        is handed out before its future fails with TaskLost."""
+        self.clock = clock
+        self.task_timeout = task_timeout
+        self.max_attempts = max_attempts
+        self.experiments: dict[str, Experiment] = {}
+        self.virtual_time = 0.0                     # smallest vtime of the busy experiments
+        self._current: Job | None = None            # job whose tasks are being handed out
+        self._in_flight: dict[int, tuple[Job, int, float]] = {}   # task_id -> (job, index, t_dispatch)
+        self._task_ids = itertools.count()
+        self._last_response = 0.0
+        self._lock = threading.Lock()
+        self.started = clock()
+
+    # ------------------------------------------------------------------
+    # Experiments and jobs
+    # ------------------------------------------------------------------
+    def register(self, name: str, weight: float = 1.0, priority: int = 0,
+                 latency: str = "batch") -> Experiment:
+        """Add an experiment, or update the settings of a registered one."""
+        if latency not in LATENCY_TARGETS:
+            raise ValueError(f"Unknown latency class: {latency}")
+        if weight <= 0:
+            raise ValueError("weight must be positive")
+        with self._lock:
+            exp = self.experiments.get(name)
+            if exp is None:
+                exp = self.experiments[name] = Experiment(name)
+            exp.weight, exp.priority, exp.latency = float(weight), int(priority), latency
+            return exp
+
+    def submit(self, name: str, tasks: list) -> Future:
+        """Queue a job of experiment `name`; the future resolves to the list of
+        its task results. Unknown experiments are registered with the defaults."""
+        if not tasks:
+            raise ValueError("a job needs at least one task")
+        if name not in self.experiments:
+            self.register(name)
+        with self._lock:
+            exp = self.experiments[name]
+            if not exp.queue and not self._in_service(exp):
+                exp.vtime = max(exp.vtime, self.virtual_time)
+            job = Job(exp, [tuple(t) for t in tasks], Future(), self.clock())
+            exp.queue.append(job)
+            METRICS.set("sched_queued_jobs", len(exp.queue), experiment=name)
+        return job.future
+
+    def _in_service(self, exp: Experiment) -> bool:
+        return any(job.experiment is exp for job, _, _ in self._in_flight.values())
+
+    def queued(self) -> int:
+        return sum(len(exp.queue) for exp in self.experiments.values())
+
+    # ------------------------------------------------------------------
+    # Dispatch
+    # ------------------------------------------------------------------
+    def _pick(self, now: float) -> Job | None:
+        heads = [exp.queue[0] for exp in self.experiments.values() if exp.queue]
+        if not heads:
+            return None
+        top = max(job.experiment.priority for job in heads)
+        heads = [job for job in heads if job.experiment.priority == top]
+
+        def deadline(job):
+            target = LATENCY_TARGETS[job.experiment.latency]
+            return None if target is None else job.submitted + target
+
+        late = [job for job in heads if deadline(job) is not None and deadline(job) <= now]
+        if late:
+            return min(late, key=deadline)
+        self.virtual_time = max(self.virtual_time, min(job.experiment.vtime for job in heads))
+        return min(heads, key=lambda job: job.experiment.vtime)
+
+    def next_tasks(self, max_tasks: int = 1) -> list[dict[str, Any]]:
+        """Tasks for a client query, [{"args": [func, args], "task_id": …}, …].
+        The tasks of the current job are handed out first; up to max_tasks
+        are taken from the following jobs (prefetch of a pipelined client)."""
+        tasks = []
+        with self._lock:
+            now = self.clock()
+            lost = self._expire(now)
+            while len(tasks) < max_tasks:
+                job = self._current
+                if job is None or job.next_index >= len(job.tasks):
+                    job = self._current = self._pick(now)
+                    if job is None:
+                        break
+                    job.experiment.queue.popleft()
+                    job.attempts += 1
+                    METRICS.observe("sched_queue_wait_seconds", now - job.submitted,
+                                    experiment=job.experiment.name)
+                    METRICS.set("sched_queued_jobs", len(job.experiment.queue),
+                                experiment=job.experiment.name)
+                func_name, func_args = job.tasks[job.next_index]
+                task_id = next(self._task_ids)
+                self._in_flight[task_id] = (job, job.next_index, now)
+                job.next_index += 1
+                tasks.append({"args": [func_name, func_args], "task_id": task_id})
+        self._fail(lost)
+        return tasks
+
+    def expire(self):
+        """Take back the tasks without a response now (also done on every query,
+        call it when the bench client may have stopped querying)."""
+        with self._lock:
+            lost = self._expire(self.clock())
+        self._fail(lost)
+
+    @staticmethod
+    def _fail(jobs: list[Job]):
+        for job in jobs:
+            job.future.set_exception(TaskLost(
+                f"job of {job.experiment.name} got no response in {job.attempts} attempts"))
+
+    def _expire(self, now: float) -> list[Job]:
+        """Take back the tasks without a response for task_timeout (lock held).
+        Their jobs are queued again from the start, the ones out of attempts
+        are returned, to be failed outside the lock."""
+        if self.task_timeout is None:
+            return []
+        expired = {id(job): job for job, _, t in self._in_flight.values()
+                   if now - t > self.task_timeout}
+        lost = []
+        for job in expired.values():
+            for task_id in [tid for tid, entry in self._in_flight.items() if entry[0] is job]:
+                del self._in_flight[task_id]
+            if self._current is job:
+                self._current = None
+            METRICS.inc("sched_expired_jobs_total", experiment=job.experiment.name)
+            if job.attempts >= self.max_attempts:
+                lost.append(job)
+                continue
+            job.results.clear()
+            job.next_index = 0
+            job.experiment.queue.appendleft(job)
+        return lost
+
+    def complete(self, task_id: int, result: Any) -> bool:
+        """Record the result of a task; False for an unknown (duplicate) task_id."""
+        with self._lock:
+            entry = self._in_flight.pop(task_id, None)
+            if entry is None:
+                return False
+            job, index, t_dispatch = entry
+            now = self.clock()
+            # one task at a time on the bench: it started when it was handed
+            # out or when the previous task finished, whichever is later
+            busy = max(0.0, now - max(t_dispatch, self._last_response))
+            self._last_response = now
+            exp = job.experiment
+            exp.busy_seconds += busy
+            exp.vtime += busy / exp.weight
+            exp.tasks_done += 1
+            METRICS.inc("sched_bench_seconds_total", busy, experiment=exp.name)
+            METRICS.inc("sched_tasks_total", experiment=exp.name)
+            job.results.append((index, result))
+            done = len(job.results) == len(job.tasks)
+            if done:
+                exp.jobs_done += 1
+        if done:
+            job.future.set_result([r for _, r in sorted(job.results, key=lambda r: r[0])])
+        return True
+
+    # ------------------------------------------------------------------
+    # Reporting
+    # ------------------------------------------------------------------
+    def utilization(self) -> dict[str, dict[str, Any]]:
+        """Bench time per experiment, absolute and as a share of the wall time
+        since the scheduler started and of the total busy time."""
+        with self._lock:
+            wall = max(self.clock() - self.started, 1e-9)
+            busy = sum(exp.busy_seconds for exp in self.experiments.values())
+            report = {}
+            for exp in self.experiments.values():
+                report[exp.name] = {
+                    "weight": exp.weight, "priority": exp.priority, "latency": exp.latency,
+                    "queued_jobs": len(exp.queue), "jobs_done": exp.jobs_done,
+                    "tasks_done": exp.tasks_done, "busy_seconds": exp.busy_seconds,
+                    "utilization": exp.busy_seconds / wall,
+                    "share": exp.busy_seconds / busy if busy else 0.0,
+                }
+                METRICS.set("sched_utilization", exp.busy_seconds / wall, experiment=exp.name)
+            return report
+
+
+# ──────────────────────────────────────────────────────────────────────────
+#  Experiment side
+# ──────────────────────────────────────────────────────────────────────────
+class SchedulerClient:
+    def __init__(self, url: str, experiment: str, weight: float = 1.0,
+                 priority: int = 0, latency: str = "batch", poll_timeout: float = 10.0,
+                 job_timeout: float | None = 300.0):
+        """Submit jobs of one experiment to a shared bench server (server.py)
+        at url, e.g. "http://127.0.0.1:9400/rpc". fetch() gives up on a job
+        after job_timeout seconds (None waits forever)."""
+        import requests
+        self.url = url
+        self.experiment = experiment
+        self.poll_timeout = poll_timeout
+        self.job_timeout = job_timeout
+        self.session = requests.Session()
+        self._post("register", weight=weight, priority=priority, latency=latency)
+
+    def _post(self, action: str, http_timeout: float = 10.0, **kw) -> dict:
+        resp = self.session.post(self.url, json={"action": action, "experiment": self.experiment, **kw},
+                                 timeout=http_timeout)
+        resp.raise_for_status()
+        return resp.json()
+
+    def submit(self, tasks: list) -> int:
+        return self._post("submit", tasks=[list(t) for t in tasks])["job_id"]
+
+    def fetch(self, job_id: int) -> list:
+        """Block until the job is done (long polls), return its results.
+        Raises TaskLost if the server failed the job, TimeoutError after
+        job_timeout."""
+        deadline = None if self.job_timeout is None else time.monotonic() + self.job_timeout
+        while True:
+            poll = self.poll_timeout
+            if deadline is not None:
+                poll = min(poll, deadline - time.monotonic())
+                if poll <= 0:
+                    raise TimeoutError(f"job {job_id} not done in {self.job_timeout} s")
+            reply = self._post("fetch", http_timeout=poll + 10.0, job_id=job_id, timeout=poll)
+            status = reply.get("status")
+            if status == "done":
+                return reply["results"]
+            if status == "failed":
+                raise TaskLost(reply.get("error", f"job {job_id} failed"))
+
+    def run(self, tasks: list) -> list:
+        return self.fetch(self.submit(tasks))
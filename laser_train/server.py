@@ -3,69 +3,168 @@ Simple task‑server that speaks the 2‑action protocol:
 
 - It waits for POST /rpc json={"action": "..."}
 - Replies with {"action": "wait", "args": [seconds]}
-  or     with {"action": "execute", "args": [func_name, func_args]}
+  or     with {"action": "execute", "args": [func_name, func_args], "task_id": …}
+
+The bench is shared by several experiments through the fair-share
+scheduler (scheduler.py). Experiments talk to the same endpoint:
+
+- {"action": "register", "experiment": name, "weight": 1, "priority": 0,
+   "latency": "batch"|"interactive"}
+- {"action": "submit", "experiment": name, "tasks": [[func_name, func_args], …]}
+  → {"job_id": …}; the tasks run back to back on the bench
+- {"action": "fetch", "job_id": …, "timeout": seconds}
+  → {"status": "pending"}, {"status": "done", "results": [...]}
+    or {"status": "failed", "error": …} (no response from the bench, see
+    BenchScheduler.task_timeout)
+
+Finished jobs nobody fetches are dropped after JOB_TTL seconds.
+
+GET /experiments reports the bench utilization per experiment.
 """
-from flask import Flask, request, jsonify
-import queue, threading, time
-import random
+from flask import Flask, request, jsonify, Response
+import itertools, threading, time
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from metrics import METRICS, CONTENT_TYPE
+from tracing import TRACER, now_us
+from tools import request_json
+from scheduler import BenchScheduler, TaskLost
 
 app = Flask(__name__)
 
-# --- demo state -------------------------------------------------------------
-WORK_QUEUE: "queue.Queue[tuple[str, list]]" = queue.Queue()
+# --- state ------------------------------------------------------------------
+SCHEDULER = BenchScheduler()
 DEFAULT_WAIT_SECONDS = 1                     # how long to tell idle clients to wait
+MAX_FETCH_TIMEOUT = 30                       # longest a fetch may block, seconds
+JOB_TTL = 600                                # finished jobs are kept this long for a fetch, seconds
+JOBS = {}                                    # job_id -> future of the submitted job
+JOBS_DONE = {}                               # job_id -> when its future finished
+JOB_IDS = itertools.count()
+JOBS_LOCK = threading.Lock()
 
 # preload a couple of demo jobs so the first client sees something to do
-#WORK_QUEUE.put(("send_mask", [1024]))
-WORK_QUEUE.put(("read_acf", ['']))
-#WORK_QUEUE.put(("send_mask", [500]))
-WORK_QUEUE.put(("read_acf", ['']))
-WORK_QUEUE.put(("read_acf", ['']))
-WORK_QUEUE.put(("read_acf", ['']))
-#WORK_QUEUE.put(("send_mask", [200]))
-#WORK_QUEUE.put(("send_mask", [1000]))
-#WORK_QUEUE.put(("send_mask", [50]))
+for _ in range(4):
+    SCHEDULER.submit("demo", [("read_acf", [''])])
 
 # --- helpers ----------------------------------------------------------------
-def next_job():
-    """Return ("execute", [func, args]) or ("wait", [n])."""
-    try:
-        func_name, func_args = WORK_QUEUE.get_nowait()
-        return "execute", [func_name, func_args]
-    except queue.Empty:
-        return "wait", [DEFAULT_WAIT_SECONDS]
+def next_job(max_tasks=1):
+    """Return the reply to a client query: execute, batch or wait."""
+    tasks = SCHEDULER.next_tasks(max_tasks)
+    METRICS.set("queue_depth", SCHEDULER.queued())
+    if not tasks:
+        return {"action": "wait", "args": [DEFAULT_WAIT_SECONDS]}
+    if max_tasks > 1:
+        return {"action": "batch", "tasks": tasks}
+    return {"action": "execute", **tasks[0]}
+
+def add_job(future):
+    """Register a submitted job, dropping the finished ones left unfetched."""
+    now = time.monotonic()
+    with JOBS_LOCK:
+        for job_id in [j for j, t in JOBS_DONE.items() if now - t > JOB_TTL]:
+            JOBS.pop(job_id, None)
+            JOBS_DONE.pop(job_id, None)
+        job_id = next(JOB_IDS)
+        JOBS[job_id] = future
+    future.add_done_callback(lambda f: finish_job(job_id))
+    return job_id
+
+def finish_job(job_id):
+    with JOBS_LOCK:
+        if job_id in JOBS:
+            JOBS_DONE[job_id] = time.monotonic()
+
+def pop_job(job_id):
+    with JOBS_LOCK:
+        JOBS_DONE.pop(job_id, None)
+        return JOBS.pop(job_id, None)
+
+def traced_reply(payload, t_recv):
+    """jsonify the reply, adding the server timestamps when tracing is on."""
+    if TRACER.enabled:
+        payload["server_time"] = [t_recv, now_us()]
+    return jsonify(payload)
 
 # --- HTTP endpoint ----------------------------------------------------------
 @app.post("/rpc")
 def rpc():
-    data = request.get_json(force=True) or {}
+    t_recv = now_us()
+    data = request_json(request) or {}
     action = data.get("action")
+    METRICS.inc("rpc_requests_total", action=str(action))
 
     if action == "query":
-        kind, args = next_job()
-        if args[0] == "send_mask":
-            args[1] = [random.randint(0, args[1]) for _ in range(20)]
-        res =  jsonify({"action": kind, "args": args})
-        return res
+        return traced_reply(next_job(int(data.get("max_tasks", 1))), t_recv)
 
     elif action == "response":
-        # demo: just log the result that came back
         res = data.get("result")
-        #app.logger.info("Client response received: %s", res)
-        #print("Client response received: %s", res)
-        print ('Result', type(res), len(res[0]), len(res[1]))
+        METRICS.record_client(data.get("timings"), data.get("counts"))
+        trace = data.get("trace")
+        if trace:
+            TRACER.merge(trace["events"], trace.get("offset_us", 0.0))
+        task_id = data.get("task_id")
+        if task_id is None or not SCHEDULER.complete(task_id, res):
+            METRICS.inc("duplicate_responses_total")
+        TRACER.complete("rpc.response", t_recv, now_us() - t_recv, trace_id=task_id)
+        if not data.get("next", True):
+            return traced_reply({"action": "wait", "args": [DEFAULT_WAIT_SECONDS]}, t_recv)
         # immediately decide what to do next
-        kind, args = next_job()
-        if args[0] == "send_mask":
-            args[1] = [random.randint(0, 1023) for _ in range(20)]
-        res =  jsonify({"action": kind, "args": args})
-        return res
+        return traced_reply(next_job(), t_recv)
+
+    elif action == "register":
+        try:
+            SCHEDULER.register(data["experiment"], data.get("weight", 1.0),
+                               data.get("priority", 0), data.get("latency", "batch"))
+        except (KeyError, ValueError) as err:
+            return jsonify({"error": str(err)}), 400
+        return jsonify({"ok": True})
+
+    elif action == "submit":
+        try:
+            future = SCHEDULER.submit(data["experiment"], data["tasks"])
+        except (KeyError, ValueError) as err:
+            return jsonify({"error": str(err)}), 400
+        return jsonify({"job_id": add_job(future)})
+
+    elif action == "fetch":
+        with JOBS_LOCK:
+            future = JOBS.get(data.get("job_id"))
+        if future is None:
+            return jsonify({"error": "unknown job_id"}), 404
+        SCHEDULER.expire()
+        try:
+            # long poll: block the (threaded) request until done or timeout
+            results = future.result(min(float(data.get("timeout", 0)), MAX_FETCH_TIMEOUT))
+        except TaskLost as err:
+            pop_job(data.get("job_id"))
+            return jsonify({"status": "failed", "error": str(err)})
+        except FutureTimeout:
+            return jsonify({"status": "pending"})
+        pop_job(data.get("job_id"))
+        return jsonify({"status": "done", "results": results})
 
     else:
         return jsonify({"error": "unknown action"}), 400
 
 
+@app.get("/experiments")
+def experiments():
+    return jsonify(SCHEDULER.utilization())
+
+
+@app.get("/metrics")
+def metrics():
+    METRICS.set("queue_depth", SCHEDULER.queued())
+    SCHEDULER.utilization()
+    return Response(METRICS.render(), mimetype=CONTENT_TYPE)
+
+
+@app.get("/trace")
+def trace():
+    return jsonify(TRACER.to_chrome())
+
+
 # --- run it -----------------------------------------------------------------
-if __name__ == "__main__":  
-    # threaded=False means one request at a time – fine for a toy demo
-    app.run(host="0.0.0.0", port=9400, threaded=False)
+if __name__ == "__main__":
+    # threaded: fetch long-polls while the bench client keeps polling
+    app.run(host="0.0.0.0", port=9400, threaded=True)
@@ -6,6 +6,9 @@ May 2, 2025
 
 import os
 import sys
+import gzip
+import json
+import zlib
 import argparse
 import pathlib
 import yaml
@@ -146,6 +149,16 @@ def log_args_to_tensorboard(logger, args):
     logger.experiment.add_text("Hyperparameters", formatted_hparams, global_step=0)
 
 
+def request_json(request):
+    """JSON body of a flask request, gzip/deflate compressed bodies are decompressed."""
+    encoding = request.headers.get("Content-Encoding", "").lower()
+    if encoding == "gzip":
+        return json.loads(gzip.decompress(request.get_data()))
+    if encoding == "deflate":
+        return json.loads(zlib.decompress(request.get_data()))
+    return request.get_json(force=True)
+
+
 def json_safe(x):
     """Recursively convert numpy types → native Python types."""
     if isinstance(x, np.ndarray):
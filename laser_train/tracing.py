@@ -0,0 +1,125 @@
+"""
+Opt-in tracing of the step pipeline (trainer, RPC server and lab client).
+
+Every task is tagged with a trace id (its task_id). Spans are recorded as
+Chrome-trace "complete" events into a bounded in-memory ring and can be
+dumped as JSON readable by chrome://tracing or https://ui.perfetto.dev.
+
+The client ships its events piggy-backed on the responses, together with
+its clock offset estimated NTP-style from the server timestamps in the
+replies (see ClockSync), so both machines end up on one timeline.
+
+Tracing is enabled with the LASER_TRACE=1 environment variable or
+TRACER.enable().
+"""
+from __future__ import annotations
+import os, json, threading, time
+from collections import deque
+from contextlib import contextmanager
+
+
+def now_us() -> float:
+    """Wall clock in microseconds (comparable between machines after offset correction)."""
+    return time.time_ns() / 1000
+
+
+class Tracer:
+    def __init__(self, process_name: str | None = None, capacity: int = 100_000,
+                 enabled: bool = False):
+        self.enabled = enabled
+        self.pid = os.getpid()
+        self.process_name = process_name or f"pid {self.pid}"
+        self._events: "deque[dict]" = deque(maxlen=capacity)
+        self._named: set = set()
+        self._lock = threading.Lock()
+
+    def enable(self, process_name: str | None = None):
+        self.enabled = True
+        if process_name:
+            self.process_name = process_name
+
+    def _meta(self, pid, tid, process_name):
+        """Add process/thread name events the first time a thread is seen."""
+        if (pid, tid) in self._named:
+            return
+        self._named.add((pid, tid))
+        self._events.append({"name": "process_name", "ph": "M", "pid": pid, "tid": tid,
+                             "args": {"name": process_name}})
+        self._events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                             "args": {"name": threading.current_thread().name}})
+
+    def complete(self, name: str, ts: float, dur: float, trace_id=None, **args):
+        """Record a span that started at ts (µs) and took dur (µs)."""
+        if not self.enabled:
+            return
+        tid = threading.get_ident()
+        if trace_id is not None:
+            args["trace_id"] = trace_id
+        with self._lock:
+            self._meta(self.pid, tid, self.process_name)
+            self._events.append({"name": name, "ph": "X", "ts": ts, "dur": dur,
+                                 "pid": self.pid, "tid": tid, "args": args})
+
+    @contextmanager
+    def span(self, name: str, trace_id=None, **args):
+        if not self.enabled:
+            yield
+            return
+        t0 = now_us()
+        try:
+            yield
+        finally:
+            self.complete(name, t0, now_us() - t0, trace_id, **args)
+
+    def take(self) -> list:
+        """Return and clear the recorded events (used by the client)."""
+        with self._lock:
+            events = list(self._events)
+            self._events.clear()
+            self._named.clear()
+        return events
+
+    def merge(self, events: list, offset_us: float = 0.0):
+        """Add events recorded on another machine, shifting them by its clock offset."""
+        with self._lock:
+            for event in events:
+                event = dict(event)
+                if "ts" in event:
+                    event["ts"] += offset_us
+                self._events.append(event)
+
+    def to_chrome(self) -> dict:
+        with self._lock:
+            events = list(self._events)
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def dump(self, path: str):
+        """Write the merged timeline as Chrome-trace/Perfetto JSON."""
+        with open(path, "w") as f:
+            json.dump(self.to_chrome(), f)
+
+
+class ClockSync:
+    """Estimate the offset between the local clock and the server clock.
+
+    Every round trip gives t0 (local send), t1 (server receive), t2 (server
+    reply) and t3 (local receive). The sample with the shortest network delay
+    among the last `window` ones is the most accurate, its offset is used.
+    """
+    def __init__(self, window: int = 32):
+        self._samples: "deque[tuple[float, float]]" = deque(maxlen=window)
+
+    def add(self, t0: float, t1: float, t2: float, t3: float):
+        delay = (t3 - t0) - (t2 - t1)
+        offset = ((t1 - t0) + (t2 - t3)) / 2
+        self._samples.append((delay, offset))
+
+    @property
+    def offset_us(self) -> float:
+        """Server clock minus local clock, µs."""
+        if not self._samples:
+            return 0.0
+        return min(self._samples)[1]
+
+
+TRACER = Tracer(enabled=os.environ.get("LASER_TRACE") == "1")
@@ -0,0 +1,81 @@
+"""Drift baseline and normalization of laser/drift.py."""
+import pathlib
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent / "laser"))
+from drift import DriftTracker
+from simulator import SimulatedLaser
+
+
+class Clock:
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self):
+        return self.t
+
+
+def test_multiplicative_baseline_is_interpolated():
+    tracker = DriftTracker(np.zeros((2, 4)))
+    tracker.record([10.0, 20.0], t=0.0)
+    tracker.record([12.0, 24.0], t=10.0)
+    assert tracker.baseline(5.0) == pytest.approx(1.1)
+    assert tracker.baseline(20.0) == pytest.approx(1.2)      # held after the last round
+    np.testing.assert_allclose(tracker.normalize([11.0, 12.0], [5.0, 10.0]), [10.0, 10.0])
+
+
+def test_additive_baseline():
+    tracker = DriftTracker(np.zeros((1, 4)), mode="additive")
+    tracker.record([5.0], t=0.0)
+    tracker.record([7.0], t=4.0)
+    assert tracker.normalize(8.0, 2.0) == pytest.approx(7.0)
+
+
+def test_no_rounds_is_neutral():
+    tracker = DriftTracker(np.zeros((1, 4)))
+    assert tracker.normalize(3.0, 1.0) == 3.0
+    assert tracker.due(0)
+
+
+def test_due_by_evaluations_and_time():
+    clock = Clock()
+    tracker = DriftTracker(np.zeros((1, 4)), every=10, every_s=60, clock=clock)
+    tracker.record([1.0], n_evals=0)
+    assert not tracker.due(9)
+    assert tracker.due(10)
+    clock.t = 61
+    assert tracker.due(0)
+
+
+def test_rejects_zero_and_non_finite_references():
+    tracker = DriftTracker(np.zeros((2, 4)))
+    with pytest.raises(ValueError):
+        tracker.record([0.0, 1.0])
+    with pytest.raises(ValueError):
+        tracker.record([np.nan, 1.0])
+    DriftTracker(np.zeros((2, 4)), mode="additive").record([0.0, 1.0])
+
+
+def test_compensates_a_drifting_simulator():
+    laser = SimulatedLaser(seed=0, noise=0.002)
+    clock = Clock()
+    factor = lambda t: 1.0 + 0.01 * t                    # 1 % per time unit
+
+    def measure(vec):
+        return laser.objective(vec) * factor(clock.t)
+
+    rng = np.random.default_rng(0)
+    tracker = DriftTracker(rng.integers(0, 1024, (3, 10)), clock=clock)
+    mask = rng.integers(0, 1024, 10)
+    first = measure(mask)
+    normalized = []
+    for t in range(0, 41, 10):
+        clock.t = t
+        tracker.measure(measure)
+        normalized.append(tracker.normalize(measure(mask), clock.t))
+    assert measure(mask) > 1.3 * first                    # the raw value drifted by 40 %
+    np.testing.assert_allclose(normalized, first, rtol=0.03)
+    assert tracker.stats()["rounds"] == 5
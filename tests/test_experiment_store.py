@@ -0,0 +1,118 @@
+"""Round trip, flushing and crash safety of laser/experiment_store.py."""
+import os
+import pathlib
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent / "laser"))
+import cs
+from drift import DriftTracker
+from experiment_store import ExperimentStore
+from simulator import SimulatedLaser
+
+
+def test_round_trip_in_chunks(tmp_path):
+    store = ExperimentStore(str(tmp_path), chunk_size=4)
+    for i in range(10):
+        store.append("evals", vec=np.full(3, i, dtype=np.int16), fitness=float(i))
+    assert store.n_segments("evals") == 2
+    assert len(store.buffered("evals")) == 2
+    assert len(store) == 8                              # only the flushed records are committed
+    store.flush()
+    records = ExperimentStore(str(tmp_path)).load("evals")
+    np.testing.assert_array_equal(records["fitness"], np.arange(10))
+    np.testing.assert_array_equal(records["vec"][:, 0], np.arange(10))
+    assert ExperimentStore(str(tmp_path)).load("evals", columns=["vec"]).keys() == {"vec"}
+
+
+def test_reopened_store_appends_after_the_last_segment(tmp_path):
+    store = ExperimentStore(str(tmp_path), chunk_size=2)
+    for i in range(4):
+        store.append("evals", fitness=float(i))
+    reopened = ExperimentStore(str(tmp_path), chunk_size=2)
+    for i in range(4, 6):
+        reopened.append("evals", fitness=float(i))
+    assert reopened.n_segments("evals") == 3
+    np.testing.assert_array_equal(reopened.load("evals")["fitness"], np.arange(6))
+
+
+def test_columns_must_match(tmp_path):
+    store = ExperimentStore(str(tmp_path))
+    store.append("evals", fitness=1.0)
+    with pytest.raises(ValueError):
+        store.append("evals", fwhm=1.0)
+
+
+def test_crash_loses_only_the_unflushed_records(tmp_path):
+    store = ExperimentStore(str(tmp_path), chunk_size=2)
+    for i in range(3):
+        store.append("evals", fitness=float(i))
+    # a segment that was being written when the process died
+    partial = tmp_path / "evals" / "seg_000001.tmp"
+    partial.mkdir()
+    (partial / "fitness.npy").write_bytes(b"\x93NUMPY truncated")
+    del store
+
+    recovered = ExperimentStore(str(tmp_path), chunk_size=2)
+    np.testing.assert_array_equal(recovered.load("evals")["fitness"], [0.0, 1.0])
+    recovered.append("evals", fitness=2.0)
+    recovered.append("evals", fitness=3.0)             # overwrites the leftover segment
+    assert not partial.exists()
+    np.testing.assert_array_equal(recovered.load("evals")["fitness"], [0.0, 1.0, 2.0, 3.0])
+
+
+def test_arrays_and_checkpoint(tmp_path):
+    store = ExperimentStore(str(tmp_path))
+    assert store.load_checkpoint() is None
+    assert not store.has_array("delay")
+    store.save_array("delay", np.linspace(-1, 1, 5))
+    np.testing.assert_array_equal(store.load_array("delay"), np.linspace(-1, 1, 5))
+
+    store.append("evals", fitness=1.0)
+    store.checkpoint(iteration=3, mem=np.arange(6).reshape(2, 3))
+    assert store.buffered("evals") == []                # the checkpoint flushes the records
+    state = ExperimentStore(str(tmp_path)).load_checkpoint()
+    assert int(state["iteration"]) == 3
+    np.testing.assert_array_equal(state["mem"], np.arange(6).reshape(2, 3))
+    assert not os.path.exists(tmp_path / "checkpoint.npz.tmp")
+
+
+def test_records_simulator_evaluations(tmp_path):
+    laser = SimulatedLaser(seed=0, noise=0.0)
+    store = ExperimentStore(str(tmp_path), chunk_size=4)
+    vecs = np.random.default_rng(0).integers(0, 1024, (5, 10))
+    fitness = [cs.objective(laser, laser.scan_range, v, 10, store=store) for v in vecs]
+    store.flush()
+
+    records = store.load("evals")
+    np.testing.assert_array_equal(records["vec"], vecs)
+    np.testing.assert_allclose(records["fitness"], fitness)
+    assert records["acf"].shape[0] == 5
+    assert store.load_array("evals_delay").shape == records["acf"].shape[1:]
+
+
+class HalvingTracker(DriftTracker):
+    """Baseline of 2 throughout, the normalized fitness is half the measured one."""
+
+    def normalize(self, values, t):
+        return np.asarray(values, dtype=float) / 2
+
+
+def test_crow_search_checkpoints_raw_fitness_and_resumes(tmp_path):
+    laser = SimulatedLaser(seed=0, noise=0.0)
+    store = ExperimentStore(str(tmp_path), chunk_size=8)
+    references = np.random.default_rng(1).integers(0, 1024, (2, 10))
+    np.random.seed(0)
+    _, _, fitness_list = cs.crow_search(10, 6, 0.1, 2, 3, 0, 1023, laser, laser.scan_range, store=store,
+                                        drift=HalvingTracker(references))
+    state = store.load_checkpoint()
+    assert int(state["iteration"]) == 2
+    np.testing.assert_allclose(state["fit_mem"], [laser.objective(m) for m in state["mem"]])
+
+    _, _, resumed = cs.crow_search(10, 6, 0.1, 2, 5, 0, 1023, laser, laser.scan_range, store=store, resume=True,
+                                   drift=HalvingTracker(references))
+    assert resumed[:3] == fitness_list
+    assert len(resumed) == 5
+    assert int(store.load_checkpoint()["iteration"]) == 4
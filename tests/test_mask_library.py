@@ -0,0 +1,74 @@
+"""Index, lookups and the crow search warm start of laser/mask_library.py."""
+import pathlib
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent / "laser"))
+import cs
+from mask_library import MaskLibrary
+from simulator import SimulatedLaser
+
+
+def filled_library(path, chunk_size=4):
+    library = MaskLibrary(str(path), chunk_size=chunk_size)
+    vecs = np.array([[0, 0], [100, 100], [1000, 1000], [500, 500], [100, 100], [10, 1020]])
+    library.add(2, vecs, [5.0, 1.0, 3.0, 4.0, 1.5, np.inf])
+    return library, vecs
+
+
+def test_index_covers_segments_and_buffer(tmp_path):
+    library, vecs = filled_library(tmp_path)
+    stored, fitness, order = library.index(2)
+    assert library.store.n_segments(library.table(2)) == 1
+    assert len(stored) == 5                         # the infinite fitness is not kept
+    np.testing.assert_array_equal(stored, vecs[:5])
+    np.testing.assert_array_equal(fitness[order], [1.0, 1.5, 3.0, 4.0, 5.0])
+
+    library.add(2, [[7, 7]], [0.5])
+    stored, fitness, order = library.index(2)
+    assert len(stored) == 6 and fitness[order[0]] == 0.5
+    library.close()
+    reopened = MaskLibrary(str(tmp_path))
+    assert len(reopened.index(2)[0]) == 6
+    assert len(reopened.index(2, bench_id="other")[0]) == 0
+    assert len(reopened.index(3)[0]) == 0
+
+
+def test_top_k_skips_repeated_masks(tmp_path):
+    library, _ = filled_library(tmp_path)
+    vecs, fitness = library.top_k(2, 3)
+    np.testing.assert_array_equal(vecs, [[100, 100], [1000, 1000], [500, 500]])
+    np.testing.assert_array_equal(fitness, [1.0, 3.0, 4.0])
+    np.testing.assert_array_equal(library.top_k(2, 2, unique=False)[1], [1.0, 1.5])
+
+
+def test_nearest_uses_the_wrapped_phase_distance(tmp_path):
+    library, _ = filled_library(tmp_path)
+    vecs, _, dist = library.nearest(2, [1020, 1020], k=2)
+    np.testing.assert_array_equal(vecs, [[0, 0], [1000, 1000]])     # 0 is 4 away across the wrap
+    np.testing.assert_allclose(dist, [np.hypot(4, 4), np.hypot(20, 20)])
+    assert MaskLibrary.distance([[0, 0]], [1020, 1020], kind="fourier")[0] == pytest.approx(np.hypot(1020, 1020))
+
+
+def test_seeds_are_best_and_diverse(tmp_path):
+    library, _ = filled_library(tmp_path)
+    seeds = library.seeds(2, 2)
+    np.testing.assert_array_equal(seeds, [[100, 100], [500, 500]])    # the farthest from the best
+    np.testing.assert_array_equal(library.seeds(2, 3, min_distance=150), [[100, 100], [1000, 1000], [500, 500]])
+    np.testing.assert_array_equal(library.seeds(2, 3, min_distance=200), [[100, 100], [500, 500]])
+    assert len(MaskLibrary(str(tmp_path / "empty")).seeds(2, 4)) == 0
+
+
+def test_crow_search_warm_starts_from_the_library(tmp_path):
+    laser = SimulatedLaser(seed=0, noise=0.0)
+    library = MaskLibrary(str(tmp_path))
+    np.random.seed(0)
+    first, _, _ = cs.crow_search(10, 8, 0.1, 2, 3, 0, 1023, laser, laser.scan_range, library=library)
+    assert library.top_k(10, 1)[1][0] == pytest.approx(first)
+    assert len(library.index(10)[0]) == 8 * 4          # the initial flock and every generation
+
+    np.random.seed(1)
+    _, _, fitness_list = cs.crow_search(10, 8, 0.1, 2, 1, 0, 1023, laser, laser.scan_range, library=library)
+    assert fitness_list[0] <= first                    # the best mask is a seed of the new flock
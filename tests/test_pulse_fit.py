@@ -0,0 +1,84 @@
+"""Known traces through laser/pulse_fit.py and the FWHM fallback of calc_pulse_qual."""
+import pathlib
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent / "laser"))
+import data_processing as data
+import pulse_fit
+
+DELAY = np.linspace(-5, 5, 2001)         # ps
+
+
+def trace(shape, width, centre=0.0, amplitude=1.0, offset=0.05, noise=0.0, seed=0):
+    clean = pulse_fit.model(DELAY, [amplitude, width, centre, offset], shape)[0]
+    return clean + noise * np.random.default_rng(seed).standard_normal(len(DELAY))
+
+
+@pytest.mark.parametrize("shape", ["sech2", "gaussian"])
+def test_fit_recovers_width_and_fwhm(shape):
+    width = 0.4
+    result = pulse_fit.fit(DELAY, trace(shape, width, centre=0.3, noise=0.01), shape)
+    assert result.converged[0]
+    assert result.params[0, 1] == pytest.approx(width, rel=0.01)
+    assert result.params[0, 2] == pytest.approx(0.3, abs=0.005)
+    assert result.fwhm[0] == pytest.approx(pulse_fit.FWHM_FACTOR[shape] * width, rel=0.01)
+    assert result.pulse_fwhm[0] == pytest.approx(result.fwhm[0] / pulse_fit.DECONVOLUTION[shape])
+    assert 0 < result.fwhm_err[0] < 0.01 * result.fwhm[0]
+
+
+def test_fit_stack_of_widths():
+    widths = np.array([0.2, 0.35, 0.5, 0.8])
+    acfs = np.stack([trace("sech2", w, noise=0.005, seed=i) for i, w in enumerate(widths)])
+    result = pulse_fit.fit(DELAY, acfs, "sech2")
+    np.testing.assert_allclose(result.params[:, 1], widths, rtol=0.01)
+
+
+@pytest.mark.parametrize("shape", ["sech2", "gaussian"])
+def test_fwhm_interp_is_sub_sample(shape):
+    width = 0.4
+    step = DELAY[1] - DELAY[0]
+    fwhm = pulse_fit.fwhm_interp(DELAY, trace(shape, width, offset=0.0))[0]
+    assert fwhm == pytest.approx(pulse_fit.FWHM_FACTOR[shape] * width, abs=0.05 * step)
+
+
+def test_flat_trace_has_no_fwhm():
+    assert np.isnan(pulse_fit.fwhm_interp(DELAY, np.ones_like(DELAY))[0])
+    assert pulse_fit.fit(DELAY, np.ones_like(DELAY)).fwhm.shape == (1,)
+
+
+def test_single_flank_falls_back_to_nearest():
+    # the peak sits near the right edge, the right flank never gets below half
+    acf = trace("sech2", 0.4, centre=4.9, offset=0.0)
+    assert np.isnan(pulse_fit.fwhm_interp(DELAY, acf)[0])
+    interp = data.calc_pulse_qual(acf.copy(), DELAY.copy(), 10, fwhm_method="interp")
+    nearest = data.calc_pulse_qual(acf.copy(), DELAY.copy(), 10, fwhm_method="nearest")
+    assert np.isfinite(interp[0])
+    assert interp[0] == nearest[0]
+    assert interp[2] == nearest[2]
+
+
+def test_calc_pulse_qual_methods_agree_on_a_clean_trace():
+    acf = trace("sech2", 0.4, offset=0.0, noise=0.002)
+    fwhm = {method: data.calc_pulse_qual(acf.copy(), DELAY.copy(), 10, fwhm_method=method)[0]
+            for method in ("interp", "fit", "nearest")}
+    expected = pulse_fit.FWHM_FACTOR["sech2"] * 0.4 * 1000           # fs
+    assert fwhm["interp"] == pytest.approx(expected, rel=0.01)
+    assert fwhm["fit"] == pytest.approx(expected, rel=0.01)
+    assert fwhm["nearest"] == pytest.approx(expected, abs=2 * (DELAY[1] - DELAY[0]) * 1000)
+
+
+def test_fit_method_uses_the_fitted_trace():
+    acf = trace("sech2", 0.4, centre=0.2, offset=0.0, noise=0.002)
+    fwhm, fit, quality, area = data.calc_pulse_qual(acf.copy(), DELAY.copy(), 10, fwhm_method="fit")
+    normalized = (acf - acf.min()) / (acf.max() - acf.min())
+    assert np.abs(fit - normalized).max() < 0.02
+    assert quality == pytest.approx(fwhm, rel=0.01)     # the areas agree, no penalty
+
+
+def test_default_is_nearest():
+    acf = trace("sech2", 0.4, noise=0.002)
+    assert data.calc_pulse_qual(acf.copy(), DELAY.copy(), 10)[2] == \
+        data.calc_pulse_qual(acf.copy(), DELAY.copy(), 10, fwhm_method="nearest")[2]
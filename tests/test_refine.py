@@ -0,0 +1,73 @@
+"""Trust-region refinement of laser/refine.py on known quadratics and the simulator."""
+import pathlib
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent / "laser"))
+import refine
+from simulator import SimulatedLaser
+
+
+def quadratic(target, period=None):
+    """Batch evaluator of sum (x - target)^2, phase-wrapped with a period."""
+    calls = []
+
+    def evaluate(X):
+        diff = np.asarray(X, dtype=float) - target
+        if period is not None:
+            diff = np.mod(diff + period / 2, period) - period / 2
+        calls.append(len(X))
+        return (diff ** 2).sum(axis=1)
+    return evaluate, calls
+
+
+def test_wrapped_displacement_across_the_period():
+    assert refine.displacement([0], [1023])[0] == 1
+    assert refine.displacement([1023], [0])[0] == -1
+    assert refine.displacement([0], [1023], 0, 1024, wrap=False)[0] == -1023
+
+
+def test_quantize_wraps_and_clips():
+    np.testing.assert_array_equal(refine.quantize([-1, 1024, 511.6]), [1023, 0, 512])
+    np.testing.assert_array_equal(refine.quantize([-1, 1024], wrap=False), [0, 1023])
+
+
+def test_converges_on_a_quadratic():
+    target = np.array([300, 700, 100, 900, 512, 20])
+    evaluate, calls = quadratic(target, period=1024)
+    x0 = target + np.array([60, -50, 40, -30, 70, -20])
+    result = refine.refine(evaluate, x0, budget=120, rng=np.random.default_rng(0))
+    assert result.f0 == ((x0 - target) ** 2).sum()
+    assert result.fitness < 0.05 * result.f0
+    assert result.n_evals <= 120
+    assert sum(calls) == result.n_evals          # the cache never measures a mask twice
+
+
+def test_converges_across_the_wrap():
+    target = np.array([5, 1020, 3, 1018])
+    evaluate, _ = quadratic(target, period=1024)
+    x0 = np.array([1000, 20, 990, 30])                # the short way is across 1023 -> 0
+    result = refine.refine(evaluate, x0, budget=100, radius=16, rng=np.random.default_rng(1))
+    assert result.fitness < 0.05 * result.f0
+    assert np.all((result.x >= 0) & (result.x < 1024))
+
+
+def test_frozen_stripes_stay():
+    target = np.full(6, 500)
+    evaluate, _ = quadratic(target)
+    x0 = np.array([400, 600, 450, 550, 420, 580])
+    active = np.array([True, True, True, False, False, False])
+    result = refine.refine(evaluate, x0, budget=60, wrap=False, active=active, rng=np.random.default_rng(2))
+    np.testing.assert_array_equal(result.x[~active], x0[~active])
+    assert np.abs(result.x[active] - 500).sum() < np.abs(x0[active] - 500).sum()
+
+
+def test_improves_a_mask_on_the_simulator():
+    laser = SimulatedLaser(seed=0, noise=0.0)
+    evaluate = lambda X: [laser.objective(x) for x in X]
+    x0 = np.random.default_rng(3).integers(0, 1024, 10)
+    result = refine.refine(evaluate, x0, budget=40, rng=np.random.default_rng(3))
+    assert result.fitness < result.f0
+    assert laser.objective(result.x) == pytest.approx(result.fitness)
@@ -0,0 +1,99 @@
+"""Selection order and lost-task handling of laser_train/scheduler.py."""
+import pathlib
+import sys
+
+import pytest
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent / "laser_train"))
+from scheduler import BenchScheduler, TaskLost
+
+
+class Clock:
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self):
+        return self.t
+
+
+def make_scheduler(**kw):
+    clock = Clock()
+    return BenchScheduler(clock=clock, **kw), clock
+
+
+def run_one(sched, clock, seconds=1.0):
+    """Hand out one task and answer it after `seconds` of bench time."""
+    (task,) = sched.next_tasks()
+    clock.t += seconds
+    assert sched.complete(task["task_id"], task["args"][1])
+    return task["args"][1]
+
+
+def test_higher_priority_goes_first():
+    sched, clock = make_scheduler()
+    sched.register("low", priority=0)
+    sched.register("high", priority=1)
+    sched.submit("low", [("read_acf", "low")])
+    sched.submit("high", [("read_acf", "high")])
+    assert run_one(sched, clock) == "high"
+    assert run_one(sched, clock) == "low"
+
+
+def test_late_interactive_job_jumps_the_fair_queue():
+    sched, clock = make_scheduler()
+    sched.register("batch")
+    sched.register("rl", latency="interactive")
+    sched.submit("rl", [("read_acf", "rl-0")])
+    assert run_one(sched, clock, 1.0) == "rl-0"      # rl is ahead in virtual time now
+    sched.submit("batch", [("read_acf", "batch-0")])
+    sched.submit("rl", [("read_acf", "rl-1")])
+    assert run_one(sched, clock, 0.1) == "batch-0"  # fair queuing: batch has less service
+    sched.submit("batch", [("read_acf", "batch-1")])
+    clock.t += 1.0                                   # rl-1 waited past its 0.5 s target
+    assert run_one(sched, clock, 0.1) == "rl-1"
+
+
+def test_weighted_fair_shares():
+    sched, clock = make_scheduler()
+    sched.register("a", weight=2)
+    sched.register("b", weight=1)
+    for _ in range(100):
+        sched.submit("a", [("read_acf", "a")])
+        sched.submit("b", [("read_acf", "b")])
+    served = [run_one(sched, clock) for _ in range(90)]
+    assert served.count("a") == pytest.approx(60, abs=2)
+    share = sched.utilization()
+    assert share["a"]["share"] == pytest.approx(2 / 3, abs=0.03)
+
+
+def test_jobs_run_back_to_back():
+    sched, clock = make_scheduler()
+    sched.submit("a", [("send_mask", "a"), ("read_acf", "a")])
+    sched.submit("b", [("send_mask", "b"), ("read_acf", "b")])
+    order = [run_one(sched, clock) for _ in range(4)]
+    assert order in (["a", "a", "b", "b"], ["b", "b", "a", "a"])
+
+
+def test_lost_task_requeues_the_job_then_fails_it():
+    sched, clock = make_scheduler(task_timeout=5.0, max_attempts=2)
+    future = sched.submit("a", [("send_mask", 1), ("read_acf", "")])
+    first = sched.next_tasks(2)
+    clock.t += 10.0
+    retry = sched.next_tasks(2)                      # the whole job again, from its first task
+    assert [t["args"] for t in retry] == [t["args"] for t in first]
+    assert not sched.complete(first[0]["task_id"], "late")
+    clock.t += 10.0
+    sched.expire()
+    with pytest.raises(TaskLost):
+        future.result(0)
+    assert sched.next_tasks() == []
+
+
+def test_requeued_job_completes():
+    sched, clock = make_scheduler(task_timeout=5.0)
+    future = sched.submit("a", [("send_mask", 1), ("read_acf", "")])
+    sched.next_tasks()
+    clock.t += 10.0
+    for task in sched.next_tasks(2):
+        sched.complete(task["task_id"], task["args"][0])
+    assert future.result(0) == ["send_mask", "read_acf"]
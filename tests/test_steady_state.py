@@ -0,0 +1,81 @@
+"""Asynchronous steady-state crow search of laser/cs.py on simulated benches."""
+import pathlib
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parent.parent / "laser"))
+import cs
+from simulator import SimulatedLaser
+
+
+def benches(n, noise=0.0):
+    lasers = [SimulatedLaser(seed=0, noise=noise) for _ in range(n)]
+    return lasers, [cs.make_evaluator(laser, laser.scan_range, 10) for laser in lasers]
+
+
+def test_spends_the_budget_and_keeps_the_best():
+    lasers, evaluators = benches(3)
+    np.random.seed(0)
+    best, best_pos, fitness_list = cs.crow_search_steady_state(10, 6, 0.1, 2, 40, 0, 1023, evaluators)
+    assert len(fitness_list) == 40
+    assert np.all(np.diff(fitness_list) <= 0)
+    assert best == fitness_list[-1]
+    assert np.all((best_pos >= 0) & (best_pos <= 1023))
+    assert lasers[0].objective(best_pos) == pytest.approx(best)
+
+
+def test_concurrency_is_bounded_and_shared():
+    lasers, evaluators = benches(3)
+    lock = threading.Lock()
+    running, peak, used = [0], [0], set()
+
+    def tracked(i):
+        def evaluator(vec):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+                used.add(i)
+            time.sleep(0.005)
+            try:
+                return evaluators[i](vec)
+            finally:
+                with lock:
+                    running[0] -= 1
+        return evaluator
+
+    np.random.seed(1)
+    _, _, fitness_list = cs.crow_search_steady_state(10, 6, 0.1, 2, 24, 0, 1023,
+                                                     [tracked(i) for i in range(3)], max_in_flight=2)
+    assert len(fitness_list) == 24
+    assert peak[0] == 2
+    assert len(used) >= 2
+
+
+def test_failed_evaluations_do_not_stop_the_search():
+    laser = SimulatedLaser(seed=0, noise=0.0)
+    calls = [0]
+
+    def flaky(vec):
+        calls[0] += 1
+        if calls[0] % 4 == 0:
+            raise ConnectionError("bench went away")
+        return laser.objective(vec)
+
+    np.random.seed(2)
+    best, _, fitness_list = cs.crow_search_steady_state(10, 4, 0.1, 2, 20, 0, 1023, [flaky])
+    assert calls[0] == 20
+    assert np.isfinite(best)
+    assert len(fitness_list) == 20
+
+
+def test_seeds_start_the_flock():
+    _, evaluators = benches(2)
+    seed = np.random.default_rng(3).integers(0, 1024, (1, 10))
+    fitness = evaluators[0](seed[0])
+    np.random.seed(3)
+    best, _, _ = cs.crow_search_steady_state(10, 4, 0.1, 2, 8, 0, 1023, evaluators, seeds=seed)
+    assert best <= fitness